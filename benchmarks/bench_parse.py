@@ -0,0 +1,124 @@
+"""Time the parse of a synthetic city scale .object file
+
+Run from the repository root (or with rwimodeling installed) and compare the
+numbers between revisions:
+
+    python benchmarks/bench_parse.py --structures 20000
+
+--reference also times the parser of another git revision on the same file,
+e.g. the tell()/seek() parser before LineCursor:
+
+    python benchmarks/bench_parse.py --reference 0792eb1~
+
+bench_suite.py covers the other operations and stores the results.
+"""
+import argparse
+import io
+import os
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from rwimodeling.objects import ObjectFile
+
+
+def write_synthetic_object(path, n_structures):
+    """Write an .object file with n_structures boxes of 6 faces each"""
+    with open(path, 'w') as dst:
+        dst.write(ObjectFile._default_head)
+        dst.write('begin_<structure_group> city\n')
+        for i in range(n_structures):
+            x, y = (i % 100) * 20.0, (i // 100) * 20.0
+            dst.write('begin_<structure> building{}\n'.format(i))
+            dst.write('begin_<sub_structure> \n')
+            for j in range(6):
+                dst.write('begin_<face> f{}\n'.format(j))
+                dst.write('Material 0\n')
+                dst.write('nVertices 4\n')
+                for k in range(4):
+                    dst.write('{:.10f} {:.10f} {:.10f}\n'.format(
+                        x + k, y + j, 10.0 * (k % 2)))
+                dst.write('end_<face>\n')
+            dst.write('end_<sub_structure>\n')
+            dst.write('end_<structure>\n')
+        dst.write('end_<structure_group>\n')
+        dst.write(ObjectFile._default_tail)
+
+
+def best_of(repeat, func):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+# run by time_reference with the package of the reference revision
+REFERENCE_SCRIPT = """
+import sys, time
+sys.path.insert(0, sys.argv[1])
+from rwimodeling.objects import ObjectFile
+times = []
+for _ in range(int(sys.argv[3])):
+    start = time.perf_counter()
+    with open(sys.argv[2]) as infile:
+        ObjectFile.from_file(infile)
+    times.append(time.perf_counter() - start)
+print(min(times))
+"""
+
+
+def time_reference(revision, path, repeat, tmp_dir):
+    """Best time of ObjectFile.from_file of a git revision, in a new process"""
+    archive = subprocess.run(['git', '-C', ROOT, 'archive', revision, 'rwimodeling'],
+                             stdout=subprocess.PIPE, check=True).stdout
+    package_dir = os.path.join(tmp_dir, 'reference')
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(package_dir)
+    command = [sys.executable, '-c', REFERENCE_SCRIPT, package_dir, path, str(repeat)]
+    output = subprocess.run(command, stdout=subprocess.PIPE, check=True,
+                            universal_newlines=True).stdout
+    return float(output)
+
+
+def report(label, elapsed, n_faces, size):
+    print('{}{} faces ({:.1f} MB): {:.3f} s, {:.2f} us/face'.format(
+        label, n_faces, size / 1e6, elapsed, 1e6 * elapsed / n_faces))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--structures', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--reference', metavar='REVISION',
+                        help='git revision whose parser is also timed')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'city.object')
+        write_synthetic_object(path, args.structures)
+
+        def parse():
+            with open(path) as infile:
+                ObjectFile.from_file(infile)
+
+        elapsed = best_of(args.repeat, parse)
+        n_faces = 6 * args.structures
+        size = os.path.getsize(path)
+        if args.reference is None:
+            report('', elapsed, n_faces, size)
+            return
+        reference = time_reference(args.reference, path, args.repeat, tmp_dir)
+        report('{}: '.format(args.reference), reference, n_faces, size)
+        report('current: ', elapsed, n_faces, size)
+        print('speedup: {:.2f}x'.format(reference / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""Time and memory profile the main operations on synthetic scenes
+
+Each case runs on the scenes of scene.generate_scene at the selected scales.
+The time is the best of --repeat runs and the memory the peak traced by
+tracemalloc on a separate run. Save the results of a revision and compare
+another one with them:
+
+    python benchmarks/bench_suite.py --output base.json
+    (change the code)
+    python benchmarks/bench_suite.py --compare base.json
+
+The comparison exits with status 1 if a case got slower (or used more
+memory) than the tolerance allows.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from bench_parse import best_of
+from scene import generate_scene
+
+from rwimodeling.mimo import SetupFile
+from rwimodeling.objects import ObjectFile
+from rwimodeling.txrx import TxRxFile
+from rwimodeling.x3dxmlfile import X3dXmlFile
+
+try:
+    import shapely
+except ImportError:
+    shapely = None
+
+# (n_buildings, n_vehicles, n_receivers, n_mimo_elements)
+SCALES = {
+    'small': (100, 10, 1000, 16),
+    'medium': (1000, 100, 10000, 64),
+    'large': (5000, 500, 100000, 256),
+}
+
+_X3D_TEMPLATE = '<X3D><Scene><ControlPoints></ControlPoints></Scene></X3D>\n'
+
+
+def _parse(entity_type, path):
+    def parse():
+        with open(path) as infile:
+            entity_type.from_file(infile)
+    return parse
+
+
+def cases(scene, tmp_dir):
+    """(name, function) of the cases on a scene, the files are written in tmp_dir"""
+    paths = {}
+    for name, entity in (('city.object', scene.city), ('vehicles.object', scene.vehicles),
+                         ('model.txrx', scene.txrx), ('model.setup', scene.setup)):
+        paths[name] = os.path.join(tmp_dir, name)
+        entity.write(paths[name])
+    template = os.path.join(tmp_dir, 'template.xml')
+    with open(template, 'w') as outfile:
+        outfile.write(_X3D_TEMPLATE)
+    with open(paths['city.object']) as infile:
+        city = ObjectFile.from_file(infile)
+    receivers = scene.txrx['Rx'].location_list[0]
+
+    def add_vertice_list():
+        x3d = X3dXmlFile(template)
+        x3d.add_vertice_list(receivers, './/ControlPoints')
+
+    def as_polygon():
+        for structure in scene.city['city']:
+            for sub_structure in structure:
+                sub_structure.as_polygon()
+
+    yield 'parse_object', _parse(ObjectFile, paths['city.object'])
+    yield 'parse_vehicles', _parse(ObjectFile, paths['vehicles.object'])
+    yield 'parse_txrx', _parse(TxRxFile, paths['model.txrx'])
+    yield 'parse_setup', _parse(SetupFile, paths['model.setup'])
+    yield 'translate', lambda: city.translate((1.0, -1.0, 0.5))
+    yield 'rotate', lambda: city.rotate(1.0, pivot=(100.0, 100.0, 0.0))
+    yield 'serialize', city.serialize
+    yield 'write', lambda: city.write(os.path.join(tmp_dir, 'out.object'))
+    yield 'write_txrx', lambda: scene.txrx.write(os.path.join(tmp_dir, 'out.txrx'))
+    yield 'x3d_add_vertice_list', add_vertice_list
+    if shapely is not None:
+        yield 'as_polygon', as_polygon
+
+
+def peak_memory(func):
+    """Peak of the memory allocated while running func, in bytes"""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(scales, repeat, seed, selected=None):
+    """{'<case>/<scale>': {'seconds': ..., 'peak_bytes': ...}}"""
+    results = {}
+    for scale in scales:
+        scene = generate_scene(*SCALES[scale], seed=seed)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for name, func in cases(scene, tmp_dir):
+                if selected and name not in selected:
+                    continue
+                key = '{}/{}'.format(name, scale)
+                results[key] = {'seconds': best_of(repeat, func), 'peak_bytes': peak_memory(func)}
+                print('{:32} {:10.4f} s {:10.1f} MB'.format(
+                    key, results[key]['seconds'], results[key]['peak_bytes'] / 1e6))
+    return results
+
+
+def _revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True,
+                              cwd=os.path.dirname(os.path.realpath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# slowdowns smaller than this are taken as noise, whatever the ratio
+MIN_SLOWDOWN = 0.002
+
+
+def compare(baseline, results, tolerance, memory_tolerance):
+    """Print the ratios to the baseline, return the keys that regressed"""
+    regressions = []
+    for key in sorted(set(baseline) & set(results)):
+        old, new = baseline[key], results[key]
+        time_ratio = new['seconds'] / max(old['seconds'], 1e-9)
+        memory_ratio = new['peak_bytes'] / max(old['peak_bytes'], 1)
+        slower = (time_ratio > 1 + tolerance and
+                  new['seconds'] - old['seconds'] > MIN_SLOWDOWN)
+        regressed = slower or memory_ratio > 1 + memory_tolerance
+        if regressed:
+            regressions.append(key)
+        print('{:32} time x{:6.2f} memory x{:6.2f}{}'.format(
+            key, time_ratio, memory_ratio, '  REGRESSION' if regressed else ''))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', default='small,medium',
+                        help='comma separated, of {}'.format(', '.join(SCALES)))
+    parser.add_argument('--cases', default=None, help='comma separated, all by default')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='JSON file to store the results')
+    parser.add_argument('--compare', default=None, help='JSON file of a previous run')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative slowdown (default 0.2)')
+    parser.add_argument('--memory-tolerance', type=float, default=0.1,
+                        help='allowed relative memory increase (default 0.1)')
+    args = parser.parse_args()
+
+    scales = args.scales.split(',')
+    for scale in scales:
+        if scale not in SCALES:
+            parser.error('unknown scale "{}"'.format(scale))
+    selected = set(args.cases.split(',')) if args.cases else None
+    results = run(scales, args.repeat, args.seed, selected)
+
+    if args.output is not None:
+        meta = {'revision': _revision(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(), 'numpy': np.__version__,
+                'machine': platform.machine(), 'seed': args.seed, 'repeat': args.repeat}
+        with open(args.output, 'w') as outfile:
+            json.dump({'meta': meta, 'results': results}, outfile, indent=1, sort_keys=True)
+    if args.compare is not None:
+        with open(args.compare) as infile:
+            baseline = json.load(infile)['results']
+        if compare(baseline, results, args.tolerance, args.memory_tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Deterministic synthetic scenes for the benchmarks
+
+The same seed and sizes always give the same files, so timings of different
+revisions are comparable:
+
+    scene = generate_scene(n_buildings=1000, n_vehicles=100, n_receivers=10000,
+                           n_mimo_elements=64, seed=0)
+    scene.city.write('city.object')
+"""
+import collections
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from rwimodeling.mimo import SetupFile, ula_positions
+from rwimodeling.objects import ObjectFile, RectangularPrism, Structure, StructureGroup
+from rwimodeling.txrx import TxRxFile
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'example')
+
+# side of a city block (a building per block) and width of the streets
+BLOCK_SIZE = 40.0
+STREET_WIDTH = 10.0
+
+Scene = collections.namedtuple('Scene', ['city', 'vehicles', 'txrx', 'setup', 'extent'])
+
+
+def _city(rng, n_buildings):
+    n_columns = max(1, int(np.ceil(np.sqrt(n_buildings))))
+    pitch = BLOCK_SIZE + STREET_WIDTH
+    sizes = rng.uniform((10, 10, 6), (BLOCK_SIZE, BLOCK_SIZE, 80), (n_buildings, 3))
+    group = StructureGroup(name='city')
+    structures = []
+    for i, (length, width, height) in enumerate(sizes.tolist()):
+        building = RectangularPrism(length, width, height, material=0)
+        building.translate(((i % n_columns) * pitch, (i // n_columns) * pitch, 0))
+        structure = Structure(name='building{}'.format(i))
+        structure.add_sub_structures(building)
+        structures.append(structure)
+    group.add_structures(structures)
+    city = ObjectFile('city.object')
+    city.add_structure_groups(group)
+    extent = (n_columns * pitch, ((n_buildings - 1) // n_columns + 1) * pitch)
+    return city, extent
+
+
+def _vehicles(rng, n_vehicles, extent):
+    # on the streets along x, heading either way
+    n_streets = max(1, int(extent[1] // (BLOCK_SIZE + STREET_WIDTH)))
+    xs = rng.uniform(0, extent[0], n_vehicles)
+    streets = rng.integers(0, n_streets, n_vehicles)
+    headings = rng.choice((0, 180), n_vehicles)
+    group = StructureGroup(name='vehicles')
+    structures = []
+    for i in range(n_vehicles):
+        car = RectangularPrism(4.54, 1.76, 1.47, material=0)
+        car.rotate(headings[i])
+        car.translate((xs[i], streets[i] * (BLOCK_SIZE + STREET_WIDTH) + BLOCK_SIZE +
+                       STREET_WIDTH / 2, 0))
+        structure = Structure(name='car{}'.format(i))
+        structure.add_sub_structures(car)
+        structures.append(structure)
+    group.add_structures(structures)
+    vehicles = ObjectFile('vehicles.object')
+    vehicles.add_structure_groups(group)
+    return vehicles
+
+
+def generate_scene(n_buildings, n_vehicles=0, n_receivers=0, n_mimo_elements=0, seed=0):
+    """Synthetic scene
+
+    :param n_buildings: buildings (a RectangularPrism each) on a square
+        grid of blocks
+    :param n_vehicles: cars (RectangularPrism) on the streets
+    :param n_receivers: receivers at random points of the scene, replacing
+        the ones of example/model.txrx
+    :param n_mimo_elements: elements of the MIMO antenna of
+        example/model.setup (a ULA)
+    :return: Scene(city, vehicles, txrx, setup, extent), extent being the
+        (x, y) size of the scene
+    """
+    rng = np.random.default_rng(seed)
+    city, extent = _city(rng, n_buildings)
+    vehicles = _vehicles(rng, n_vehicles, extent)
+
+    with open(os.path.join(EXAMPLE_DIR, 'model.txrx')) as infile:
+        txrx = TxRxFile.from_file(infile)
+    receivers = txrx['Rx'].location_list[0]
+    receivers.clear()
+    if n_receivers > 0:
+        points = rng.uniform((0, 0, 1.5), (extent[0], extent[1], 1.5), (n_receivers, 3))
+        receivers.add_vertices(points)
+
+    with open(os.path.join(EXAMPLE_DIR, 'model.setup')) as infile:
+        setup = SetupFile.from_file(infile)
+    if n_mimo_elements > 0:
+        setup['MIMO'].set_mimo_elements(ula_positions(n_mimo_elements, 0.02))
+
+    return Scene(city, vehicles, txrx, setup, extent)
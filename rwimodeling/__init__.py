@@ -1,2 +1,3 @@
 from .x3dxmlfile import X3dXmlFile
 from .x3dxmlfile import X3dXmlFile3_3
+from .verticelist import default_dtype, get_default_dtype, set_default_dtype
@@ -1,18 +1,75 @@
-import re
+import copy
+
+import numpy as np
 
 from .errors import FormatError
-from .utils import match_or_error, look_next_line
+from .transform import rotation_matrix, scale_matrix
+from .utils import match_or_error, as_line_cursor
 #from errors import FormatError
-#from utils import match_or_error, look_next_line
+#from utils import match_or_error, as_line_cursor
 
 MAX_LEN_NAME = 71
 
 
 class BaseObject():
     def __init__(self, name='', material=0):
+        # containers holding this entity, notified when its subtree changes
+        self._parents = []
+        # axis aligned bounds, computed on the first access
+        self._bounds_cache = None
+        self._bounds_valid = False
         self.material = material
         self.name = name
-        self.dimensions = None
+
+    def _structure_changed(self):
+        """Called when entities are added to or removed from the subtree"""
+        for parent in self._parents:
+            parent._structure_changed()
+
+    def invalidate_bounds(self):
+        """Drop the cached bounds of this entity and of the containers holding it
+
+        The methods changing vertices call it, call it after modifying a
+        vertice_array in place.
+        """
+        # the containers of an entity without cached bounds have none either
+        if self._bounds_valid:
+            self._bounds_valid = False
+            self._bounds_cache = None
+            for parent in self._parents:
+                parent.invalidate_bounds()
+
+    @property
+    def bounds(self):
+        """Axis aligned bounds as a (2, 3) array [min, max] (None if there are no vertices)
+
+        The result is cached until the vertices of the subtree change.
+        """
+        if not self._bounds_valid:
+            self._bounds_cache = _read_only(self._compute_bounds())
+            self._bounds_valid = True
+        return self._bounds_cache
+
+    @property
+    def dimensions(self):
+        """Size of the bounds along each axis (None if there are no vertices)"""
+        bounds = self.bounds
+        if bounds is None:
+            return None
+        return bounds[1] - bounds[0]
+
+    def _deepcopy_state(self, inst, memo, skip=()):
+        for key, value in self.__dict__.items():
+            if key != '_parents' and key not in skip:
+                inst.__dict__[key] = copy.deepcopy(value, memo)
+        # only keep the parents copied along with this entity
+        inst._parents = [memo[id(p)] for p in self._parents if id(p) in memo]
+
+    def __deepcopy__(self, memo):
+        inst = self.__class__.__new__(self.__class__)
+        memo[id(self)] = inst
+        self._deepcopy_state(inst, memo)
+        return inst
 
     @property
     def name(self):
@@ -24,26 +81,90 @@ class BaseObject():
             raise FormatError(
                 'Max len for name is {}'.format(MAX_LEN_NAME))
         else:
+            old_name = getattr(self, '_name', None)
             self._name = name
+            for parent in self._parents:
+                parent._child_renamed(self, old_name)
+
+
+def _read_only(bounds):
+    if bounds is not None:
+        bounds.flags.writeable = False
+    return bounds
+
+
+def _merge_bounds(all_bounds):
+    """Bounds enclosing a sequence of bounds (None entries are ignored)"""
+    all_bounds = [bounds for bounds in all_bounds if bounds is not None]
+    if len(all_bounds) == 0:
+        return None
+    all_bounds = np.array(all_bounds)
+    return np.array((all_bounds[:, 0].min(axis=0), all_bounds[:, 1].max(axis=0)))
+
+
+def _partition_bounds(vertice_array, offsets):
+    """Bounds of vertice_array[offsets[i]:offsets[i + 1]] for each i
+
+    All ranges are reduced with a single reduceat call.
+
+    :param offsets: increasing offsets, the last one equal to len(vertice_array)
+    :return: list of (2, 3) arrays (None for empty ranges)
+    """
+    offsets = np.asarray(offsets)
+    non_empty = np.flatnonzero(offsets[1:] > offsets[:-1])
+    all_bounds = [None] * (len(offsets) - 1)
+    if len(non_empty) > 0:
+        # the empty ranges have no rows, so each non empty one ends where the
+        # next one starts
+        starts = offsets[non_empty]
+        mins = np.minimum.reduceat(vertice_array, starts, axis=0)
+        maxs = np.maximum.reduceat(vertice_array, starts, axis=0)
+        for i, bounds in zip(non_empty.tolist(), np.stack((mins, maxs), axis=1)):
+            all_bounds[i] = bounds
+    return all_bounds
+
+
+def _set_bounds(entity, bounds):
+    # store bounds computed by a container for one of its children
+    entity._bounds_cache = _read_only(bounds)
+    entity._bounds_valid = True
+
+
+def _add_parent(child, parent):
+    parents = getattr(child, '_parents', None)
+    if parents is not None and not any(p is parent for p in parents):
+        parents.append(parent)
+
+
+def _remove_parent(child, parent):
+    parents = getattr(child, '_parents', None)
+    if parents is not None:
+        parents[:] = [p for p in parents if p is not parent]
 
 
 class BaseContainerObject(BaseObject):
+    # The expressions below are compiled once per class by the subclasses
+    # define the first line of the entity (assumes the header has only one line)
+    _begin_re = None
+    # define the end of the entity header used only if _begin_re is None
+    _end_header_re = None
+    # define when start parsing the entity tail
+    _begin_tail_re = None
+    # define the end of entity, it None the entity ends in the end of the file
+    # (if _begin_tail_re is not defined it is required, the _tail must be implemented)
+    _end_re = None
+    # keyword of the entity in the files read by events.iterparse (e.g.
+    # 'structure'), None for the files themselves
+    _kind = None
 
     def __init__(self, child_type, **kargs):
+        # children by name, built on the first lookup (see _get_name_index)
+        self._name_index = None
         BaseObject.__init__(self, **kargs)
         # list of child entities
         self._child_list = []
         # type of child entities
         self._child_type = child_type
-        # define the first line of the entity (assumes the header has only one line)
-        self._begin_re = None
-        # define the end of the entity header used only if _begin_re is None
-        self._end_header_re = None
-        # define when start parsing the entity tail
-        self._begin_tail_re = None
-        # define the end of entity, it None the entity ends in the end of the file
-        # (if _begin_tail_re is not defined it is required, the _tail must be implemented)
-        self._end_re = None
         # default header and tail strings
         self._header_str = None
         self._tail_str = None
@@ -56,12 +177,13 @@ class BaseContainerObject(BaseObject):
     def _tail(self):
         return self._tail_str
 
+    def _iter_content(self):
+        for child in self._child_list:
+            yield from child.iter_serialize()
+
     @property
     def _content(self):
-        content_str = ''
-        for child in self._child_list:
-            content_str += child.serialize()
-        return content_str
+        return ''.join(self._iter_content())
 
     def append(self, children):
         """Append an element to the container
@@ -81,16 +203,88 @@ class BaseContainerObject(BaseObject):
                     'Object is not a "{}" "{}"'.format(
                         self._child_type, child))
             self._child_list.append(child)
+            _add_parent(child, self)
+            if self._name_index is not None:
+                self._name_index.setdefault(child.name, []).append(child)
         for child in children:
             _check_and_add_child(child)
+        self._structure_changed()
+        self.invalidate_bounds()
 
     def clear(self):
+        for child in self._child_list:
+            _remove_parent(child, self)
         self._child_list = []
+        self._name_index = None
+        self._structure_changed()
+        self.invalidate_bounds()
+
+    def _child_renamed(self, child, old_name):
+        if self._name_index is None:
+            return
+        children = self._name_index.get(old_name, [])
+        remaining = [c for c in children if c is not child]
+        if len(remaining) == len(children) or child.name in self._name_index:
+            # the position among children with the same name is unknown
+            self._name_index = None
+            return
+        if remaining:
+            self._name_index[old_name] = remaining
+        else:
+            del self._name_index[old_name]
+        self._name_index[child.name] = [child]
+
+    def _get_name_index(self):
+        """Map of each name to the children with that name, in order
+
+        The index is kept up to date by append, clear and renames of the
+        children (only BaseObject children notify renames, for other types
+        it is rebuilt on every lookup).
+        """
+        if self._name_index is not None:
+            return self._name_index
+        name_index = {}
+        for child in self._child_list:
+            name_index.setdefault(child.name, []).append(child)
+        if isinstance(self._child_type, type) and issubclass(self._child_type, BaseObject):
+            self._name_index = name_index
+        return name_index
+
+    def __deepcopy__(self, memo):
+        inst = self.__class__.__new__(self.__class__)
+        memo[id(self)] = inst
+        self._deepcopy_state(inst, memo, skip=('_name_index',))
+        inst._name_index = None
+        # children copied before their parent do not know the copy
+        for child in inst._stored_children():
+            _add_parent(child, inst)
+        return inst
+
+    def _stored_children(self):
+        """Children kept as objects (not created on demand)"""
+        return self._child_list
+
+    def _compute_bounds(self):
+        # computing the bounds of the children caches them as well
+        return _merge_bounds(getattr(child, 'bounds', None) for child in self._child_list)
 
     def translate(self, v):
         for child in self._child_list:
             child.translate(v)
 
+    def transform(self, matrix):
+        """Apply a 4x4 affine transform (see the transform module) to all vertices"""
+        for child in self._child_list:
+            child.transform(matrix)
+
+    def rotate(self, angle, axis=(0, 0, 1), pivot=(0, 0, 0)):
+        """Rotate counterclockwise by angle (degrees) around axis passing through pivot"""
+        self.transform(rotation_matrix(angle, axis, pivot))
+
+    def scale(self, factor, pivot=(0, 0, 0)):
+        """Scale by factor (scalar or per axis) around pivot"""
+        self.transform(scale_matrix(factor, pivot))
+
     def serialize(self):
         mstr = ''
         mstr += self._header
@@ -98,9 +292,30 @@ class BaseContainerObject(BaseObject):
         mstr += self._tail
         return mstr
 
+    def iter_serialize(self):
+        """Serialize the entity as a sequence of string chunks
+
+        The concatenation of the chunks is equal to serialize(), but the
+        whole document is never held in memory
+
+        :return: generator of strings
+        """
+        yield self._header
+        yield from self._iter_content()
+        yield self._tail
+
+    def write_to(self, dst_file):
+        """Write the entity chunk by chunk to an opened file
+
+        :param dst_file: opened text file (or any object with a write method)
+        :return:
+        """
+        for chunk in self.iter_serialize():
+            dst_file.write(chunk)
+
     def write(self, filename):
         with open(filename, 'w', newline='\r\n') as dst_file:
-            dst_file.write(self.serialize())
+            self.write_to(dst_file)
 
     def _parse_head(self, infile):
         """Parse the start of the entity
@@ -108,7 +323,7 @@ class BaseContainerObject(BaseObject):
         if _begin_re is defined read only the first line which must match _begin_re
         if _begin_re is not defined read until _end_header_re is found
 
-        :param infile: opened input file
+        :param infile: LineCursor over the input
         :return:
         """
         self._header_str = ''
@@ -119,12 +334,12 @@ class BaseContainerObject(BaseObject):
         # if _begin_re is not defined read until _end_header_re
         elif self._end_header_re is not None:
             while True:
-                line = look_next_line(infile)
+                line = infile.peek()
                 if line == '':
                     raise FormatError(
-                        'Could not find "{}"'.format(self._end_header_re)
+                        'Could not find "{}"'.format(self._end_header_re.pattern)
                     )
-                if re.match(self._end_header_re, line):
+                if self._end_header_re.match(line):
                     break
                 self._header_str += line
                 # consumes the line
@@ -139,7 +354,7 @@ class BaseContainerObject(BaseObject):
         read the file until _end_re is found and save in _tail_str
         if _end_re is None the file is read until its end
 
-        :param infile: opened input file
+        :param infile: LineCursor over the input
         :return:
         """
         self._tail_str = ''
@@ -150,14 +365,14 @@ class BaseContainerObject(BaseObject):
                 # if in end of file is reached and _end_re was not found
                 if self._end_re is not None:
                     raise FormatError(
-                        'Could not find "{}"'.format(self._end_re)
+                        'Could not find "{}"'.format(self._end_re.pattern)
                     )
                 # if _end_re is None the procesing ends
                 else:
                     break
             # if _end_re is defined, search for it
             if self._end_re is not None:
-                if re.match(self._end_re, line):
+                if self._end_re.match(line):
                     break
 
     def _parse_content(self, infile,mimo_id = -1):
@@ -168,10 +383,45 @@ class BaseContainerObject(BaseObject):
         self.append(child)
 
     def __getitem__(self, key):
-        for child in self._child_list:
-            if child.name == key:
-                return child
-        raise KeyError()
+        """Child named key
+
+        Names may be duplicated, in that case the first child (in file order)
+        with that name is returned, use get_all to get all of them.
+
+        key can also be a path of names separated by '/' crossing levels, e.g.
+        obj['group/structure/sub_structure/face'], each name selecting the
+        first child with that name. As names may contain '/', a key is first
+        looked up as a whole and then split from the left.
+        """
+        children = self._get_name_index().get(key)
+        if children:
+            return children[0]
+        if isinstance(key, str):
+            separator = key.find('/')
+            while separator != -1:
+                children = self._get_name_index().get(key[:separator])
+                if children:
+                    try:
+                        return children[0][key[separator + 1:]]
+                    except (KeyError, TypeError):
+                        pass
+                separator = key.find('/', separator + 1)
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        """Same as self[key], but returns default if key is not found"""
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def get_all(self, name):
+        """List of all children named name (empty if there are none)"""
+        return list(self._get_name_index().get(name, []))
+
+    def get_many(self, keys):
+        """List with self[key] for each key (names or paths)"""
+        return [self[key] for key in keys]
 
     def __iter__(self):
         return iter(self._child_list)
@@ -189,24 +439,24 @@ class BaseContainerObject(BaseObject):
             * if _begin_tail is defined calls _parse_tail when _begin_tail is matched
             * if _begin_tail is None _end_re must be defined and children are parsed until it is found
 
-        :param infile: opened input file
+        :param infile: opened input file, LineCursor or any iterable of lines
         :return: entity instance
         """
+        infile = as_line_cursor(infile)
         # consumes the entity header
-    
         self._parse_head(infile)
         MIMO = MIMO
         mimo_id = -1
         while True:
-            line = look_next_line(infile)
+            line = infile.peek()
             # are we searching for the beginning of the tail
             if self._begin_tail_re is not None:
-                if re.match(self._begin_tail_re, line):
+                if self._begin_tail_re.match(line):
                     self._parse_tail(infile)
                     break
             # if not we have to search for the end of the entity
             elif self._end_re is not None:
-                if re.match(self._end_re, line):
+                if self._end_re.match(line):
                     infile.readline()
                     break
             # if it is not the start of the tail nor the end of the entity,
@@ -215,4 +465,48 @@ class BaseContainerObject(BaseObject):
                 mimo_id += 1
                 self._parse_content(infile, mimo_id=mimo_id)
             else:
-                self._parse_content(infile)
\ No newline at end of file
+                self._parse_content(infile)
+
+    def _build(self, event, value, events):
+        """Build the entity from the events of events.iterparse
+
+        :param event, value: the begin event of the entity
+        :param events: the events iterator, consumed up to the end event
+        """
+        if event != 'begin' or value.kind != self._kind:
+            raise FormatError('Expected "begin_<{}>", found {} event {!r}'.format(
+                self._kind, event, value))
+        self.name = value.name
+        self._build_content(events)
+
+    def _build_content(self, events):
+        """Add the children found in events, up to the end event if any
+
+        Text before the children goes to _header_text and after them to
+        _tail_text, the end line to _end_line.
+        """
+        children = []
+        for event, value in events:
+            if event == 'end':
+                self._end_line(value.line)
+                break
+            if event == 'text':
+                if children:
+                    self._tail_text(value)
+                else:
+                    self._header_text(value)
+            else:
+                child = self._child_type()
+                child._build(event, value, events)
+                children.append(child)
+        self.append(children)
+
+    def _header_text(self, text):
+        raise FormatError('Unexpected "{}" in {}'.format(
+            text.splitlines()[0], type(self).__name__))
+
+    def _tail_text(self, text):
+        self._header_text(text)
+
+    def _end_line(self, line):
+        pass
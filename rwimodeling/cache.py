@@ -0,0 +1,292 @@
+"""Binary parse cache for ObjectFile, TxRxFile and SetupFile
+
+The parsed tree is stored in a sidecar file next to the parsed one
+(<file>.cache.npz, see sidecar_path), holding:
+    * vertices: the vertices of all faces/locations in file order as a single
+      float64 (n, 3) array
+    * tree: JSON with the cache key and the names, materials, float
+      precisions and raw header/tail strings of each entity (the faces of a
+      sub structure are stored as columns)
+
+The sidecar is valid if the path, size and mtime of the file are the ones
+recorded, or, when only the path or the mtime changed (e.g. the file was
+copied or touched), if the size and the blake2b hash of its content match.
+The vertices are memory mapped from the (uncompressed) archive and read at
+once. When an ObjectFile is loaded in compact mode that array becomes the
+CompactMesh and no Face is created.
+
+Use it through the cache argument of the from_file functions, e.g.
+
+    with open('base.object') as infile:
+        obj = ObjectFile.from_file(infile, cache=True)
+"""
+import hashlib
+import json
+import os
+import struct
+import sys
+import tempfile
+import zipfile
+
+import numpy as np
+
+from . import face, mimo, objects, substructure, txrx
+from .basecontainerobject import BaseContainerObject
+from .mesh import CompactMesh
+from .verticelist import BaseVerticeList, get_default_dtype
+
+# increase when the sidecar layout changes
+CACHE_VERSION = 1
+
+SIDECAR_SUFFIX = '.cache.npz'
+
+
+def sidecar_path(path):
+    return path + SIDECAR_SUFFIX
+
+
+def _content_hash(path):
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _entity_types():
+    # classes that can appear in a parsed tree, by name
+    types = (objects.ObjectFile, objects.StructureGroup, objects.Structure,
+             substructure.SubStructure, face.Face,
+             txrx.TxRxFile, txrx.TxRx, txrx.Location,
+             mimo.SetupFile, mimo.Antenna, mimo.MimoElement)
+    return {entity_type.__name__: entity_type for entity_type in types}
+
+
+def _encode(entity, vertice_arrays):
+    if isinstance(entity, mimo.MimoElement):
+        return {'type': 'MimoElement', 'name': entity.name, 'ID': entity.ID,
+                'position': entity.position, 'antenna': entity.antenna,
+                'rotation': entity.rotation}
+    node = {'type': type(entity).__name__, 'name': entity.name}
+    if isinstance(entity, face.Face):
+        node['material'] = entity.material
+    if isinstance(entity, BaseVerticeList):
+        node['precision'] = entity.vertice_float_precision
+        node['n_vertices'] = entity.n_vertices
+        if entity.n_vertices > 0:
+            vertice_arrays.append(entity.vertice_array)
+    if isinstance(entity, BaseContainerObject):
+        node['header'] = entity._header_str
+        node['tail'] = entity._tail_str
+        if isinstance(entity, substructure.SubStructure):
+            faces = entity.face_list
+            node['faces'] = {
+                'names': [f.name for f in faces],
+                'materials': [f.material for f in faces],
+                'precisions': [f.vertice_float_precision for f in faces],
+                'n_vertices': [f.n_vertices for f in faces],
+            }
+            vertice_arrays.extend(f.vertice_array for f in faces if f.n_vertices > 0)
+        elif entity._child_type is not None:
+            node['children'] = [_encode(child, vertice_arrays) for child in entity]
+    return node
+
+
+def _decode_faces(inst, faces, vertices, state):
+    if state['compact']:
+        # the faces will be views of the mesh
+        face_start = len(state['face_n_vertices'])
+        state['face_n_vertices'].extend(faces['n_vertices'])
+        # names and materials repeat a lot across faces
+        state['face_names'].extend(map(sys.intern, faces['names']))
+        state['face_materials'].extend(sys.intern(material) if isinstance(material, str)
+                                       else material for material in faces['materials'])
+        state['face_precisions'].extend(faces['precisions'])
+        state['sub_structures'].append(inst)
+        state['face_ranges'].append((face_start, len(state['face_n_vertices'])))
+        state['vertice_offset'] += sum(faces['n_vertices'])
+        return
+    face_list = []
+    start = state['vertice_offset']
+    for name, material, precision, n_vertices in zip(
+            faces['names'], faces['materials'], faces['precisions'], faces['n_vertices']):
+        face_inst = face.Face(name, material, state['dtype'])
+        face_inst.vertice_float_precision = precision
+        if n_vertices > 0:
+            face_inst.add_vertices(vertices[start:start + n_vertices])
+            start += n_vertices
+        face_list.append(face_inst)
+    state['vertice_offset'] = start
+    inst.append(face_list)
+
+
+def _decode(node, entity_types, vertices, state):
+    entity_type = entity_types[node['type']]
+    if entity_type is mimo.MimoElement:
+        inst = mimo.MimoElement(node['name'], node['ID'])
+        inst.position = node['position']
+        inst.antenna = node['antenna']
+        inst.rotation = node['rotation']
+        return inst
+    if entity_type is face.Face:
+        inst = face.Face(node['name'], node['material'], state['dtype'])
+    elif entity_type is txrx.Location:
+        inst = txrx.Location(state['dtype'])
+        inst.name = node['name']
+    else:
+        inst = entity_type(name=node['name'])
+    if isinstance(inst, BaseVerticeList):
+        inst.vertice_float_precision = node['precision']
+        start = state['vertice_offset']
+        stop = start + node['n_vertices']
+        if stop > start:
+            inst.add_vertices(vertices[start:stop])
+        state['vertice_offset'] = stop
+    if isinstance(inst, BaseContainerObject):
+        inst._header_str = node['header']
+        inst._tail_str = node['tail']
+        if 'faces' in node:
+            _decode_faces(inst, node['faces'], vertices, state)
+        elif 'children' in node:
+            inst.append([_decode(child, entity_types, vertices, state)
+                         for child in node['children']])
+    return inst
+
+
+def _compact_mesh(state, vertices):
+    face_offsets = np.zeros(len(state['face_n_vertices']) + 1, dtype=np.int64)
+    np.cumsum(state['face_n_vertices'], out=face_offsets[1:])
+    return CompactMesh(vertices, face_offsets, state['face_names'], state['face_materials'],
+                       np.array(state['face_precisions'], dtype=np.int8))
+
+
+def _member_memmap(path, member):
+    """Memory map a .npy member stored without compression in a .npz file"""
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo(member + '.npy')
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError('Compressed members can not be memory mapped')
+    with open(path, 'rb') as infile:
+        # the data follows the local file header, whose extra field may
+        # differ from the one in the central directory
+        infile.seek(info.header_offset)
+        local_header = infile.read(30)
+        name_len, extra_len = struct.unpack('<HH', local_header[26:30])
+        infile.seek(info.header_offset + 30 + name_len + extra_len)
+        version = np.lib.format.read_magic(infile)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(infile)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(infile)
+        offset = infile.tell()
+    if shape[0] == 0:
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                     order='F' if fortran_order else 'C')
+
+
+def _file_key(path, stat=None):
+    if stat is None:
+        stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns}
+
+
+def _is_valid(cached_key, path, key):
+    if cached_key is None or cached_key['size'] != key['size']:
+        return False
+    if (cached_key['path'] == key['path'] and
+            cached_key['mtime_ns'] == key['mtime_ns']):
+        return True
+    return cached_key['hash'] == _content_hash(path)
+
+
+def load(path, entity_type, dtype=None, compact=False):
+    """Entity parsed from path loaded from its sidecar (None if there is no valid one)
+
+    :param entity_type: expected type of the root entity (e.g. ObjectFile)
+    :param dtype: coordinate dtype, by default the package default
+    :param compact: load an ObjectFile in compact mode (see ObjectFile.compact)
+    """
+    cache_file = sidecar_path(path)
+    if not os.path.isfile(cache_file):
+        return None
+    try:
+        with np.load(cache_file) as archive:
+            tree = json.loads(archive['tree'].tobytes().decode('utf-8'))
+        if (tree['version'] != CACHE_VERSION or tree['type'] != entity_type.__name__ or
+                not _is_valid(tree['key'], path, _file_key(path))):
+            return None
+        # a single read of all vertices, converted to the requested dtype
+        vertices = np.array(_member_memmap(cache_file, 'vertices'),
+                            dtype=get_default_dtype() if dtype is None else dtype)
+    except (OSError, ValueError, KeyError, EOFError, struct.error, zipfile.BadZipFile):
+        return None
+    compact = compact and entity_type is objects.ObjectFile
+    state = {'vertice_offset': 0, 'dtype': dtype, 'compact': compact,
+             'face_n_vertices': [], 'face_names': [], 'face_materials': [],
+             'face_precisions': [], 'sub_structures': [], 'face_ranges': []}
+    inst = _decode(tree['root'], _entity_types(), vertices, state)
+    if compact:
+        inst._attach_mesh(_compact_mesh(state, vertices), state['sub_structures'],
+                          state['face_ranges'])
+    return inst
+
+
+def save(entity, path, key=None):
+    """Write the sidecar of path storing entity (parsed from path)
+
+    :param key: file key taken before parsing (see _file_key), so changes
+        made while parsing invalidate the sidecar
+    """
+    if key is None:
+        key = _file_key(path)
+    key = dict(key, hash=_content_hash(path))
+    vertice_arrays = []
+    root = _encode(entity, vertice_arrays)
+    if vertice_arrays:
+        vertices = np.concatenate(vertice_arrays).astype(np.float64, copy=False)
+    else:
+        vertices = np.empty((0, 3), dtype=np.float64)
+    tree = {'version': CACHE_VERSION, 'type': type(entity).__name__, 'key': key,
+            'root': root}
+    tree = np.frombuffer(json.dumps(tree).encode('utf-8'), dtype=np.uint8)
+    # write to a temporary file and rename it, so concurrent readers never see
+    # a partial sidecar
+    cache_file = sidecar_path(path)
+    fd, tmp_file = tempfile.mkstemp(suffix=SIDECAR_SUFFIX,
+                                    dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'wb') as outfile:
+            np.savez(outfile, vertices=vertices, tree=tree)
+        os.replace(tmp_file, cache_file)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+
+
+def from_file_cached(infile, entity_type, parse, **load_options):
+    """Load infile from its sidecar, or parse it and write the sidecar
+
+    Inputs that are not regular files (pipes, lists of lines...) are always
+    parsed. Failing to write the sidecar (e.g. read only directory) is not
+    an error.
+
+    :param infile: opened file or LineCursor
+    :param entity_type: type of the root entity
+    :param parse: function parsing infile
+    :param load_options: passed to load
+    :return: entity instance
+    """
+    path = getattr(infile, 'name', None)
+    if not isinstance(path, str) or not os.path.isfile(path):
+        return parse(infile)
+    key = _file_key(path)
+    inst = load(path, entity_type, **load_options)
+    if inst is None:
+        inst = parse(infile)
+        try:
+            save(inst, path, key)
+        except OSError:
+            pass
+    return inst
@@ -0,0 +1,159 @@
+"""Event based (streaming) reader of the .object and .txrx keyword formats
+
+iterparse yields the structure of a file as it reads it, one line at a time,
+without building the entities. Only the current leaf is held in memory, so
+any number of files can be scanned in constant memory, e.g. counting the
+faces per material:
+
+    with open('city.object') as infile:
+        for event, value in iterparse(infile):
+            if event == 'face':
+                counts[value.material] += len(value.vertice_array)
+
+The events are (event, value) pairs:
+    * ('begin', Begin(kind, name, line)) for begin_<structure_group>,
+      begin_<structure>, begin_<sub_structure> and begin_<points>
+    * ('end', End(kind, line)) for the matching end_<kind> line
+    * ('face', FaceRecord(name, material, vertice_array)) for a whole face
+    * ('location', LocationRecord(header, vertice_array, start_line,
+      stop_line, start_offset, stop_offset)) for a whole location
+    * ('text', str) for the lines that are not entities (e.g. the head of
+      an .object file, the antenna parameters of a set of points)
+
+The from_file functions of the entities build them from these events.
+"""
+import collections
+import re
+
+from .errors import FormatError
+from .utils import as_line_cursor, match_or_error, match_line_or_error
+from .verticelist import VerticeList, parse_vertices, read_vertice_list
+
+Begin = collections.namedtuple('Begin', ['kind', 'name', 'line'])
+End = collections.namedtuple('End', ['kind', 'line'])
+FaceRecord = collections.namedtuple('FaceRecord', ['name', 'material', 'vertice_array'])
+# header holds the begin_<location> line and any line before the vertices,
+# the vertice list (nVertices line and vertices) is the lines
+# [start_line, stop_line) of the input, and the characters
+# [start_offset, stop_offset) of its text (see LineCursor.offset)
+LocationRecord = collections.namedtuple(
+    'LocationRecord', ['header', 'vertice_array', 'start_line', 'stop_line',
+                       'start_offset', 'stop_offset'])
+
+# kinds of the children of each kind of entity, None being the top level
+_CHILD_KINDS = {
+    None: {'structure_group', 'structure', 'sub_structure', 'face', 'points', 'location'},
+    'structure_group': {'structure'},
+    'structure': {'sub_structure'},
+    'sub_structure': {'face'},
+    'points': {'location'},
+}
+
+_begin_re = re.compile(r'^\s*begin_<(?P<kind>[^>]*)>\s+(?P<name>.*)\s*$')
+_end_re = re.compile(r'^\s*end_<(?P<kind>[^>]*)>\s*$')
+_material_re = re.compile(r'\s*Material\s+(?P<mid>\d+)\s*$')
+_nvertices_re = re.compile(r'\s*nVertices\s+\d+\s*$')
+_end_face_re = re.compile(r'^\s*end_<face>\s*$')
+_end_location_re = re.compile(r'^\s*end_<location>\s*$')
+
+
+def _read_face(infile, name):
+    # the lines of a face are read in two blocks, the size of the second
+    # being known after the first one
+    lines = infile.readlines(2) + ['', '']
+    material = match_line_or_error(_material_re, lines[0]).group('mid')
+    n_vertices = int(match_line_or_error(VerticeList._begin_re, lines[1]).group('nv'))
+    lines = infile.readlines(n_vertices + 1) + ['']
+    vertice_array = parse_vertices(lines[:n_vertices], n_vertices)
+    match_line_or_error(_end_face_re, lines[n_vertices])
+    return FaceRecord(name, material, vertice_array)
+
+
+def _read_location(infile, header):
+    while not _nvertices_re.match(infile.peek()):
+        line = infile.readline()
+        if line == '':
+            raise FormatError('Could not find "{}"'.format(_nvertices_re.pattern))
+        header += line
+    start_line, start_offset = infile.line_number, infile.offset
+    vertice_array = read_vertice_list(infile)
+    stop_line, stop_offset = infile.line_number, infile.offset
+    match_or_error(_end_location_re, infile)
+    return LocationRecord(header, vertice_array, start_line, stop_line,
+                          start_offset, stop_offset)
+
+
+def iterparse(infile):
+    """Events of an .object or .txrx file (or of a single entity of one)
+
+    Lines are read only as the events are consumed: a caller that stops
+    after the end event of an entity leaves the input right after its
+    end_<kind> line.
+
+    Consecutive lines that are not entities are joined in a single text
+    event. Once an entity has text after its children, the rest of it is
+    text (e.g. the tail of a set of points).
+
+    :param infile: opened file, LineCursor or any iterable of lines
+    """
+    infile = as_line_cursor(infile)
+    peek = infile.peek
+    readline = infile.readline
+    # [kind, whether it has children, whether its tail started] of the open
+    # entities, the first being the top level
+    stack = [[None, False, False]]
+    text = []
+    while True:
+        line = peek()
+        entity = stack[-1]
+        kind = entity[0]
+        if line == '':
+            if kind is not None:
+                raise FormatError('Could not find "end_<{}>"'.format(kind))
+            if text:
+                yield 'text', ''.join(text)
+            return
+        if kind is not None:
+            match = _end_re.match(line)
+            if match and match.group('kind') == kind:
+                if text:
+                    yield 'text', ''.join(text)
+                    text = []
+                readline()
+                stack.pop()
+                yield 'end', End(kind, line)
+                continue
+        if not entity[2]:
+            match = _begin_re.match(line)
+            if match and match.group('kind') in _CHILD_KINDS[kind]:
+                if text:
+                    yield 'text', ''.join(text)
+                    text = []
+                readline()
+                entity[1] = True
+                child_kind = match.group('kind')
+                if child_kind == 'face':
+                    yield 'face', _read_face(infile, match.group('name'))
+                elif child_kind == 'location':
+                    yield 'location', _read_location(infile, line)
+                else:
+                    stack.append([child_kind, False, False])
+                    yield 'begin', Begin(child_kind, match.group('name'), line)
+                continue
+            # text after the children starts the tail
+            entity[2] = entity[1]
+        text.append(readline())
+
+
+def build(inst, infile):
+    """Fill inst, a new entity, with the first entity read from infile
+
+    Used by the from_file functions of the entities below the files, e.g.
+    build(Structure(), infile).
+
+    :return: inst
+    """
+    events = iterparse(infile)
+    event, value = next(events, (None, None))
+    inst._build(event, value, events)
+    return inst
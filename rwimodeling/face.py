@@ -1,16 +1,19 @@
+import re
+
 from .basecontainerobject import BaseObject
-from .utils import match_or_error
+from .errors import FormatError
+from .events import build
 from .verticelist import VerticeList
 
 
 class Face(BaseObject, VerticeList):
-    _begin_re = r'^\s*begin_<face>\s+(?P<fname>.*)\s*$'
-    _end_re = r'^\s*end_<face>\s*$'
-    _material_re = r'\s*Material\s+(?P<mid>\d+)\s*$'
+    _begin_re = re.compile(r'^\s*begin_<face>\s+(?P<fname>.*)\s*$')
+    _end_re = re.compile(r'^\s*end_<face>\s*$')
+    _material_re = re.compile(r'\s*Material\s+(?P<mid>\d+)\s*$')
 
-    def __init__(self, name='', material=0):
+    def __init__(self, name='', material=0, dtype=None):
         BaseObject.__init__(self, name)
-        VerticeList.__init__(self)
+        VerticeList.__init__(self, dtype)
         self.material = material
 
     def serialize(self):
@@ -21,15 +24,19 @@ class Face(BaseObject, VerticeList):
         mstr += 'end_<face>\n'
         return mstr
 
-    def from_file(infile):
-        inst = Face()
-
-        begin_match = match_or_error(Face._begin_re, infile)
-        inst.name = begin_match.group('fname')
-        material_match = match_or_error(Face._material_re, infile)
-        inst.material = material_match.group('mid')
+    def iter_serialize(self):
+        yield 'begin_<face> {}\nMaterial {}\n'.format(self.name, self.material)
+        yield from VerticeList.iter_serialize(self)
+        yield 'end_<face>\n'
 
-        VerticeList.from_file(infile, inst)
-
-        match_or_error(Face._end_re, infile)
-        return inst
\ No newline at end of file
+    def from_file(infile):
+        return build(Face(), infile)
+
+    def _build(self, event, value, events):
+        """Fill the face from its record (see BaseContainerObject._build)"""
+        if event != 'face':
+            raise FormatError('Expected "begin_<face>", found {} event {!r}'.format(event, value))
+        self.name = value.name
+        self.material = value.material
+        if len(value.vertice_array) > 0:
+            self.add_vertices(value.vertice_array)
@@ -0,0 +1,168 @@
+"""Receiver grids as (n, 3) arrays
+
+The grids are built with numpy and can be masked with the footprints of the
+buildings of an ObjectFile before being loaded in a Location at once, e.g.
+
+    points = rectangular_grid(0, 0, 500, 300, spacing=2, height=1.5)
+    points = points[~inside_footprints(points, obj)]
+    txrx['Rx'].location_list[0].add_vertices(points)
+"""
+import numpy as np
+
+from .spatial import _iter_sub_structures
+
+
+def _steps(length, spacing):
+    # number of points from 0 to length (included if it is a multiple)
+    return int(np.floor(length / spacing + 1e-9)) + 1
+
+
+def _with_height(xy, height):
+    points = np.empty((len(xy), 3))
+    points[:, :2] = xy
+    points[:, 2] = height
+    return points
+
+
+def rectangular_grid(xmin, ymin, xmax, ymax, spacing, height=0):
+    """Points of a regular grid over a rectangle, x varying first
+
+    :param spacing: distance between points, scalar or (dx, dy)
+    :param height: z of all points
+    """
+    dx, dy = np.broadcast_to(np.asarray(spacing, dtype=np.float64), (2,))
+    xs = xmin + np.arange(_steps(xmax - xmin, dx)) * dx
+    ys = ymin + np.arange(_steps(ymax - ymin, dy)) * dy
+    xy = np.empty((len(ys), len(xs), 2))
+    xy[:, :, 0] = xs
+    xy[:, :, 1] = ys[:, np.newaxis]
+    return _with_height(xy.reshape(-1, 2), height)
+
+
+def corridor_grid(polyline, width, spacing, height=0):
+    """Points along a polyline (e.g. the axis of a street) over a given width
+
+    Each segment gets rows of points across its direction every spacing
+    meters, the rows being centered on the polyline.
+
+    :param polyline: array like with shape (n, 2) or (n, 3) (z is ignored)
+    :param width: width of the corridor
+    :param spacing: distance between the points along and across
+    :param height: z of all points
+    """
+    polyline = np.asarray(polyline, dtype=np.float64)[:, :2]
+    n_across = _steps(width, spacing)
+    across = (np.arange(n_across) - (n_across - 1) / 2) * spacing
+    blocks = []
+    n_segments = len(polyline) - 1
+    for i in range(n_segments):
+        start, stop = polyline[i], polyline[i + 1]
+        length = np.hypot(*(stop - start))
+        if length == 0:
+            continue
+        direction = (stop - start) / length
+        normal = np.array((-direction[1], direction[0]))
+        along = np.arange(_steps(length, spacing)) * spacing
+        if i < n_segments - 1 and along[-1] >= length - 1e-9:
+            # the point at the joint belongs to the next segment
+            along = along[:-1]
+        blocks.append((start + along[:, np.newaxis, np.newaxis] * direction +
+                       across[np.newaxis, :, np.newaxis] * normal).reshape(-1, 2))
+    if len(blocks) == 0:
+        return np.empty((0, 3))
+    return _with_height(np.concatenate(blocks), height)
+
+
+def radial_grid(center, radii, n_angles, height=0):
+    """Points on circles around center, n_angles points per circle
+
+    A radius of 0 gives the center itself.
+
+    :param center: (x, y)
+    :param radii: sequence of radii
+    """
+    radii = np.asarray(radii, dtype=np.float64)
+    angles = np.arange(n_angles) * (2 * np.pi / n_angles)
+    rings = radii[radii > 0]
+    xy = np.empty((len(rings), n_angles, 2))
+    xy[:, :, 0] = center[0] + rings[:, np.newaxis] * np.cos(angles)
+    xy[:, :, 1] = center[1] + rings[:, np.newaxis] * np.sin(angles)
+    xy = xy.reshape(-1, 2)
+    if np.any(radii == 0):
+        xy = np.concatenate(([center[:2]], xy))
+    return _with_height(xy, height)
+
+
+def convex_hull(xy):
+    """Convex hull of 2D points, counterclockwise, without repeated vertices"""
+    # monotone chain over the points sorted by x then y
+    points = sorted(set(map(tuple, np.asarray(xy, dtype=np.float64).tolist())))
+    if len(points) < 3:
+        return np.array(points).reshape(-1, 2)
+
+    def half(points):
+        chain = []
+        for p in points:
+            while len(chain) >= 2 and (
+                    (chain[-1][0] - chain[-2][0]) * (p[1] - chain[-2][1]) -
+                    (chain[-1][1] - chain[-2][1]) * (p[0] - chain[-2][0])) <= 0:
+                chain.pop()
+            chain.append(p)
+        return chain[:-1]
+    return np.array(half(points) + half(points[::-1]))
+
+
+def footprints(entity):
+    """Footprints (convex hull in the xy plane) of the sub structures of entity
+
+    The same polygon SubStructure.as_polygon gives, without shapely.
+
+    :param entity: ObjectFile, StructureGroup, Structure, SubStructure or a
+        list of them
+    :return: list of (k, 2) arrays
+    """
+    hulls = []
+    for sub_structure in _iter_sub_structures(entity):
+        vertice_array = sub_structure.as_vertice_array()
+        if vertice_array is not None:
+            hulls.append(convex_hull(vertice_array[:, :2]))
+    return hulls
+
+
+def inside_footprints(points, entity):
+    """Whether each point is inside (or on the border of) a footprint
+
+    The points are sorted by x once, each footprint then tests only the
+    points within its bounds, against all its edges at once.
+
+    :param points: array like with shape (n, 2) or (n, 3)
+    :param entity: see footprints, or a list of (k, 2) polygons as returned
+        by it
+    :return: boolean array with shape (n,)
+    """
+    points = np.asarray(points, dtype=np.float64)
+    x = points[:, 0]
+    y = points[:, 1]
+    order = np.argsort(x, kind='stable')
+    sorted_x = x[order]
+    inside = np.zeros(len(points), dtype=bool)
+    if isinstance(entity, list) and all(isinstance(p, np.ndarray) for p in entity):
+        polygons = entity
+    else:
+        polygons = footprints(entity)
+    for polygon in polygons:
+        if len(polygon) < 3:
+            continue
+        start = np.searchsorted(sorted_x, polygon[:, 0].min(), side='left')
+        stop = np.searchsorted(sorted_x, polygon[:, 0].max(), side='right')
+        candidates = order[start:stop]
+        candidates = candidates[(y[candidates] >= polygon[:, 1].min()) &
+                                (y[candidates] <= polygon[:, 1].max())]
+        if len(candidates) == 0:
+            continue
+        # left of (or on) every edge of the counterclockwise polygon
+        edges = np.roll(polygon, -1, axis=0) - polygon
+        cross = (edges[:, 0] * (y[candidates, np.newaxis] - polygon[:, 1]) -
+                 edges[:, 1] * (x[candidates, np.newaxis] - polygon[:, 0]))
+        inside[candidates[np.all(cross >= 0, axis=1)]] = True
+    return inside
@@ -3,6 +3,8 @@ import logging
 import os
 import shutil
 
+from .scheduler import Scheduler
+
 CALCPROP_BIN=r'"C:\Program Files\Remcom\Wireless InSite 3.2.0.3\bin\calc\calcprop"'
 
 def add_opt(opt, formatter):
@@ -36,6 +38,10 @@ class InSiteProject:
     def __init__(self, project_name='model', calcprop_bin=CALCPROP_BIN,
                  wibatch_bin=None):
         """InSite project
+
+        The project files are expected to be in a run folder per simulation,
+        see staging.ProjectStager to build them from a base project.
+
         :param calcprop_bin: the path to InSite's calcprop binary
         """
         self._project_name = project_name
@@ -43,20 +49,37 @@ class InSiteProject:
         self._wibatch_bin = wibatch_bin
 
 
+    def x3d_command(self, xml_path, output_dir):
+        """Command line of run_x3d"""
+        cmd = ''
+        cmd += self._wibatch_bin
+        cmd += add_opt(output_dir, ' -out {opt}')
+        cmd += add_opt(xml_path, ' -f {opt}')
+        cmd += add_opt(self._project_name, ' -p {opt}')
+        return cmd
+
     def run_x3d(self, xml_path, output_dir):
         '''
         :param setup_path: path to the .setup file
         :param xml_path: path to the X3D xml path
         :param output_dir: where the .setup will store the results (normally the Study Area name)
         '''
-        cmd = ''
-        cmd += self._wibatch_bin
-        cmd += add_opt(output_dir, ' -out {opt}')
-        cmd += add_opt(xml_path, ' -f {opt}')
-        cmd += add_opt(self._project_name, ' -p {opt}')
+        cmd = self.x3d_command(xml_path, output_dir)
         logging.info('Running CMD: "{}"'.format(cmd))
         subprocess.run(cmd, shell=True, check=True)
 
+    def calcprop_command(self, setup_path, calc_mode=None, clean_run=None, delete_temp=None,
+                         memory=None):
+        """Command line of run_calcprop"""
+        cmd = ''
+        cmd += self._calcprop_bin
+        cmd += add_opt(calc_mode, ' --calc-mode={opt}')
+        cmd += add_opt(clean_run, ' --clean-run')
+        cmd += add_opt(delete_temp, ' --delete-temp')
+        cmd += add_opt(memory, ' --memory={opt}')
+        cmd += add_opt(setup_path, ' --project={opt}')
+        return cmd
+
     def run_calcprop(self, setup_path, calc_mode=None, clean_run=None, delete_temp=None, memory=None):
         """Run InSite simulation and store the results in output_dir
 
@@ -69,18 +92,24 @@ class InSiteProject:
         :param output_dir: Move InSite's result to this path
         :return: None
         """
-        cmd = ''
-        cmd += self._calcprop_bin
-        cmd += add_opt(calc_mode, ' --calc-mode={opt}')
-        cmd += add_opt(clean_run, ' --clean-run')
-        cmd += add_opt(delete_temp, ' --delete-temp')
-        cmd += add_opt(memory, ' --memory={opt}')
-        cmd += add_opt(setup_path, ' --project={opt}')
+        cmd = self.calcprop_command(setup_path, calc_mode, clean_run, delete_temp, memory)
         logging.info('Running CMD: "{}"'.format(cmd))
         subprocess.run(cmd, shell=True, check=True)
         #if output_dir is not None:
         #    shutil.move(self._output_dir, output_dir)
 
+    def run_all(self, specs, max_workers=None, timeout=None, retries=0, memory_budget=None,
+                manifest=None, resume=True):
+        """Run many simulations in parallel (see scheduler.Scheduler)
+
+        :param specs: list of scheduler.RunSpec
+        :param manifest: path of a scheduler.RunManifest, to resume the
+            campaign if it is interrupted
+        :return: list of scheduler.RunResult, in the order of specs
+        """
+        scheduler = Scheduler(self, max_workers, timeout, retries, memory_budget)
+        return scheduler.run(specs, manifest=manifest, resume=resume)
+
 if __name__=='__main__':
     logging.basicConfig(level=logging.INFO)
     path = os.path.join(os.path.dirname(os.path.realpath(__file__)),
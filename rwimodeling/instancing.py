@@ -0,0 +1,143 @@
+import numpy as np
+
+from .mesh import CompactMesh, MeshFace
+from .substructure import SubStructure
+from .transform import apply_transform, translation_matrix
+
+
+class Prototype:
+    """Geometry shared by many SubStructureInstance
+
+    The faces are packed once in a CompactMesh. A prototype is immutable,
+    so it is shared (not copied) by copy.deepcopy.
+
+    :param sub_structure: SubStructure whose faces are copied to the prototype
+    """
+
+    def __init__(self, sub_structure):
+        self.name = sub_structure.name
+        self.mesh = CompactMesh.from_faces(sub_structure.face_list)
+
+    def instance(self, matrix=None, name=None, material=None):
+        """Create a SubStructureInstance of this prototype"""
+        return SubStructureInstance(self, matrix, name=name, material=material)
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class SubStructureInstance(SubStructure):
+    """SubStructure sharing the faces of a Prototype
+
+    Only a 4x4 transform (see the transform module) and, optionally, a
+    material for all faces are stored per instance. Transforms are composed
+    with the instance transform in O(1), the faces are computed when
+    serialized or accessed.
+
+    The faces returned by face_list are transient copies. To edit them, or to
+    add or remove faces, call expand(), which turns the instance into a
+    regular SubStructure with its own faces.
+
+    :param prototype: shared Prototype
+    :param matrix: initial 4x4 transform (identity by default)
+    :param name: name of the sub structure (by default the prototype name)
+    :param material: material of all faces (by default the prototype ones)
+    """
+
+    def __init__(self, prototype, matrix=None, name=None, material=None):
+        self.prototype = prototype
+        self.matrix = np.identity(4) if matrix is None else np.array(matrix, dtype=np.float64)
+        SubStructure.__init__(
+            self, name=prototype.name if name is None else name, material=material)
+
+    def _get_name_index(self):
+        if self.prototype is None:
+            return SubStructure._get_name_index(self)
+        # the faces are created on each access, do not keep them
+        self._name_index = None
+        name_index = SubStructure._get_name_index(self)
+        self._name_index = None
+        return name_index
+
+    def _instance_mesh(self):
+        # mesh with the transformed vertices, sharing the prototype tables
+        mesh = self.prototype.mesh
+        vertices = mesh.vertices.copy()
+        if len(vertices) > 0:
+            apply_transform(vertices, self.matrix)
+        if self.material is None:
+            face_materials = mesh.face_materials
+        else:
+            face_materials = [self.material] * mesh.n_faces
+        return CompactMesh(vertices, mesh.face_offsets, mesh.face_names,
+                           face_materials, mesh.face_precisions)
+
+    @property
+    def _child_list(self):
+        if self.prototype is None:
+            return SubStructure._child_list.fget(self)
+        mesh = self._instance_mesh()
+        return [MeshFace(mesh, i).to_face() for i in range(mesh.n_faces)]
+
+    @_child_list.setter
+    def _child_list(self, faces):
+        SubStructure._child_list.fset(self, faces)
+
+    def expand(self):
+        """Turn the instance into a regular SubStructure with its own faces"""
+        if self.prototype is not None:
+            faces = self._child_list
+            self.prototype = None
+            self._child_list = []
+            SubStructure.append(self, faces)
+        else:
+            SubStructure.expand(self)
+
+    def append(self, children):
+        self.expand()
+        SubStructure.append(self, children)
+
+    def clear(self):
+        self.prototype = None
+        SubStructure.clear(self)
+
+    def _attach_mesh(self, mesh, face_start, face_stop):
+        self.prototype = None
+        SubStructure._attach_mesh(self, mesh, face_start, face_stop)
+
+    def _compute_bounds(self):
+        if self.prototype is None:
+            return SubStructure._compute_bounds(self)
+        return self._instance_mesh().bounds()
+
+    def translate(self, v):
+        if self.prototype is None:
+            SubStructure.translate(self, v)
+        else:
+            self.matrix = np.matmul(translation_matrix(v), self.matrix)
+            self.invalidate_bounds()
+
+    def transform(self, matrix):
+        if self.prototype is None:
+            SubStructure.transform(self, matrix)
+        else:
+            self.matrix = np.matmul(matrix, self.matrix)
+            self.invalidate_bounds()
+
+    def as_vertice_array(self):
+        if self.prototype is None:
+            return SubStructure.as_vertice_array(self)
+        vertice_array = self._instance_mesh().vertices
+        return vertice_array if len(vertice_array) > 0 else None
+
+    def _face_mesh(self):
+        if self.prototype is None:
+            return SubStructure._face_mesh(self)
+        mesh = self._instance_mesh()
+        return mesh, 0, mesh.n_faces
+
+    def _iter_content(self):
+        if self.prototype is None:
+            yield from SubStructure._iter_content(self)
+        else:
+            yield self._instance_mesh().serialize_faces()
@@ -0,0 +1,186 @@
+import sys
+
+import numpy as np
+
+from .basecontainerobject import MAX_LEN_NAME
+from .errors import FormatError
+from .face import Face
+from .transform import apply_transform
+from .verticelist import get_default_dtype
+
+
+class CompactMesh:
+    """Faces stored as a structure of arrays
+
+    The vertices of all faces live in a single contiguous (n_vertices, 3)
+    array, the vertices of face i being
+    vertices[face_offsets[i]:face_offsets[i + 1]]. Names, materials and
+    float precisions are kept in per face tables.
+    """
+
+    def __init__(self, vertices, face_offsets, face_names, face_materials,
+                 face_precisions):
+        self.vertices = vertices
+        self.face_offsets = face_offsets
+        self.face_names = face_names
+        self.face_materials = face_materials
+        self.face_precisions = face_precisions
+
+    def from_faces(faces, dtype=None):
+        """Pack a sequence of faces in a new mesh (the vertices are copied)
+
+        :param dtype: coordinate dtype, by default the one of the first face
+        """
+        faces = list(faces)
+        n_vertices = np.array([face.n_vertices for face in faces], dtype=np.int64)
+        face_offsets = np.zeros(len(faces) + 1, dtype=np.int64)
+        np.cumsum(n_vertices, out=face_offsets[1:])
+        if dtype is None:
+            dtype = faces[0].vertice_dtype if len(faces) > 0 else get_default_dtype()
+        vertices = np.empty((face_offsets[-1], 3), dtype=dtype)
+        for face, start, stop in zip(faces, face_offsets[:-1], face_offsets[1:]):
+            if stop > start:
+                vertices[start:stop] = face.vertice_array
+        return CompactMesh(
+            vertices, face_offsets,
+            # names and materials repeat a lot across faces
+            [sys.intern(face.name) for face in faces],
+            [sys.intern(face.material) if isinstance(face.material, str) else face.material
+             for face in faces],
+            np.array([face.vertice_float_precision for face in faces], dtype=np.int8))
+
+    @property
+    def n_faces(self):
+        return len(self.face_names)
+
+    def vertice_range(self, start, stop):
+        """Range of vertices of the faces [start, stop)"""
+        return self.face_offsets[start], self.face_offsets[stop]
+
+    def subset(self, start, stop):
+        """New mesh with a copy of the faces [start, stop)"""
+        v_start, v_stop = self.vertice_range(start, stop)
+        return CompactMesh(
+            self.vertices[v_start:v_stop].copy(),
+            self.face_offsets[start:stop + 1] - v_start,
+            self.face_names[start:stop],
+            self.face_materials[start:stop],
+            self.face_precisions[start:stop].copy())
+
+    def translate(self, v, start=0, stop=None):
+        """Translate the vertices of the faces [start, stop)"""
+        v_start, v_stop = self.vertice_range(start, self.n_faces if stop is None else stop)
+        self.vertices[v_start:v_stop] += v
+
+    def transform(self, matrix, start=0, stop=None):
+        """Apply a 4x4 affine transform to the vertices of the faces [start, stop)"""
+        v_start, v_stop = self.vertice_range(start, self.n_faces if stop is None else stop)
+        if v_stop > v_start:
+            apply_transform(self.vertices[v_start:v_stop], matrix)
+
+    def bounds(self, start=0, stop=None):
+        """Axis aligned bounds of the faces [start, stop) as [min, max] (None if empty)"""
+        v_start, v_stop = self.vertice_range(start, self.n_faces if stop is None else stop)
+        if v_stop == v_start:
+            return None
+        vertices = self.vertices[v_start:v_stop]
+        return np.array((vertices.min(axis=0), vertices.max(axis=0)))
+
+    def serialize_faces(self, start=0, stop=None):
+        """Serialize the faces [start, stop) as Face.serialize would
+
+        The text is built by a single formatting operation over all the
+        coordinates and face fields.
+        """
+        if stop is None:
+            stop = self.n_faces
+        template = []
+        values = []
+        offsets = self.face_offsets
+        v_start, v_stop = self.vertice_range(start, stop)
+        coordinates = self.vertices[v_start:v_stop].astype(np.float64, copy=False).ravel().tolist()
+        for i in range(start, stop):
+            n_vertices = int(offsets[i + 1] - offsets[i])
+            line_format = ' '.join(['%.{0}f'.format(self.face_precisions[i])] * 3) + '\n'
+            template.append('begin_<face> %s\nMaterial %s\nnVertices %d\n')
+            template.append(line_format * n_vertices)
+            template.append('end_<face>\n')
+            values.append(self.face_names[i])
+            values.append(self.face_materials[i])
+            values.append(n_vertices)
+            first = 3 * int(offsets[i] - v_start)
+            values.extend(coordinates[first:first + 3 * n_vertices])
+        return ''.join(template) % tuple(values)
+
+
+class MeshFace(Face):
+    """Face whose vertices, name and material are stored in a CompactMesh
+
+    The vertices are a view of the mesh, so modifications are seen by the
+    mesh, but the number of vertices can not change.
+    """
+
+    def __init__(self, mesh, index, parent=None):
+        self._mesh = mesh
+        self._index = index
+        self._parents = [] if parent is None else [parent]
+        self._vertice_dtype = mesh.vertices.dtype
+        self._bounds_cache = None
+        self._bounds_valid = False
+        v_start, v_stop = mesh.vertice_range(index, index + 1)
+        self._vertice_buffer = mesh.vertices[v_start:v_stop]
+        self._n_vertices = int(v_stop - v_start)
+
+    @property
+    def name(self):
+        return self._mesh.face_names[self._index]
+
+    @name.setter
+    def name(self, name):
+        if len(name) > MAX_LEN_NAME:
+            raise FormatError(
+                'Max len for name is {}'.format(MAX_LEN_NAME))
+        old_name = self._mesh.face_names[self._index]
+        self._mesh.face_names[self._index] = name
+        for parent in self._parents:
+            parent._child_renamed(self, old_name)
+
+    @property
+    def material(self):
+        return self._mesh.face_materials[self._index]
+
+    @material.setter
+    def material(self, material):
+        self._mesh.face_materials[self._index] = material
+
+    @property
+    def vertice_float_precision(self):
+        return int(self._mesh.face_precisions[self._index])
+
+    @vertice_float_precision.setter
+    def vertice_float_precision(self, value):
+        self._mesh.face_precisions[self._index] = value
+
+    def invalidate_bounds(self):
+        # views are created on demand, so the parent may have cached bounds
+        # even if this face has not
+        self._bounds_valid = False
+        self._bounds_cache = None
+        for parent in self._parents:
+            parent.invalidate_bounds()
+
+    def _reserve(self, n_vertices):
+        if n_vertices > self._n_vertices:
+            raise FormatError(
+                'The number of vertices of a compact face can not change')
+
+    def clear(self):
+        self._reserve(self._n_vertices + 1)
+
+    def to_face(self):
+        """Independent Face with a copy of this face"""
+        face = Face(self.name, self.material, self.vertice_dtype)
+        face.vertice_float_precision = self.vertice_float_precision
+        if self._n_vertices > 0:
+            face.add_vertices(self.vertice_array)
+        return face
@@ -1,14 +1,50 @@
+import re
+
+from . import cache as parse_cache
 from .basecontainerobject import BaseContainerObject
-from .utils import match_or_error
+from .setupblocks import SetupText
+from .transform import apply_transform, rotation_matrix
+from .utils import match_or_error, as_line_cursor
 import numpy as np
 import os 
 
+# format of the position and rotation coordinates set as numbers
+VECTOR_FORMAT = '%.10g %.10g %.10g'
+
+
+def _format_vector(vector):
+    # '-0' would be written for negative zeros
+    return VECTOR_FORMAT % tuple(float(v) + 0.0 for v in vector)
+
+
+def _read_only(vector):
+    vector.flags.writeable = False
+    return vector
+
+
+def _vector(vector):
+    vector = np.array(vector, dtype=np.float64)
+    if vector.shape != (3,):
+        raise ValueError('Expected 3 numbers, got {}'.format(vector))
+    return _read_only(vector)
+
+
+def _parse_vector(text, field):
+    try:
+        vector = np.array(text.split(), dtype=np.float64)
+    except ValueError:
+        vector = None
+    if vector is None or vector.shape != (3,):
+        raise ValueError('MimoElement {} is not 3 numbers: "{}"'.format(field, text))
+    return vector
+
+
 class MimoElement:
-    _begin_re = r'^\s*begin_<MimoElement>\s*$'
-    _position = r'^\s*position\s+(?P<Mposition>.*)\s*$'
-    _antenna = r'^\s*antenna\s+(?P<Mantenna>.*)\s*$'
-    _rotation = r'\s*rotation\s+(?P<Mrotation>.*)\s*$'
-    _end_re = r'^\s*end_<MimoElement>\s*$'
+    _begin_re = re.compile(r'^\s*begin_<MimoElement>\s*$')
+    _position = re.compile(r'^\s*position\s+(?P<Mposition>.*)\s*$')
+    _antenna = re.compile(r'^\s*antenna\s+(?P<Mantenna>.*)\s*$')
+    _rotation = re.compile(r'\s*rotation\s+(?P<Mrotation>.*)\s*$')
+    _end_re = re.compile(r'^\s*end_<MimoElement>\s*$')
 
     def __init__(self, name='', ID=''):
         self.rotation = ''
@@ -17,6 +53,9 @@ class MimoElement:
         self.name = name
         self.ID = ID
 
+    # position and rotation keep the text parsed (written back unchanged)
+    # until they are set as numbers
+
     @property
     def name(self):
         return self._name
@@ -39,23 +78,54 @@ class MimoElement:
     
     @property
     def rotation(self):
+        if self._rotation is None:
+            return _format_vector(self._rotation_array)
         return self._rotation
     
     @rotation.setter
     def rotation(self, rotation):
-        self._rotation = rotation
+        """Rotation as text or as 3 numbers"""
+        if isinstance(rotation, str):
+            self._rotation = rotation
+            self._rotation_array = None
+        else:
+            self._rotation = None
+            self._rotation_array = _vector(rotation)
+
+    @property
+    def rotation_array(self):
+        """Rotation as a read only array of 3 floats"""
+        if self._rotation_array is None:
+            self._rotation_array = _read_only(_parse_vector(self._rotation, 'rotation'))
+        return self._rotation_array
     
     @property
     def position(self):
+        if self._position is None:
+            return _format_vector(self._position_array)
         return self._position
     
     @position.setter
     def position(self, position):
-        self._position = position
+        """Position as text or as 3 numbers"""
+        if isinstance(position, str):
+            self._position = position
+            self._position_array = None
+        else:
+            self._position = None
+            self._position_array = _vector(position)
+
+    @property
+    def position_array(self):
+        """Position as a read only array of 3 floats"""
+        if self._position_array is None:
+            self._position_array = _read_only(_parse_vector(self._position, 'position'))
+        return self._position_array
     
     def from_file(infile, mimo_id):
         inst = MimoElement()
         inst.ID = str(mimo_id)
+        infile = as_line_cursor(infile)
 
         match_or_error(MimoElement._begin_re, infile)
         #begin_match = match_or_error(MimoElement._begin_re, infile)
@@ -82,16 +152,19 @@ class MimoElement:
         mstr += 'end_<MimoElement>\n'
         return mstr
 
+    def iter_serialize(self):
+        yield self.serialize()
+
 class Antenna(BaseContainerObject):
+    __begin_re = re.compile(r'^\s*begin_<antenna>\s+(?P<name>.*)\s*$')
+    #_begin_re = re.compile(r'^\s*description\s+(?P<name>.*)\s*$')
+    _end_header_re = re.compile(r'^\s*begin_<MimoElement>\s*$')
+    # the tail starts if the "content" is not a location
+    _begin_tail_re = re.compile(r'^(?!begin_<MimoElement>).*$')
+    _end_re = re.compile(r'^\s*end_<antenna>\s*$')
 
     def __init__(self, name=''):
         BaseContainerObject.__init__(self, MimoElement, name=name)
-        self.__begin_re = r'^\s*begin_<antenna>\s+(?P<name>.*)\s*$'
-        #self._begin_re = r'^\s*description\s+(?P<name>.*)\s*$'
-        self._end_header_re = r'^\s*begin_<MimoElement>\s*$'
-        # the tail starts if the "content" is not a location
-        self._begin_tail_re = r'^(?!begin_<MimoElement>).*$'
-        self._end_re = r'^\s*end_<antenna>\s*$'
 
     def add_mimo_element(self, mimo_element):
         self.append(mimo_element)
@@ -99,6 +172,63 @@ class Antenna(BaseContainerObject):
     @property
     def mimo_list(self):
         return self._child_list
+
+    @property
+    def positions(self):
+        """Positions of the elements as a (n, 3) array (a copy)"""
+        return np.array([element.position_array for element in self], dtype=np.float64).reshape(-1, 3)
+
+    @positions.setter
+    def positions(self, positions):
+        for element, position in zip(self, self._element_rows(positions)):
+            element.position = position
+
+    @property
+    def rotations(self):
+        """Rotations of the elements as a (n, 3) array (a copy)"""
+        return np.array([element.rotation_array for element in self], dtype=np.float64).reshape(-1, 3)
+
+    @rotations.setter
+    def rotations(self, rotations):
+        for element, rotation in zip(self, self._element_rows(rotations)):
+            element.rotation = rotation
+
+    def _element_rows(self, array):
+        # one row per element, a single row is used for all
+        array = np.asarray(array, dtype=np.float64)
+        try:
+            return np.broadcast_to(array, (len(self._child_list), 3))
+        except ValueError:
+            raise ValueError('Expected {} rows of 3 numbers, got shape {}'.format(
+                len(self._child_list), array.shape))
+
+    def set_mimo_elements(self, positions, rotations=None, antenna=None):
+        """Replace the elements by one element per position
+
+        :param positions: (n, 3) array (see ula_positions, upa_positions and
+            uca_positions)
+        :param rotations: (n, 3) or (3,) array, by default the rotation of
+            the first current element (0 0 0 if there is none)
+        :param antenna: antenna of the elements, by default the one of the
+            first current element
+        """
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 3)
+        first = self._child_list[0] if len(self._child_list) > 0 else None
+        if rotations is None:
+            rotations = first.rotation if first is not None else (0, 0, 0)
+        if antenna is None:
+            antenna = first.antenna if first is not None else ''
+        elements = [MimoElement(ID=str(i)) for i in range(len(positions))]
+        for element in elements:
+            element.antenna = antenna
+        self.clear()
+        self.append(elements)
+        self.positions = positions
+        if isinstance(rotations, str):
+            for element in elements:
+                element.rotation = rotations
+        else:
+            self.rotations = rotations
     
 
     def _parse_head(self, infile):
@@ -122,6 +252,62 @@ class Antenna(BaseContainerObject):
         return inst
 
 
+def _orient(positions, azimuth, tilt):
+    # raise the x axis by tilt (towards z), then turn it by azimuth around z
+    matrix = np.matmul(rotation_matrix(azimuth), rotation_matrix(tilt, (0, -1, 0)))
+    apply_transform(positions, matrix)
+    return positions
+
+
+def ula_positions(n_elements, spacing, azimuth=0, tilt=0):
+    """Uniform linear array from the origin along the x axis
+
+    The array is tilted towards z and then turned around z by azimuth
+    (degrees), e.g. azimuth=30 lays it 30 degrees from the x axis.
+
+    :return: (n_elements, 3) array
+    """
+    positions = np.zeros((n_elements, 3))
+    positions[:, 0] = np.arange(n_elements) * spacing
+    return _orient(positions, azimuth, tilt)
+
+
+def upa_positions(n_rows, n_columns, spacing, azimuth=0, tilt=0):
+    """Uniform planar array in the xz plane from the origin
+
+    Each row has n_columns elements along x and the rows are stacked
+    along z. The array is oriented as in ula_positions.
+
+    :param spacing: distance between elements, scalar or (along x, along z)
+    :return: (n_rows * n_columns, 3) array, row by row
+    """
+    dx, dz = np.broadcast_to(np.asarray(spacing, dtype=np.float64), (2,))
+    positions = np.zeros((n_rows, n_columns, 3))
+    positions[:, :, 0] = np.arange(n_columns) * dx
+    positions[:, :, 2] = np.arange(n_rows)[:, np.newaxis] * dz
+    return _orient(positions.reshape(-1, 3), azimuth, tilt)
+
+
+def uca_positions(n_elements, spacing=None, radius=None, azimuth=0, tilt=0):
+    """Uniform circular array in the xy plane centered at the origin
+
+    The first element is on the x axis and the array is oriented as in
+    ula_positions.
+
+    :param spacing: distance between neighbour elements (or give radius)
+    :return: (n_elements, 3) array
+    """
+    if radius is None:
+        if spacing is None:
+            raise ValueError('Give the spacing or the radius of the array')
+        radius = spacing / (2 * np.sin(np.pi / n_elements))
+    angles = np.arange(n_elements) * (2 * np.pi / n_elements)
+    positions = np.zeros((n_elements, 3))
+    positions[:, 0] = radius * np.cos(angles)
+    positions[:, 1] = radius * np.sin(angles)
+    return _orient(positions, azimuth, tilt)
+
+
 class SetupFile(BaseContainerObject):
     _default_head = (
         'Format type:keyword version: 1.1.0\n' +
@@ -131,18 +317,89 @@ class SetupFile(BaseContainerObject):
         'end_<project>\n'
     )
 
+    _end_header_re = re.compile(r'^\s*begin_<antenna>.*$')
+    _end_re = re.compile(r'^\s*end_<project>.*$')
+    _begin_tail_re = re.compile(r'^\s*(?!begin_<antenna>).*$')
+
     def __init__(self, name=''):
+        # block trees of the header and tail, built on first access
+        self._header_blocks = None
+        self._tail_blocks = None
         BaseContainerObject.__init__(self, Antenna, name=name)
-        self._head_str = SetupFile._default_head
+        self._header_str = SetupFile._default_head
         self._tail_str = SetupFile._default_tail
-        self._end_header_re = r'^\s*begin_<antenna>.*$'
-        self._end_re = r'^\s*end_<project>.*$'
-        self._begin_tail_re = r'^\s*(?!begin_<antenna>).*$'
 
-    def from_file(infile):
-        inst = SetupFile()
-        BaseContainerObject.from_file(inst, infile)
-        return inst
+    # the header and tail are the raw text until their blocks are accessed,
+    # then the text of the blocks (verbatim for the blocks not modified)
+    @property
+    def _header_str(self):
+        if self._header_blocks is None:
+            return self._raw_header
+        return self._header_blocks.serialize()
+
+    @_header_str.setter
+    def _header_str(self, text):
+        self._raw_header = text
+        self._header_blocks = None
+
+    @property
+    def _tail_str(self):
+        if self._tail_blocks is None:
+            return self._raw_tail
+        return self._tail_blocks.serialize()
+
+    @_tail_str.setter
+    def _tail_str(self, text):
+        self._raw_tail = text
+        self._tail_blocks = None
+
+    @property
+    def header_blocks(self):
+        """SetupText with the blocks before the antennas (studyarea, feature...)"""
+        if self._header_blocks is None:
+            self._header_blocks = SetupText(self._raw_header or '')
+        return self._header_blocks
+
+    @property
+    def tail_blocks(self):
+        """SetupText with the blocks after the antennas (Waveform, requests...)"""
+        if self._tail_blocks is None:
+            self._tail_blocks = SetupText(self._raw_tail or '')
+        return self._tail_blocks
+
+    def block(self, path, label=None):
+        """First block of a given kind or path of kinds (e.g. 'studyarea/model')
+
+        The blocks before the antennas are searched first, see
+        setupblocks.SetupBlock to read and modify its fields.
+
+        :param label: label of the last block of the path, any by default
+        """
+        found = self.header_blocks.get_block(path, label)
+        if found is None:
+            found = self.tail_blocks.get_block(path, label)
+        if found is None:
+            raise KeyError(path)
+        return found
+
+    def blocks(self, kind):
+        """All top level blocks of a given kind (e.g. 'feature')"""
+        return self.header_blocks.blocks(kind) + self.tail_blocks.blocks(kind)
+
+    def from_file(infile, cache=False):
+        """Parse a setup file
+
+        :param infile: opened file, LineCursor or any iterable of lines
+        :param cache: load from (or create) the binary sidecar of the file
+            (see the cache module)
+        """
+        def parse(infile):
+            inst = SetupFile()
+            BaseContainerObject.from_file(inst, infile)
+            return inst
+        if cache:
+            return parse_cache.from_file_cached(infile, SetupFile, parse)
+        return parse(infile)
 
 if __name__=='__main__':
     #with open('../base_v2/base.setup') as infile:
@@ -150,20 +407,9 @@ if __name__=='__main__':
         #print(antenna.from_file(infile).serialize())
         #print(TxRx.from_file(infile).serialize())
         txrx = SetupFile.from_file(infile)
-        angle = np.radians(90 - 60) #graus
-        delta_y = np.sin(angle)
-        delta_x = np.cos(angle)
-        offset = 0.02
+        # ULA 60 degrees from the y axis, 2 cm between elements
         for child in txrx._child_list:
-            x = 0
-            y = 0
-            Xoffset = round((delta_x*offset),5)
-            Yoffset = round((delta_y*offset),5)
-            for mimo in child._child_list:
-                position = '{} {} {}'.format(x,y,0)
-                mimo.position=position
-                x = x + Xoffset
-                y = y + Yoffset
+            child.positions = ula_positions(len(child.mimo_list), 0.02, azimuth=90 - 60)
         #setup_path = os.path.join('../base_v2', 'model.setup')
         #txrx.write(setup_path)
         print(txrx.serialize())
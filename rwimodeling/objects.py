@@ -1,23 +1,28 @@
-import copy
+import functools
 import os
+import re
 
 import numpy as np
 
-from .basecontainerobject import BaseContainerObject
+from . import cache as parse_cache
+from .basecontainerobject import BaseContainerObject, _partition_bounds, _set_bounds
+from .errors import FormatError
+from .events import build, iterparse
 from .face import Face
+from .instancing import Prototype
+from .mesh import CompactMesh
 from .substructure import SubStructure
-from .utils import match_or_error
-
-
-# TODO: calculate dimentions as most distant points in each dimension
+from .utils import as_line_cursor
+from .verticelist import get_default_dtype
 
 
 class Structure(BaseContainerObject):
+    _begin_re = re.compile(r'^\s*begin_<structure>\s+(?P<stname>.*)\s*$')
+    _end_re = re.compile(r'^\s*end_<structure>\s*$')
+    _kind = 'structure'
 
     def __init__(self, **kargs):
         BaseContainerObject.__init__(self, SubStructure, **kargs)
-        self._begin_re = r'^\s*begin_<structure>\s+(?P<stname>.*)\s*$'
-        self._end_re = r'^\s*end_<structure>\s*$'
 
     @property
     def _header(self):
@@ -34,14 +39,20 @@ class Structure(BaseContainerObject):
     def add_sub_structures(self, sub_structures):
         self.append(sub_structures)
 
-    def _parse_head(self, infile):
-        match = match_or_error(self._begin_re, infile)
-        self.name = match.group('stname')
-
     def from_file(infile):
-        inst = Structure()
-        BaseContainerObject.from_file(inst, infile)
-        return inst
+        return build(Structure(), infile)
+
+
+# vertices of the faces of a unit box, in the order and direction used by
+# RectangularPrism (the vertices are ordered according to the outside of each face)
+_UNIT_BOX_FACES = (
+    ('top',    ((0, 0, 1), (1, 0, 1), (1, 1, 1), (0, 1, 1))),
+    ('bottom', ((0, 1, 0), (1, 1, 0), (1, 0, 0), (0, 0, 0))),
+    ('front',  ((0, 1, 1), (1, 1, 1), (1, 1, 0), (0, 1, 0))),
+    ('back',   ((0, 0, 0), (1, 0, 0), (1, 0, 1), (0, 0, 1))),
+    ('left',   ((0, 0, 1), (0, 1, 1), (0, 1, 0), (0, 0, 0))),
+    ('right',  ((1, 0, 0), (1, 1, 0), (1, 1, 1), (1, 0, 1))),
+)
 
 
 class RectangularPrism(SubStructure):
@@ -51,8 +62,9 @@ class RectangularPrism(SubStructure):
     to define the "outside" of the object
     """
 
-    def __init__(self, length, width, height, name='', material=1):
+    def __init__(self, length, width, height, name='', material=1, dtype=None):
         SubStructure.__init__(self, name=name, material=material)
+        self._dtype = dtype
         self._length = length
         self._width = width
         self._height = height
@@ -86,44 +98,35 @@ class RectangularPrism(SubStructure):
         self._make()
 
     def _make(self):
-        length = self.length
-        width = self.width
-        height = self.height
-        bottom = Face('bottom', material=self.material)
-        bottom.add_vertice((0,      width, 0))
-        bottom.add_vertice((length, width, 0))
-        bottom.add_vertice((length, 0,     0))
-        bottom.add_vertice((0,      0,     0))
-
-        top = copy.deepcopy(bottom)
-        top.name = 'top'
-        top.translate((0, 0, height))
-        top.invert_direction()
-
-        front = Face('front', material=self.material)
-        front.add_vertice((0,      width, height))
-        front.add_vertice((length, width, height))
-        front.add_vertice((length, width, 0     ))
-        front.add_vertice((0,      width, 0     ))
-
-        back = copy.deepcopy(front)
-        back.name = 'back'
-        back.translate((0, -width, 0))
-        back.invert_direction()
-
-        left = Face('left', material=self.material)
-        left.add_vertice((0, 0,     height))
-        left.add_vertice((0, width, height))
-        left.add_vertice((0, width, 0     ))
-        left.add_vertice((0, 0,     0     ))
-
-        right = copy.deepcopy(left)
-        right.name = 'right'
-        right.translate((length, 0, 0))
-        right.invert_direction()
-
-        self.add_faces([top, bottom, front, back, left, right])
-        self.dimensions = np.array((length, width, height))
+        size = np.array((self.length, self.width, self.height))
+        faces = []
+        for name, unit_vertices in _UNIT_BOX_FACES:
+            face = Face(name, material=self.material, dtype=self._dtype)
+            face.add_vertices(np.multiply(unit_vertices, size))
+            faces.append(face)
+        self.clear()
+        self.add_faces(faces)
+
+
+@functools.lru_cache(maxsize=None)
+def _rectangular_prism_prototype(length, width, height, material, dtype):
+    return Prototype(RectangularPrism(length, width, height, material=material, dtype=dtype))
+
+
+def rectangular_prism_prototype(length, width, height, material=1, dtype=None):
+    """Cached Prototype of a RectangularPrism
+
+    Use it to place many identical boxes (e.g. vehicles) as
+    SubStructureInstance sharing the same geometry:
+
+        car = rectangular_prism_prototype(4.54, 1.76, 1.47, material=0)
+        structure.add_sub_structures(car.instance(translation_matrix((x, y, 0))))
+
+    :param dtype: coordinate dtype, by default the current default dtype
+        (a prototype is cached per dtype)
+    """
+    dtype = get_default_dtype() if dtype is None else np.dtype(dtype)
+    return _rectangular_prism_prototype(length, width, height, material, dtype)
 
 
 class ObjectFile(BaseContainerObject):
@@ -162,44 +165,147 @@ class ObjectFile(BaseContainerObject):
     _default_tail = (
         'end_<object>\n'
     )
-
-    def __init__(self, name=None, head=None, tail=None):
+    _end_header_re = re.compile(r'^\s*begin_<structure_group>\s+(?P<name>.*)\s*$')
+    #_begin_tail_re = re.compile(r'^\s*end_<object>\s*$')
+    _begin_tail_re = re.compile(r'^\s*(?!begin_<structure_group>).*$')
+
+    def __init__(self, name='', head=None, tail=None):
+        # CompactMesh holding all faces, if in compact mode, and the sub
+        # structures using it
+        self._mesh = None
+        self._mesh_sub_structures = []
         BaseContainerObject.__init__(self, StructureGroup, name=name)
-        self._head_str = ObjectFile._default_head if head is None else head
+        self._header_str = ObjectFile._default_head if head is None else head
         self._tail_str = ObjectFile._default_tail if tail is None else tail
-        self._end_header_re = StructureGroup._begin_re
-        #self._begin_tail_re = r'^\s*end_<object>\s*$'
-        self._begin_tail_re = r'^\s*(?!begin_<structure_group>).*$'
 
     def add_structure_groups(self, structure_groups):
         self.append(structure_groups)
 
-    def from_file(infile):
-        inst = ObjectFile(os.path.basename(infile.name))
-        BaseContainerObject.from_file(inst, infile)
+    @property
+    def mesh(self):
+        """CompactMesh holding every face of the object (None if not compact)"""
+        return self._mesh
+
+    def compact(self, dtype=None):
+        """Store the geometry of all faces in a single CompactMesh
+
+        The faces of each SubStructure become views of the mesh, so
+        translating the whole object or computing its bounds takes a single
+        array operation. Adding or removing entities anywhere in the tree
+        leaves compact mode for the object (the sub structures not touched
+        keep using the mesh), call compact() again to pack everything.
+
+        :param dtype: coordinate dtype of the mesh, by default the one of the faces
+        """
+        sub_structures = [sub_structure
+                          for structure_group in self
+                          for structure in structure_group
+                          for sub_structure in structure]
+        faces = []
+        face_ranges = []
+        for sub_structure in sub_structures:
+            face_start = len(faces)
+            faces.extend(sub_structure.face_list)
+            face_ranges.append((face_start, len(faces)))
+        self._attach_mesh(CompactMesh.from_faces(faces, dtype), sub_structures, face_ranges)
+
+    def _attach_mesh(self, mesh, sub_structures, face_ranges):
+        # sub_structures must be all the sub structures of the object, in order
+        for sub_structure, (face_start, face_stop) in zip(sub_structures, face_ranges):
+            sub_structure._attach_mesh(mesh, face_start, face_stop)
+        self._mesh = mesh
+        self._mesh_sub_structures = sub_structures
+
+    def _structure_changed(self):
+        # faces not in the mesh may have been added or removed
+        self._mesh = None
+        self._mesh_sub_structures = []
+        BaseContainerObject._structure_changed(self)
+
+    def _compute_bounds(self):
+        sub_structures = [s for s in self._mesh_sub_structures if not s._bounds_valid]
+        if self._mesh is not None and len(sub_structures) > 0:
+            # bounds of all sub structures from a single pass over the mesh,
+            # their faces are contiguous and in order
+            face_offsets = [s._face_start for s in self._mesh_sub_structures]
+            face_offsets.append(self._mesh.n_faces)
+            offsets = self._mesh.face_offsets[face_offsets]
+            all_bounds = _partition_bounds(self._mesh.vertices, offsets)
+            for sub_structure, bounds in zip(self._mesh_sub_structures, all_bounds):
+                if not sub_structure._bounds_valid:
+                    _set_bounds(sub_structure, bounds)
+        return BaseContainerObject._compute_bounds(self)
+
+    def _mesh_changed(self):
+        # the mesh was modified directly, the sub structures do not know
+        for sub_structure in self._mesh_sub_structures:
+            sub_structure.invalidate_bounds()
+
+    def translate(self, v):
+        if self._mesh is None:
+            BaseContainerObject.translate(self, v)
+        else:
+            self._mesh.translate(v)
+            self._mesh_changed()
+
+    def transform(self, matrix):
+        if self._mesh is None:
+            BaseContainerObject.transform(self, matrix)
+        else:
+            self._mesh.transform(matrix)
+            self._mesh_changed()
+
+    def _header_text(self, text):
+        self._header_str += text
+
+    def _tail_text(self, text):
+        self._tail_str += text
+
+    def from_file(infile, compact=False, cache=False):
+        """Parse an object file
+
+        :param infile: opened file, LineCursor or any iterable of lines
+        :param compact: store the faces in a CompactMesh (see compact())
+        :param cache: load from (or create) the binary sidecar of the file
+            (see the cache module)
+        """
+        infile = as_line_cursor(infile)
+        # pipes and other iterables have no file name
+        name = os.path.basename(infile.name) if isinstance(infile.name, str) else ''
+
+        def parse(infile):
+            inst = ObjectFile(name)
+            inst._header_str = ''
+            inst._tail_str = ''
+            inst._build_content(iterparse(infile))
+            if len(inst._child_list) == 0:
+                raise FormatError('Could not find "{}"'.format(ObjectFile._end_header_re.pattern))
+            return inst
+        if cache:
+            inst = parse_cache.from_file_cached(infile, ObjectFile, parse, compact=compact)
+            # the sidecar may have been created for a copy of the file
+            inst.name = name
+        else:
+            inst = parse(infile)
+        if compact and inst.mesh is None:
+            inst.compact()
         return inst
 
 
 class StructureGroup(BaseContainerObject):
 
-    _begin_re = r'^\s*begin_<structure_group>\s+(?P<name>.*)\s*$'
+    _begin_re = ObjectFile._end_header_re
+    _end_re = re.compile(r'^\s*end_<structure_group>\s*$')
+    _kind = 'structure_group'
 
     def __init__(self, **kargs):
         BaseContainerObject.__init__(self, Structure, **kargs)
-        self._begin_re = StructureGroup._begin_re
-        self._end_re = r'^\s*end_<structure_group>\s*$'
 
     def add_structures(self, structures):
         self.append(structures)
 
-    def _parse_head(self, infile):
-        begin_match = match_or_error(self._begin_re, infile)
-        self.name = begin_match.group('name')
-
     def from_file(infile):
-        inst = StructureGroup()
-        BaseContainerObject.from_file(inst, infile)
-        return inst
+        return build(StructureGroup(), infile)
 
     @property
     def _header(self):
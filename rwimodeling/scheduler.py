@@ -0,0 +1,405 @@
+import collections
+import hashlib
+import json
+import logging
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+_MEMORY_RE = re.compile(r'^\s*(?P<value>\d+(\.\d*)?)\s*(?P<unit>[KMG])\s*$', re.IGNORECASE)
+_MEMORY_UNITS = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+
+
+def parse_memory(memory):
+    """Bytes of a memory option of calcprop (<n+>[.[<n+>]]K/M/G e.g. 450.5M)
+
+    Integers are taken as bytes, None as 0.
+    """
+    if memory is None:
+        return 0
+    if isinstance(memory, int):
+        return memory
+    match = _MEMORY_RE.match(memory)
+    if match is None:
+        raise ValueError('Invalid memory "{}", expected e.g. 450.5M'.format(memory))
+    return int(float(match.group('value')) * _MEMORY_UNITS[match.group('unit').upper()])
+
+
+class RunSpec(collections.namedtuple(
+        'RunSpec', ['setup_path', 'xml_path', 'output_dir', 'calc_mode', 'memory', 'name'])):
+    """A simulation run
+
+    Runs InSiteProject.run_x3d(xml_path, output_dir) if xml_path is given,
+    otherwise InSiteProject.run_calcprop(setup_path, calc_mode, memory=memory).
+
+    :param output_dir: where the results are written (for calcprop runs,
+        normally the study area directory), checked by validate_outputs
+    :param memory: memory used by the run (calcprop --memory option), counted
+        in the memory budget of the Scheduler
+    :param name: used in the logs, by default the xml or setup path
+    """
+    __slots__ = ()
+
+    def __new__(cls, setup_path=None, xml_path=None, output_dir=None, calc_mode=None,
+                memory=None, name=None):
+        if setup_path is None and xml_path is None:
+            raise ValueError('A run needs a setup_path or a xml_path')
+        if name is None:
+            name = xml_path if xml_path is not None else setup_path
+        return super().__new__(cls, setup_path, xml_path, output_dir, calc_mode, memory, name)
+
+    def command(self, project):
+        """Command line running the spec with an InSiteProject"""
+        if self.xml_path is not None:
+            return project.x3d_command(self.xml_path, self.output_dir)
+        return project.calcprop_command(self.setup_path, self.calc_mode, memory=self.memory)
+
+
+class RunResult:
+    """Outcome of a RunSpec
+
+    :param spec: the RunSpec
+    :param returncode: exit code of the last attempt (None if it timed out)
+    :param duration: seconds spent in all attempts
+    :param log: stdout and stderr of the last attempt
+    :param attempts: number of times the command was run (0 if it was
+        skipped because the manifest shows it is done)
+    :param timed_out: whether the last attempt was killed by the timeout
+    :param outputs: output files found by the validation ({relative path:
+        size}), None if the outputs are not valid
+    """
+
+    def __init__(self, spec, returncode, duration, log, attempts, timed_out=False, outputs=None):
+        self.spec = spec
+        self.returncode = returncode
+        self.duration = duration
+        self.log = log
+        self.attempts = attempts
+        self.timed_out = timed_out
+        self.outputs = outputs
+
+    @property
+    def ok(self):
+        return self.returncode == 0 and self.outputs is not None
+
+    @property
+    def skipped(self):
+        return self.attempts == 0
+
+    def __repr__(self):
+        return 'RunResult({!r}, returncode={}, duration={:.3f}, attempts={}{}{})'.format(
+            self.spec.name, self.returncode, self.duration, self.attempts,
+            ', timed_out=True' if self.timed_out else '',
+            ', invalid outputs' if self.returncode == 0 and self.outputs is None else '')
+
+
+def _output_stats(output_dir):
+    # size and mtime of the files below output_dir, by relative path
+    stats = {}
+    for dir_path, dir_names, file_names in os.walk(output_dir):
+        for file_name in file_names:
+            path = os.path.join(dir_path, file_name)
+            stat = os.stat(path)
+            stats[os.path.relpath(path, output_dir)] = (stat.st_size, stat.st_mtime_ns)
+    return stats
+
+
+def output_files(output_dir):
+    """Files below output_dir as {path relative to output_dir: size}"""
+    return {path: size for path, (size, mtime) in _output_stats(output_dir).items()}
+
+
+def validate_outputs(spec, previous=None):
+    """Default validation of the outputs of a run that exited with 0
+
+    The run is complete if its output_dir holds at least one non empty file
+    written by the run (runs without output_dir can not be checked and are
+    complete). Files with the size and mtime they had when the attempt
+    started are left from an earlier attempt or run and are not counted.
+
+    :param previous: {relative path: (size, mtime_ns)} of the files of
+        output_dir when the attempt started, given by the Scheduler (None to
+        count every file)
+    :return: output files ({relative path: size}) or None if not complete
+    """
+    if spec.output_dir is None:
+        return {}
+    stats = _output_stats(spec.output_dir)
+    previous = previous or {}
+    if not any(size for path, (size, mtime) in stats.items()
+               if previous.get(path) != (size, mtime)):
+        return None
+    return {path: size for path, (size, mtime) in stats.items()}
+
+
+def run_key(spec):
+    """Identifier of a run in a RunManifest (the memory and name do not matter)"""
+    fields = [spec.setup_path, spec.xml_path, spec.output_dir, spec.calc_mode]
+    fields = [os.path.abspath(field) if field is not None and i < 3 else field
+              for i, field in enumerate(fields)]
+    return hashlib.sha1(json.dumps(fields).encode('utf-8')).hexdigest()
+
+
+def _input_stats(spec):
+    # size and mtime of the input files, a change means the run is stale
+    stats = {}
+    for path in (spec.setup_path, spec.xml_path):
+        if path is not None and os.path.isfile(path):
+            stat = os.stat(path)
+            stats[path] = [stat.st_size, stat.st_mtime_ns]
+    return stats
+
+
+class RunManifest:
+    """Append only JSONL file recording the runs of a Scheduler
+
+    A line is written when a run starts and another when it finishes, with
+    its spec, inputs (size and mtime of the setup/xml files), state
+    ('started', 'done' or 'failed'), exit code, duration and validated
+    outputs. Lines are flushed and synced one by one, so after a crash the
+    file holds every run that finished; a run whose last line is 'started'
+    was interrupted. A truncated last line is ignored.
+
+    A run is done if its last state is 'done', its inputs did not change
+    and its output files still have the recorded size, which only takes a
+    few stat calls per run.
+
+    :param path: path of the manifest, created if it does not exist
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # last record of each run
+        self._records = {}
+        # the last line was truncated, the next record starts a new line
+        self._truncated = False
+        if os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        with open(self.path, encoding='utf-8') as infile:
+            for line in infile:
+                self._truncated = not line.endswith('\n')
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # interrupted while writing
+                    continue
+                self._records[record['key']] = record
+
+    def record(self, spec, state, result=None):
+        """Append the state of a run"""
+        record = {'key': run_key(spec), 'spec': spec._asdict(), 'state': state,
+                  'inputs': _input_stats(spec), 'time': time.time()}
+        if result is not None:
+            record.update(returncode=result.returncode, duration=result.duration,
+                          attempts=result.attempts, timed_out=result.timed_out,
+                          outputs=result.outputs)
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            if self._truncated:
+                line = '\n' + line
+                self._truncated = False
+            with open(self.path, 'a', encoding='utf-8') as outfile:
+                outfile.write(line)
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            self._records[record['key']] = record
+
+    def last_record(self, spec):
+        """Last record of the run of spec (None if it never started)"""
+        return self._records.get(run_key(spec))
+
+    def is_done(self, spec):
+        record = self.last_record(spec)
+        if record is None or record['state'] != 'done':
+            return False
+        if record['inputs'] != _input_stats(spec):
+            return False
+        outputs = record.get('outputs') or {}
+        for path, size in outputs.items():
+            path = os.path.join(spec.output_dir, path)
+            if not os.path.isfile(path) or os.path.getsize(path) != size:
+                return False
+        return True
+
+    def skipped_result(self, spec):
+        """RunResult of a done run, from its record"""
+        record = self.last_record(spec)
+        return RunResult(spec, record['returncode'], 0.0, '', 0, outputs=record['outputs'])
+
+
+class _MemoryBudget:
+    # blocks the runs until their memory fits in the budget
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.used = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, amount):
+        if self.budget is None:
+            return
+        with self._condition:
+            self._condition.wait_for(lambda: self.used + amount <= self.budget)
+            self.used += amount
+
+    def release(self, amount):
+        if self.budget is None:
+            return
+        with self._condition:
+            self.used -= amount
+            self._condition.notify_all()
+
+
+def _kill_tree(process):
+    # the command runs in a shell, kill the process group so the simulator
+    # started by it does not survive
+    if os.name == 'posix':
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    else:
+        subprocess.run(['taskkill', '/F', '/T', '/PID', str(process.pid)],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        process.kill()
+
+
+class Scheduler:
+    """Run many RunSpec of an InSiteProject on a pool of workers
+
+    Each command runs in its own process group (session on Linux), with
+    stdout and stderr captured, and is killed with everything it started
+    if it takes more than timeout seconds. Failed or timed out runs are
+    retried up to retries times. With memory_budget, runs wait until the sum
+    of the memory of the running specs plus theirs fits in the budget (specs
+    without memory count as 0).
+
+    :param project: InSiteProject building the commands
+    :param max_workers: number of runs at the same time, by default the
+        number of CPUs
+    :param timeout: seconds per attempt (None for no limit)
+    :param retries: extra attempts for failed runs
+    :param memory_budget: total memory of the runs at the same time, in
+        bytes or in the format of the memory option (e.g. '16G')
+    :param validate: function called with the spec of a run that exited
+        with 0 and the files of its output_dir when the attempt started (as
+        the previous argument of validate_outputs, None without output_dir),
+        returning its output files or None if they are not complete (the
+        run then fails and is retried), validate_outputs by default
+    """
+
+    def __init__(self, project, max_workers=None, timeout=None, retries=0, memory_budget=None,
+                 validate=validate_outputs):
+        self.project = project
+        self.max_workers = max_workers if max_workers is not None else (os.cpu_count() or 1)
+        self.timeout = timeout
+        self.retries = retries
+        self.memory_budget = None if memory_budget is None else parse_memory(memory_budget)
+        self.validate = validate
+
+    def _attempt(self, cmd):
+        """Run cmd once, return (returncode, log, timed_out)"""
+        popen_options = {}
+        if os.name == 'posix':
+            popen_options['start_new_session'] = True
+        else:
+            popen_options['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+        process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT, **popen_options)
+        try:
+            output, _ = process.communicate(timeout=self.timeout)
+            return process.returncode, output, False
+        except subprocess.TimeoutExpired:
+            _kill_tree(process)
+            output, _ = process.communicate()
+            return None, output, True
+        except BaseException:
+            # e.g. KeyboardInterrupt, do not leave the simulation running
+            _kill_tree(process)
+            process.wait()
+            raise
+
+    def run_spec(self, spec, budget=None, manifest=None):
+        """Run a single spec (with its retries) and return its RunResult
+
+        :param manifest: RunManifest where the run is recorded
+        """
+        memory = parse_memory(spec.memory)
+        cmd = spec.command(self.project)
+        if budget is not None:
+            budget.acquire(memory)
+        try:
+            if manifest is not None:
+                manifest.record(spec, 'started')
+            start = time.monotonic()
+            attempts = 0
+            while True:
+                attempts += 1
+                logging.info('Running CMD: "{}"'.format(cmd))
+                previous = None
+                if spec.output_dir is not None and os.path.isdir(spec.output_dir):
+                    previous = _output_stats(spec.output_dir)
+                returncode, output, timed_out = self._attempt(cmd)
+                outputs = None
+                if returncode == 0:
+                    outputs = {} if self.validate is None else self.validate(spec, previous)
+                    if outputs is not None:
+                        break
+                if attempts > self.retries:
+                    break
+                if returncode == 0:
+                    problem = 'has invalid outputs'
+                elif timed_out:
+                    problem = 'timed out'
+                else:
+                    problem = 'failed with {}'.format(returncode)
+                logging.warning('Run "{}" {} (attempt {} of {})'.format(
+                    spec.name, problem, attempts, self.retries + 1))
+            result = RunResult(spec, returncode, time.monotonic() - start,
+                               output.decode(errors='replace'), attempts, timed_out, outputs)
+            if manifest is not None:
+                manifest.record(spec, 'done' if result.ok else 'failed', result)
+            return result
+        finally:
+            if budget is not None:
+                budget.release(memory)
+
+    def run(self, specs, callback=None, manifest=None, resume=True):
+        """Run all specs and return their RunResult, in the order of specs
+
+        A failed run does not stop the others, check RunResult.ok.
+
+        :param callback: called with each RunResult as soon as it is ready
+            (from a worker thread)
+        :param manifest: RunManifest (or its path) recording the runs
+        :param resume: skip the runs the manifest shows are done (see
+            RunManifest.is_done), the failed and interrupted ones run again
+        """
+        specs = list(specs)
+        if isinstance(manifest, str):
+            manifest = RunManifest(manifest)
+        budget = _MemoryBudget(self.memory_budget)
+        if self.memory_budget is not None:
+            for spec in specs:
+                if parse_memory(spec.memory) > self.memory_budget:
+                    raise ValueError('Run "{}" needs more memory ({}) than the budget ({})'.format(
+                        spec.name, spec.memory, self.memory_budget))
+
+        def run_spec(spec):
+            if manifest is not None and resume and manifest.is_done(spec):
+                result = manifest.skipped_result(spec)
+            else:
+                result = self.run_spec(spec, budget, manifest)
+            if callback is not None:
+                callback(result)
+            return result
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(run_spec, specs))
@@ -0,0 +1,264 @@
+"""Lazy tree of the begin_<kind> ... end_<kind> blocks of a .setup file
+
+The text kept by SetupFile around the antennas (header and tail) is indexed
+with a single regular expression pass the first time the blocks are
+accessed. The lines of a block are only split and looked up when one of its
+fields is read or written, and blocks that were not modified are written
+back verbatim (the slice of the original text), e.g.
+
+    setup = SetupFile.from_file(infile)
+    setup.block('studyarea/model')['num_threads'] = 4
+    setup.block('studyarea/boundary').vertice_array += (10, 0, 0)
+    setup.write('run/model.setup')
+"""
+import re
+
+import numpy as np
+
+_MARKER_RE = re.compile(r'^(?P<marker>begin|end)_<(?P<kind>[^>]*)>(?P<label>[^\n]*)(\n|$)', re.M)
+
+
+def _index(text, start=0, stop=None):
+    """Top level blocks of text[start:stop]
+
+    Begin lines without a matching end (e.g. begin_<project>, which ends
+    after the antennas) and stray end lines are plain lines, the blocks
+    inside an unclosed block belong to its parent.
+    """
+    # (kind, label, start, body_start, children) of the open blocks
+    stack = [(None, None, start, start, [])]
+    for match in _MARKER_RE.finditer(text, start, len(text) if stop is None else stop):
+        kind = match.group('kind')
+        if match.group('marker') == 'begin':
+            stack.append((kind, match.group('label'), match.start(), match.end(), []))
+            continue
+        depth = len(stack) - 1
+        while depth > 0 and stack[depth][0] != kind:
+            depth -= 1
+        if depth == 0:
+            continue
+        while len(stack) - 1 > depth:
+            unclosed = stack.pop()
+            stack[-1][4].extend(unclosed[4])
+        kind, label, block_start, body_start, children = stack.pop()
+        stack[-1][4].append(SetupBlock(text, kind, label.strip(), block_start, body_start,
+                                       match.start(), match.end(), children))
+    while len(stack) > 1:
+        unclosed = stack.pop()
+        stack[-1][4].extend(unclosed[4])
+    return stack[0][4]
+
+
+class _BlockList:
+    """Lines and blocks of a region of the text of a .setup file
+
+    The items (lines as str and SetupBlock) are split from the text on
+    first access.
+    """
+
+    def __init__(self, text, start, stop, children):
+        self._text = text
+        self._start = start
+        self._stop = stop
+        self._children = children
+        self._items = None
+        self._modified = False
+
+    @property
+    def items(self):
+        """Lines (str, with the line break) and SetupBlock in file order"""
+        if self._items is None:
+            items = []
+            offset = self._start
+            for child in self._children:
+                items.extend(self._text[offset:child._block_start].splitlines(True))
+                items.append(child)
+                offset = child._block_stop
+            items.extend(self._text[offset:self._stop].splitlines(True))
+            self._items = items
+        return self._items
+
+    @property
+    def children(self):
+        """Blocks directly inside this one"""
+        return list(self._children)
+
+    def blocks(self, kind=None):
+        """Blocks directly inside this one of a given kind (all by default)"""
+        return [child for child in self._children if kind is None or child.kind == kind]
+
+    def block(self, path, label=None):
+        """First block of a given kind, or path of kinds separated by '/'
+
+        :param label: label of the last block of the path (the text after
+            begin_<kind>), any by default
+        """
+        kind, _, rest = path.partition('/')
+        for child in self._children:
+            if child.kind != kind:
+                continue
+            if rest:
+                found = child.get_block(rest, label)
+                if found is not None:
+                    return found
+            elif label is None or child.label == label:
+                return child
+        raise KeyError(path)
+
+    def get_block(self, path, label=None):
+        """Same as block, but returns None if there is no such block"""
+        try:
+            return self.block(path, label)
+        except KeyError:
+            return None
+
+    def iter_blocks(self):
+        """All blocks below this one, depth first"""
+        for child in self._children:
+            yield child
+            yield from child.iter_blocks()
+
+    def is_modified(self):
+        """Whether this region or any block below it was modified"""
+        return self._modified or any(child.is_modified() for child in self._children)
+
+    def _iter_body(self):
+        if not self.is_modified():
+            yield self._text[self._start:self._stop]
+            return
+        for item in self.items:
+            if isinstance(item, str):
+                yield item
+            else:
+                yield item.serialize()
+
+    def serialize(self):
+        return ''.join(self._iter_body())
+
+
+class SetupBlock(_BlockList):
+    """begin_<kind> label ... end_<kind> block of a .setup file
+
+    The fields are the lines starting with a keyword ("num_threads 12"),
+    looked up with block['num_threads'] (the rest of the line as str) or
+    block.value('num_threads', int), and replaced with
+    block['num_threads'] = 4 (str() of the value). Lines with a single word
+    ("active", "x3d") are flags, see has_flag and set_flag.
+    """
+
+    def __init__(self, text, kind, label, start, body_start, body_stop, stop, children):
+        _BlockList.__init__(self, text, body_start, body_stop, children)
+        self.kind = kind
+        self.label = label
+        # span of the whole block, from its begin line to its end line
+        self._block_start = start
+        self._block_stop = stop
+
+    def __repr__(self):
+        return 'SetupBlock({!r}, {!r})'.format(self.kind, self.label)
+
+    def _line_index(self, key):
+        for i, item in enumerate(self.items):
+            if isinstance(item, str):
+                words = item.split(None, 1)
+                if words and words[0] == key:
+                    return i
+        return None
+
+    def __contains__(self, key):
+        return self._line_index(key) is not None
+
+    def __getitem__(self, key):
+        i = self._line_index(key)
+        if i is None:
+            raise KeyError(key)
+        words = self.items[i].split(None, 1)
+        return words[1].strip() if len(words) > 1 else ''
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def value(self, key, value_type=str):
+        """Field converted by value_type (e.g. int, float)"""
+        return value_type(self[key])
+
+    def __setitem__(self, key, value):
+        """Replace the field, or add it at the end of the block"""
+        line = '{} {}\n'.format(key, value)
+        i = self._line_index(key)
+        if i is None:
+            self._insert_line(line)
+        else:
+            self.items[i] = line
+        self._modified = True
+
+    def _insert_line(self, line):
+        # after the last line of the block (before a missing line break)
+        items = self.items
+        if items and isinstance(items[-1], str) and not items[-1].endswith('\n'):
+            items[-1] += '\n'
+        items.append(line)
+
+    def has_flag(self, flag):
+        return any(isinstance(item, str) and item.strip() == flag for item in self.items)
+
+    def set_flag(self, flag, enabled=True):
+        """Add or remove a single word line"""
+        if enabled == self.has_flag(flag):
+            return
+        if enabled:
+            self._insert_line(flag + '\n')
+        else:
+            self._items = [item for item in self.items
+                           if not (isinstance(item, str) and item.strip() == flag)]
+        self._modified = True
+
+    @property
+    def vertice_array(self):
+        """The nVertices lines after the nVertices field as a (n, 3) array"""
+        i = self._line_index('nVertices')
+        if i is None:
+            raise KeyError('nVertices')
+        n_vertices = self.value('nVertices', int)
+        lines = self.items[i + 1:i + 1 + n_vertices]
+        return np.array(''.join(lines).split(), dtype=np.float64).reshape(-1, 3)
+
+    @vertice_array.setter
+    def vertice_array(self, vertice_array):
+        i = self._line_index('nVertices')
+        if i is None:
+            raise KeyError('nVertices')
+        vertice_array = np.asarray(vertice_array, dtype=np.float64).reshape(-1, 3)
+        n_vertices = self.value('nVertices', int)
+        lines = [' '.join(_format_coordinate(value) for value in v) + '\n'
+                 for v in vertice_array.tolist()]
+        self.items[i:i + 1 + n_vertices] = ['nVertices {}\n'.format(len(lines))] + lines
+        self._modified = True
+
+    def serialize(self):
+        if not self.is_modified():
+            return self._text[self._block_start:self._block_stop]
+        begin = self._text[self._block_start:self._start]
+        end = self._text[self._stop:self._block_stop]
+        return begin + ''.join(self._iter_body()) + end
+
+
+def _format_coordinate(value):
+    # shortest text read back as the same float, integers without '.0' as
+    # InSite writes them
+    text = repr(value)
+    return text[:-2] if text.endswith('.0') else text
+
+
+class SetupText(_BlockList):
+    """Block tree of a piece of a .setup file (see SetupFile.blocks)
+
+    :param text: the text, written back verbatim unless a block is modified
+    """
+
+    def __init__(self, text):
+        children = _index(text)
+        _BlockList.__init__(self, text, 0, len(text), children)
@@ -0,0 +1,297 @@
+import math
+import weakref
+
+import numpy as np
+
+from .basecontainerobject import _add_parent, _remove_parent
+from .substructure import SubStructure
+
+# entries covering more grid cells than this (e.g. a ground plane) are not
+# put in the cells but tested by every query
+MAX_CELLS_PER_ENTRY = 256
+
+
+def _xy_bounds(sub_structure):
+    # the bounds are cached by the sub structure
+    bounds = sub_structure.bounds
+    if bounds is None:
+        return None
+    return (bounds[0, 0], bounds[0, 1], bounds[1, 0], bounds[1, 1])
+
+
+def _iter_sub_structures(entity):
+    if isinstance(entity, SubStructure):
+        yield entity
+    else:
+        for child in entity:
+            yield from _iter_sub_structures(child)
+
+
+class _Watcher:
+    """Registered as a parent of an indexed sub structure to learn when its bounds change"""
+    __slots__ = ('_index', '_slot', 'sub_structure')
+
+    def __init__(self, index, slot, sub_structure):
+        # the sub structures do not keep the index alive
+        self._index = weakref.ref(index)
+        self._slot = slot
+        self.sub_structure = sub_structure
+
+    def invalidate_bounds(self):
+        index = self._index()
+        if index is not None:
+            index._stale.add(self._slot)
+
+    _structure_changed = invalidate_bounds
+
+    def _child_renamed(self, child, old_name):
+        pass
+
+
+def _detach(watchers):
+    for watcher in watchers.values():
+        _remove_parent(watcher.sub_structure, watcher)
+
+
+class SpatialIndex:
+    """Uniform grid over the axis aligned bounds of SubStructures in the xy plane
+
+    Answers rectangle, radius and nearest neighbour queries and batch overlap
+    tests without shapely. The index is told when the bounds of the sub
+    structures it holds are invalidated (as their containers are), so the
+    ones moved or edited in any way (translate() of the sub structure or of
+    a container, edits of its faces, a compact ObjectFile transformed...)
+    are indexed again by the next query. As for bounds, call
+    invalidate_bounds() (or update()) after modifying a vertice_array in
+    place. Use insert() to add new sub structures.
+
+    :param cell_size: side of the grid cells, by default the median of the
+        largest side of the bounds of the sub structures first inserted
+    """
+
+    def __init__(self, cell_size=None):
+        self.cell_size = cell_size
+        # slot of each sub structure (by id) and the sub structure in each slot
+        self._slots = {}
+        self._items = []
+        # xmin, ymin, xmax, ymax of each slot (nan for empty slots)
+        self._bounds = np.full((16, 4), np.nan)
+        # grid cell -> set of slots
+        self._cells = {}
+        # slots covering too many cells, candidates of every query
+        self._large = set()
+        # slots whose bounds changed since they were indexed
+        self._stale = set()
+        # watcher registered in the sub structure of each slot
+        self._watchers = {}
+        weakref.finalize(self, _detach, self._watchers)
+
+    def from_object(entity, cell_size=None):
+        """Index all sub structures of an ObjectFile, StructureGroup or Structure"""
+        inst = SpatialIndex(cell_size)
+        inst.insert(list(_iter_sub_structures(entity)))
+        return inst
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, sub_structure):
+        return id(sub_structure) in self._slots
+
+    def _cell_range(self, xmin, ymin, xmax, ymax):
+        size = self.cell_size
+        return (math.floor(xmin / size), math.floor(ymin / size),
+                math.floor(xmax / size), math.floor(ymax / size))
+
+    def _add_to_cells(self, slot, bounds):
+        xmin, ymin, xmax, ymax = bounds
+        size = self.cell_size
+        # also True for infinite bounds
+        if not ((xmax - xmin) / size + 2) * ((ymax - ymin) / size + 2) <= MAX_CELLS_PER_ENTRY:
+            self._large.add(slot)
+            return
+        i0, j0, i1, j1 = self._cell_range(*bounds)
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                self._cells.setdefault((i, j), set()).add(slot)
+
+    def _remove_from_cells(self, slot):
+        bounds = self._bounds[slot]
+        if np.isnan(bounds[0]):
+            return
+        if slot in self._large:
+            self._large.discard(slot)
+            return
+        i0, j0, i1, j1 = self._cell_range(*bounds)
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                cell = self._cells[(i, j)]
+                cell.discard(slot)
+                if not cell:
+                    del self._cells[(i, j)]
+
+    def insert(self, sub_structures):
+        """Add a sub structure or a list of sub structures"""
+        if not isinstance(sub_structures, list):
+            sub_structures = [sub_structures]
+        sub_structures = [s for s in sub_structures if id(s) not in self._slots]
+        all_bounds = [_xy_bounds(s) for s in sub_structures]
+        if self.cell_size is None:
+            sizes = [max(b[2] - b[0], b[3] - b[1]) for b in all_bounds if b is not None]
+            self.cell_size = float(np.median(sizes)) if sizes else 1.0
+            if not self.cell_size > 0:
+                self.cell_size = 1.0
+        n_slots = len(self._items) + len(sub_structures)
+        if n_slots > len(self._bounds):
+            bounds_array = np.full((max(n_slots, 2 * len(self._bounds)), 4), np.nan)
+            bounds_array[:len(self._items)] = self._bounds[:len(self._items)]
+            self._bounds = bounds_array
+        for sub_structure, bounds in zip(sub_structures, all_bounds):
+            slot = len(self._items)
+            self._items.append(sub_structure)
+            self._slots[id(sub_structure)] = slot
+            self._watchers[slot] = _Watcher(self, slot, sub_structure)
+            _add_parent(sub_structure, self._watchers[slot])
+            if bounds is not None:
+                self._bounds[slot] = bounds
+                self._add_to_cells(slot, bounds)
+
+    def remove(self, sub_structure):
+        slot = self._slots.pop(id(sub_structure))
+        self._remove_from_cells(slot)
+        self._bounds[slot] = np.nan
+        self._items[slot] = None
+        self._stale.discard(slot)
+        _remove_parent(sub_structure, self._watchers.pop(slot))
+
+    def _update_slot(self, slot):
+        self._remove_from_cells(slot)
+        bounds = _xy_bounds(self._items[slot])
+        if bounds is None:
+            self._bounds[slot] = np.nan
+        else:
+            self._bounds[slot] = bounds
+            self._add_to_cells(slot, bounds)
+
+    def _refresh(self):
+        # index again the sub structures whose bounds changed
+        while self._stale:
+            self._update_slot(self._stale.pop())
+
+    def update(self, sub_structure):
+        """Recompute the bounds of a sub structure that was modified"""
+        slot = self._slots[id(sub_structure)]
+        self._stale.discard(slot)
+        self._update_slot(slot)
+
+    def translate(self, sub_structure, v):
+        """Translate an indexed sub structure and update the index"""
+        sub_structure.translate(v)
+        self.update(sub_structure)
+
+    def transform(self, sub_structure, matrix):
+        """Transform an indexed sub structure and update the index"""
+        sub_structure.transform(matrix)
+        self.update(sub_structure)
+
+    def _candidates(self, xmin, ymin, xmax, ymax):
+        """Slots that may intersect the rectangle (a set, or None for all)"""
+        i0, j0, i1, j1 = self._cell_range(xmin, ymin, xmax, ymax)
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self._cells):
+            # large query, faster to test every slot
+            return None
+        slots = set(self._large)
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                cell = self._cells.get((i, j))
+                if cell:
+                    slots.update(cell)
+        return slots
+
+    def _intersections(self, rects, exclude=()):
+        """Pairs (rectangle index, slot) of intersecting rectangles and bounds
+
+        The candidates of all rectangles are tested in a single vectorized
+        comparison.
+        """
+        self._refresh()
+        excluded = {self._slots[id(s)] for s in exclude if id(s) in self._slots}
+        rects = np.asarray(rects, dtype=np.float64).reshape(-1, 4)
+        rect_index = []
+        slots = []
+        for n, rect in enumerate(rects.tolist()):
+            candidates = self._candidates(*rect)
+            if candidates is None:
+                candidates = range(len(self._items))
+            candidates = [slot for slot in candidates if slot not in excluded]
+            rect_index.extend([n] * len(candidates))
+            slots.extend(candidates)
+        rect_index = np.array(rect_index, dtype=np.int64)
+        slots = np.array(slots, dtype=np.int64)
+        bounds = self._bounds[slots]
+        rects = rects[rect_index]
+        # comparisons with nan (empty slots) are False
+        hit = ((bounds[:, 0] <= rects[:, 2]) & (bounds[:, 2] >= rects[:, 0]) &
+               (bounds[:, 1] <= rects[:, 3]) & (bounds[:, 3] >= rects[:, 1]))
+        return rect_index[hit], slots[hit]
+
+    def query_rect(self, xmin, ymin, xmax, ymax):
+        """Sub structures whose bounds intersect the rectangle"""
+        rect_index, slots = self._intersections([(xmin, ymin, xmax, ymax)])
+        return [self._items[slot] for slot in np.sort(slots)]
+
+    def _distances(self, slots, point):
+        # distance from point to each bounding box (0 if inside)
+        bounds = self._bounds[slots]
+        dx = np.maximum(np.maximum(bounds[:, 0] - point[0], point[0] - bounds[:, 2]), 0)
+        dy = np.maximum(np.maximum(bounds[:, 1] - point[1], point[1] - bounds[:, 3]), 0)
+        return np.hypot(dx, dy)
+
+    def query_radius(self, center, radius):
+        """Sub structures whose bounds are at most radius away from center"""
+        self._refresh()
+        x, y = center[0], center[1]
+        slots = self._candidates(x - radius, y - radius, x + radius, y + radius)
+        if slots is None:
+            slots = np.arange(len(self._items))
+        else:
+            slots = np.fromiter(slots, dtype=np.int64, count=len(slots))
+        slots = np.sort(slots[self._distances(slots, (x, y)) <= radius])
+        return [self._items[slot] for slot in slots]
+
+    def nearest(self, point, k=1):
+        """The k sub structures whose bounds are the closest to point"""
+        self._refresh()
+        slots = np.flatnonzero(~np.isnan(self._bounds[:len(self._items), 0]))
+        distances = self._distances(slots, point)
+        if k < len(slots):
+            closest = np.argpartition(distances, k)[:k]
+        else:
+            closest = np.arange(len(slots))
+        closest = closest[np.argsort(distances[closest], kind='stable')]
+        return [self._items[slot] for slot in slots[closest]]
+
+    def overlaps(self, rects, exclude=()):
+        """Batch version of query_rect
+
+        :param rects: array like with shape (n, 4) (xmin, ymin, xmax, ymax)
+        :param exclude: sub structures to ignore (e.g. the one being placed)
+        :return: list with the sub structures overlapping each rectangle
+        """
+        rect_index, slots = self._intersections(rects, exclude)
+        result = [[] for rect in range(len(np.asarray(rects).reshape(-1, 4)))]
+        order = np.lexsort((slots, rect_index))
+        for n, slot in zip(rect_index[order].tolist(), slots[order].tolist()):
+            result[n].append(self._items[slot])
+        return result
+
+    def any_overlap(self, rects, exclude=()):
+        """Whether each rectangle intersects the bounds of any sub structure
+
+        :param rects: array like with shape (n, 4) (xmin, ymin, xmax, ymax)
+        :param exclude: sub structures to ignore (e.g. the one being placed)
+        :return: boolean array with shape (n,)
+        """
+        n_rects = len(np.asarray(rects).reshape(-1, 4))
+        rect_index, slots = self._intersections(rects, exclude)
+        return np.bincount(rect_index, minlength=n_rects) > 0
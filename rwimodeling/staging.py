@@ -0,0 +1,190 @@
+import errno
+import json
+import os
+import shutil
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl cloning a whole file on Linux (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+# file in the run directory listing the staged files (see clean_run_dir)
+STAGE_RECORD = '.rwimodeling-stage.json'
+
+# errors meaning a file system does not support reflinks or hardlinks
+_UNSUPPORTED = {errno.EXDEV, errno.EOPNOTSUPP, errno.EINVAL, errno.ENOTTY, errno.EPERM,
+                errno.EMLINK, errno.ENOSYS}
+
+
+def reflink(src, dst):
+    """Copy on write clone of src at dst (raises OSError if not supported)"""
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, 'reflink is not supported on this platform')
+    with open(src, 'rb') as src_file:
+        fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        try:
+            fcntl.ioctl(fd, FICLONE, src_file.fileno())
+        except OSError:
+            os.close(fd)
+            os.remove(dst)
+            raise
+        os.close(fd)
+    shutil.copystat(src, dst)
+
+
+class ProjectStager:
+    """Build run directories from a base InSite project
+
+    The base directory is listed once. Each staged file is a reflink (copy
+    on write, so the run may modify it), or when the file system does not
+    support them a hardlink, or a copy as last resort (see method). The
+    per run files (e.g. the .txrx and vehicle .object) are written by their
+    entities instead.
+
+    Hardlinks share the data with the base project: a program writing to
+    a staged file in place (instead of replacing it) would modify the base.
+    Use method='reflink' or 'copy' for files that the simulation modifies.
+
+    :param base_dir: directory of the base project
+    :param method: 'auto' (reflink, hardlink, copy), 'reflink' (fall back
+        to copy), 'hardlink' (fall back to copy) or 'copy'
+    :param ignore: function called with a path relative to base_dir,
+        returning True if it must not be staged (e.g. results of the base)
+    """
+
+    def __init__(self, base_dir, method='auto', ignore=None):
+        if method not in ('auto', 'reflink', 'hardlink', 'copy'):
+            raise ValueError('Unknown staging method "{}"'.format(method))
+        self.base_dir = base_dir
+        self.method = method
+        self._dirs = []
+        self._files = []
+        for dir_path, dir_names, file_names in os.walk(base_dir):
+            rel_dir = os.path.relpath(dir_path, base_dir)
+            dir_names.sort()
+            for dir_name in list(dir_names):
+                rel_path = os.path.normpath(os.path.join(rel_dir, dir_name))
+                if ignore is not None and ignore(rel_path):
+                    dir_names.remove(dir_name)
+                else:
+                    self._dirs.append(rel_path)
+            for file_name in sorted(file_names):
+                rel_path = os.path.normpath(os.path.join(rel_dir, file_name))
+                if file_name != STAGE_RECORD and (ignore is None or not ignore(rel_path)):
+                    self._files.append(rel_path)
+        # link methods that failed, by (base device, run device)
+        self._unsupported = set()
+
+    @property
+    def files(self):
+        """Paths of the files of the base project, relative to base_dir"""
+        return list(self._files)
+
+    def _link(self, src, dst, devices):
+        # stage a single file, return the method used
+        methods = {'auto': ('reflink', 'hardlink'), 'reflink': ('reflink',),
+                   'hardlink': ('hardlink',), 'copy': ()}[self.method]
+        for method in methods:
+            if (devices, method) in self._unsupported:
+                continue
+            try:
+                if method == 'reflink':
+                    reflink(src, dst)
+                else:
+                    os.link(src, dst)
+                return method
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED:
+                    raise
+                self._unsupported.add((devices, method))
+        shutil.copy2(src, dst)
+        return 'copy'
+
+    def stage(self, run_dir, files=None):
+        """Create run_dir with the base project and the per run files
+
+        :param run_dir: directory of the run, created if needed (files
+            already there are replaced)
+        :param files: {path relative to run_dir: content} where content is
+            an entity with a write(filename) method (TxRxFile, ObjectFile,
+            SetupFile...), str, bytes, or None to leave the base file out
+        :return: {path relative to run_dir: method}, method being 'reflink',
+            'hardlink', 'copy' or 'write'
+        """
+        files = {} if files is None else {os.path.normpath(path): content
+                                          for path, content in files.items()}
+        os.makedirs(run_dir, exist_ok=True)
+        for rel_dir in self._dirs:
+            os.makedirs(os.path.join(run_dir, rel_dir), exist_ok=True)
+        devices = (os.stat(self.base_dir).st_dev, os.stat(run_dir).st_dev)
+        staged = {}
+        for rel_path in self._files:
+            if rel_path in files:
+                continue
+            dst = os.path.join(run_dir, rel_path)
+            _remove(dst)
+            staged[rel_path] = self._link(os.path.join(self.base_dir, rel_path), dst, devices)
+        for rel_path, content in files.items():
+            if content is None:
+                continue
+            dst = os.path.join(run_dir, rel_path)
+            dst_dir = os.path.dirname(dst)
+            if dst_dir:
+                os.makedirs(dst_dir, exist_ok=True)
+            # never write through a hardlink to the base project
+            _remove(dst)
+            if isinstance(content, str):
+                with open(dst, 'w') as outfile:
+                    outfile.write(content)
+            elif isinstance(content, bytes):
+                with open(dst, 'wb') as outfile:
+                    outfile.write(content)
+            else:
+                content.write(dst)
+            staged[rel_path] = 'write'
+        with open(os.path.join(run_dir, STAGE_RECORD), 'w') as outfile:
+            json.dump({'files': staged, 'dirs': self._dirs}, outfile)
+        return staged
+
+
+def clean_run_dir(run_dir, keep_written=True):
+    """Remove the staged inputs of a finished run, keeping its results
+
+    Meant for runs made with delete_temp, after which the run directory only
+    holds the results and the staged project, e.g. from the callback of
+    Scheduler.run. The directories created by the staging are removed if
+    left empty.
+
+    :param keep_written: keep the per run files written by stage
+    :return: paths of the removed files, relative to run_dir
+    """
+    record_path = os.path.join(run_dir, STAGE_RECORD)
+    if not os.path.isfile(record_path):
+        return []
+    with open(record_path) as infile:
+        record = json.load(infile)
+    removed = []
+    for rel_path, method in record['files'].items():
+        if method == 'write' and keep_written:
+            continue
+        path = os.path.join(run_dir, rel_path)
+        if os.path.isfile(path):
+            os.remove(path)
+            removed.append(rel_path)
+    os.remove(record_path)
+    # deepest first
+    for rel_dir in sorted(record['dirs'], reverse=True):
+        path = os.path.join(run_dir, rel_dir)
+        if os.path.isdir(path) and not os.listdir(path):
+            os.rmdir(path)
+    return removed
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -1,8 +1,12 @@
+import re
+
 import numpy as np
 
-from .basecontainerobject import BaseContainerObject
+from .basecontainerobject import (BaseContainerObject, _add_parent, _remove_parent,
+                                  _partition_bounds, _set_bounds)
+from .events import build
 from .face import Face
-from .utils import match_or_error
+from .mesh import CompactMesh, MeshFace
 
 try:
     from shapely import geometry# import asMultiPoint
@@ -10,11 +14,117 @@ except ImportError:
     geometry = None
 
 class SubStructure(BaseContainerObject):
+    _begin_re = re.compile(r'^\s*begin_<sub_structure>\s+(?P<sstname>.*)\s*$')
+    _end_re = re.compile(r'^\s*end_<sub_structure>\s*$')
+    _kind = 'sub_structure'
 
     def __init__(self, **kargs):
+        # in compact mode the faces are [_face_start, _face_stop) of _mesh
+        self._mesh = None
         BaseContainerObject.__init__(self, Face, **kargs)
-        self._begin_re = r'^\s*begin_<sub_structure>\s+(?P<sstname>.*)\s*$'
-        self._end_re = r'^\s*end_<sub_structure>\s*$'
+
+    @property
+    def _child_list(self):
+        if self._mesh is None:
+            return self._faces
+        return [MeshFace(self._mesh, i, self)
+                for i in range(self._face_start, self._face_stop)]
+
+    @_child_list.setter
+    def _child_list(self, faces):
+        self._mesh = None
+        self._faces = faces
+        self._name_index = None
+
+    def _stored_children(self):
+        return self._faces
+
+    @property
+    def is_compact(self):
+        return self._mesh is not None
+
+    def _attach_mesh(self, mesh, face_start, face_stop):
+        """Use the faces [face_start, face_stop) of a CompactMesh as children"""
+        for face in self._faces:
+            _remove_parent(face, self)
+        self._faces = []
+        self._name_index = None
+        self._mesh = mesh
+        self._face_start = face_start
+        self._face_stop = face_stop
+
+    def expand(self):
+        """Leave compact mode, copying the faces out of the mesh"""
+        if self._mesh is not None:
+            faces = [face.to_face() for face in self._child_list]
+            self._child_list = faces
+            for face in faces:
+                _add_parent(face, self)
+            self._structure_changed()
+
+    def append(self, children):
+        self.expand()
+        BaseContainerObject.append(self, children)
+
+    def clear(self):
+        if self._mesh is not None:
+            self._child_list = []
+        BaseContainerObject.clear(self)
+
+    def _compute_bounds(self):
+        if self._mesh is not None:
+            return self._mesh.bounds(self._face_start, self._face_stop)
+        # compute the bounds of all faces at once
+        faces = [face for face in self._faces if not face._bounds_valid]
+        if len(faces) > 1:
+            offsets = np.zeros(len(faces) + 1, dtype=np.int64)
+            np.cumsum([face.n_vertices for face in faces], out=offsets[1:])
+            if offsets[-1] > 0:
+                vertice_array = np.concatenate([face.vertice_array for face in faces
+                                                if face.n_vertices > 0])
+                for face, bounds in zip(faces, _partition_bounds(vertice_array, offsets)):
+                    _set_bounds(face, bounds)
+        return BaseContainerObject._compute_bounds(self)
+
+    def translate(self, v):
+        if self._mesh is None:
+            BaseContainerObject.translate(self, v)
+        else:
+            self._mesh.translate(v, self._face_start, self._face_stop)
+            self.invalidate_bounds()
+
+    def transform(self, matrix):
+        if self._mesh is None:
+            BaseContainerObject.transform(self, matrix)
+        else:
+            self._mesh.transform(matrix, self._face_start, self._face_stop)
+            self.invalidate_bounds()
+
+    def _iter_content(self):
+        if self._mesh is None:
+            yield from BaseContainerObject._iter_content(self)
+        else:
+            yield self._mesh.serialize_faces(self._face_start, self._face_stop)
+
+    def _face_mesh(self):
+        """(CompactMesh, start, stop) holding the faces, packed in a new mesh if not compact"""
+        if self._mesh is not None:
+            return self._mesh, self._face_start, self._face_stop
+        mesh = CompactMesh.from_faces(self._faces)
+        return mesh, 0, mesh.n_faces
+
+    def __deepcopy__(self, memo):
+        if self._mesh is None or id(self._mesh) in memo:
+            return BaseContainerObject.__deepcopy__(self, memo)
+        # copy only the faces of this sub structure, not the whole mesh
+        inst = self.__class__.__new__(self.__class__)
+        memo[id(self)] = inst
+        self._deepcopy_state(inst, memo, skip=('_mesh', '_name_index'))
+        inst._name_index = None
+        inst._mesh = self._mesh.subset(self._face_start, self._face_stop)
+        inst._face_start = 0
+        inst._face_stop = inst._mesh.n_faces
+        return inst
 
     @property
     def face_list(self):
@@ -26,23 +136,28 @@ class SubStructure(BaseContainerObject):
     def as_polygon(self, axis=(0, 1)):
         if geometry is None:
             raise NotImplementedError('shapely module was not found')
-        return geometry.asMultiPoint(
+        return geometry.MultiPoint(
             self.as_vertice_array()[:,axis]
         ).convex_hull
 
     def as_vertice_array(self):
-        vertice_array = None
-        for face in self.face_list:
-            if face.vertice_array is not None:
-                if vertice_array is None:
-                    vertice_array = np.array(face.vertice_array)
-                else:
-                    vertice_array = np.concatenate((vertice_array, face.vertice_array))
-        return vertice_array
-
-    def rotate(self, angle):
-        for f in self.face_list:
-            f.rotate(angle)
+        """Vertices of all faces as a (n, 3) array (None if there are no vertices)
+
+        In compact mode a read only view of the mesh is returned, otherwise a
+        new array.
+        """
+        if self._mesh is not None:
+            v_start, v_stop = self._mesh.vertice_range(self._face_start, self._face_stop)
+            if v_stop == v_start:
+                return None
+            vertice_array = self._mesh.vertices[v_start:v_stop]
+            vertice_array.flags.writeable = False
+            return vertice_array
+        vertice_arrays = [face.vertice_array for face in self.face_list
+                          if face.vertice_array is not None]
+        if len(vertice_arrays) == 0:
+            return None
+        return np.concatenate(vertice_arrays)
 
     @property
     def _header(self):
@@ -56,11 +171,5 @@ class SubStructure(BaseContainerObject):
         tail_str += 'end_<sub_structure>\n'
         return tail_str
 
-    def _parse_head(self, infile):
-        match = match_or_error(self._begin_re, infile)
-        self.name = match.group('sstname')
-
     def from_file(infile):
-        inst = SubStructure()
-        BaseContainerObject.from_file(inst, infile)
-        return inst
\ No newline at end of file
+        return build(SubStructure(), infile)
\ No newline at end of file
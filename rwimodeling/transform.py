@@ -0,0 +1,69 @@
+"""4x4 affine transforms applied to (n, 3) vertice arrays
+
+The matrices act on column vectors [x, y, z, 1] and angles are given in
+degrees. Compose transforms with matrix products, e.g.
+np.matmul(translation_matrix(v), rotation_matrix(90)) rotates and then
+translates.
+"""
+import numpy as np
+
+
+def translation_matrix(v):
+    matrix = np.identity(4)
+    matrix[:3, 3] = v
+    return matrix
+
+
+def _about_pivot(linear, pivot):
+    # p' = A (p - pivot) + pivot
+    matrix = np.identity(4)
+    matrix[:3, :3] = linear
+    matrix[:3, 3] = np.asarray(pivot, dtype=np.float64) - np.matmul(linear, pivot)
+    return matrix
+
+
+def rotation_matrix(angle, axis=(0, 0, 1), pivot=(0, 0, 0)):
+    """Counterclockwise rotation by angle around an axis passing through pivot
+
+    :param angle: angle in degrees
+    :param axis: direction of the rotation axis (does not need to be normalized)
+    :param pivot: point of the rotation axis
+    :return: 4x4 matrix
+    """
+    axis = np.asarray(axis, dtype=np.float64)
+    norm = np.linalg.norm(axis)
+    if norm == 0:
+        raise ValueError('The rotation axis can not be null')
+    x, y, z = axis / norm
+    angle = np.radians(angle)
+    c = np.cos(angle)
+    s = np.sin(angle)
+    t = 1 - c
+    # Rodrigues' rotation formula
+    linear = np.array([
+        [t * x * x + c,     t * x * y - s * z, t * x * z + s * y],
+        [t * x * y + s * z, t * y * y + c,     t * y * z - s * x],
+        [t * x * z - s * y, t * y * z + s * x, t * z * z + c],
+    ])
+    # keep the coordinate along a coordinate axis exactly untouched
+    for i in np.flatnonzero(np.abs(axis / norm) == 1):
+        linear[i, :] = 0
+        linear[:, i] = 0
+        linear[i, i] = 1
+    return _about_pivot(linear, pivot)
+
+
+def scale_matrix(factor, pivot=(0, 0, 0)):
+    """Scale by factor (a scalar or one factor per axis) around pivot"""
+    factor = np.broadcast_to(np.asarray(factor, dtype=np.float64), (3,))
+    return _about_pivot(np.diag(factor), pivot)
+
+
+def apply_transform(vertice_array, matrix):
+    """Transform the rows of a (n, 3) array in place with one matrix product"""
+    matrix = np.asarray(matrix)
+    if matrix.shape != (4, 4):
+        raise ValueError('Transform matrix must be 4x4')
+    # compute in the dtype of the vertices (float32 stays float32)
+    matrix = matrix.astype(np.result_type(vertice_array.dtype, np.float32), copy=False)
+    vertice_array[...] = np.matmul(vertice_array, matrix[:3, :3].T) + matrix[:3, 3]
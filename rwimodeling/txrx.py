@@ -1,6 +1,14 @@
+import locale
+import os
+import re
+
+import numpy as np
+
+from . import cache as parse_cache
 from .basecontainerobject import BaseContainerObject
-from .utils import match_or_error
-from .verticelist import VerticeList
+from .errors import FormatError
+from .events import build, iterparse
+from .verticelist import VerticeList, format_vertices
 
 #from basecontainerobject import BaseContainerObject
 #from utils import match_or_error
@@ -8,59 +16,95 @@ from .verticelist import VerticeList
 
 
 class Location(VerticeList, BaseContainerObject):
+    # VerticeList._begin_re would be found first in the MRO
+    _begin_re = None
+    _end_header_re = VerticeList._begin_re
+    _end_re = re.compile(r'^\s*end_<location>\s*$')
+    _kind = 'location'
 
-    def __init__(self):
-        VerticeList.__init__(self)
+    def __init__(self, dtype=None):
+        VerticeList.__init__(self, dtype)
         BaseContainerObject.__init__(self, None)
-        self._end_header_re = VerticeList._begin_re
-        self._end_re = r'^\s*end_<location>\s*$'
         self.vertice_float_precision = 15
+        # where the vertices are in the file last parsed or written, used by
+        # TxRxFile.write(patch=True): (start, stop, vertice_float_precision)
+        # in bytes. Just after parsing start is None and stop the size of the
+        # vertices, the position is found when the file is verified
+        self._source_block = None
+        # whether the vertices changed since then
+        self._source_modified = False
+
+    def invalidate_bounds(self):
+        """Called when the vertices change, call it after modifying vertice_array in place"""
+        self._source_modified = True
+        # VerticeList.invalidate_bounds would not notify the TxRx holding the location
+        BaseContainerObject.invalidate_bounds(self)
 
     @property
     def _content(self):
         return VerticeList.serialize(self)
 
+    def _iter_content(self):
+        return VerticeList.iter_serialize(self)
+
     @property
     def _tail(self):
         return 'end_<location>\n'
 
     def from_file(infile):
-        inst = Location()
-        BaseContainerObject.from_file(inst, infile)
-        return inst
+        return build(Location(), infile)
 
-    def _parse_content(self, infile):
-        VerticeList.from_file(infile, self)
+    def _build(self, event, value, events):
+        """Fill the location from its record (see BaseContainerObject._build)"""
+        if event != 'location':
+            raise FormatError('Expected "begin_<location>", found {} event {!r}'.format(
+                event, value))
+        self._header_str = value.header
+        if len(value.vertice_array) > 0:
+            self.add_vertices(value.vertice_array)
+        # in the format of write, each '\n' read was '\r\n' in the file
+        n_bytes = value.stop_offset - value.start_offset + value.stop_line - value.start_line
+        self._source_block = (None, n_bytes, self.vertice_float_precision)
+        self._source_modified = False
 
     def serialize(self):
         return BaseContainerObject.serialize(self)
 
+    def iter_serialize(self):
+        return BaseContainerObject.iter_serialize(self)
+
 
 class TxRx(BaseContainerObject):
+    _end_header_re = re.compile(r'^\s*begin_<location>\s*$')
+    # the tail starts if the "content" is not a location
+    _begin_tail_re = re.compile(r'^(?!begin_<location>).*$')
+    _end_re = re.compile(r'^\s*end_<points>\s*$')
+    _kind = 'points'
 
     def __init__(self, name=''):
         BaseContainerObject.__init__(self, Location, name=name)
-        self.__begin_re = r'^\s*begin_<points>\s+(?P<name>.*)\s*$'
-        self._end_header_re = r'^\s*begin_<location>\s*$'
-        # the tail starts if the "content" is not a location
-        self._begin_tail_re = r'^(?!begin_<location>).*$'
-        self._end_re = r'^\s*end_<points>\s*$'
 
     def from_file(infile):
-        inst = TxRx()
-        BaseContainerObject.from_file(inst, infile)
-        return inst
+        return build(TxRx(), infile)
 
     @property
     def location_list(self):
         return self._child_list
 
-    def _parse_head(self, infile):
-        # read the name (could read here any parameter of interest)
-        match = match_or_error(self.__begin_re, infile)
-        self.name = match.group('name')
-        # read header that will not be parsed, but cached to output
-        BaseContainerObject._parse_head(self, infile)
+    def _build(self, event, value, events):
+        # the lines around the locations are not parsed, but kept to output
+        self._header_str = ''
+        self._tail_str = ''
+        BaseContainerObject._build(self, event, value, events)
+
+    def _header_text(self, text):
+        self._header_str += text
+
+    def _tail_text(self, text):
+        self._tail_str += text
+
+    def _end_line(self, line):
+        self._tail_str += line
 
     @property
     def _header(self):
@@ -72,22 +116,286 @@ class TxRx(BaseContainerObject):
 
 
 class TxRxFile(BaseContainerObject):
+    _end_header_re = re.compile(r'^\s*begin_<points>.*$')
+    _end_re = re.compile(r'^$')
 
     def __init__(self, name=''):
         BaseContainerObject.__init__(self, TxRx, name=name)
-        self._end_header_re = r'^\s*begin_<points>.*$'
-        self._end_re = r'^$'
+        # file the entities were parsed from or last written to (see write)
+        self._source = None
 
     @property
     def _tail(self):
         return ''
 
-    def from_file(infile):
-        inst = TxRxFile()
-        BaseContainerObject.from_file(inst, infile)
-        #print(inst.__dict__)
+    def _header_text(self, text):
+        self._header_str += text
+
+    def _tail_text(self, text):
+        # the file ends at the first empty line after the points, anything
+        # else is not part of the format (TxRxFile._header_text accepts it)
+        if not self._end_re.match(text.splitlines(True)[0]):
+            BaseContainerObject._header_text(self, text)
+
+    def from_file(infile, cache=False):
+        """Parse a txrx file
+
+        :param infile: opened file, LineCursor or any iterable of lines
+        :param cache: load from (or create) the binary sidecar of the file
+            (see the cache module)
+        """
+        # line numbers are only meaningful if the whole file is parsed
+        path = getattr(infile, 'name', None)
+        if not (isinstance(path, str) and os.path.isfile(path) and
+                getattr(infile, 'tell', None) is not None and infile.tell() == 0):
+            path = None
+
+        def parse(infile):
+            inst = TxRxFile()
+            stat = os.stat(path) if path is not None else None
+            inst._header_str = ''
+            inst._build_content(iterparse(infile))
+            if len(inst._child_list) == 0:
+                raise FormatError('Could not find "{}"'.format(TxRxFile._end_header_re.pattern))
+            if path is not None:
+                inst._source = _PatchSource(path, stat, inst._locations())
+            return inst
+        if cache:
+            return parse_cache.from_file_cached(infile, TxRxFile, parse)
+        return parse(infile)
+
+    def _locations(self):
+        return [location for txrx in self for location in txrx]
+
+    def _skeleton(self, locations):
+        """Text between the vertices of the locations, as written by serialize
+
+        The serialization is skeleton[0] + vertices of locations[0] +
+        skeleton[1] + ... + vertices of locations[-1] + skeleton[-1]
+        """
+        skeleton = []
+        chunks = [self._header]
+        for txrx in self:
+            chunks.append(txrx._header)
+            for location in txrx:
+                chunks.append(location._header)
+                skeleton.append(''.join(chunks))
+                chunks = [location._tail]
+            chunks.append(txrx._tail)
+        chunks.append(self._tail)
+        skeleton.append(''.join(chunks))
+        return skeleton
+
+    def write(self, filename, patch=False):
+        """Write the file
+
+        :param patch: only format the vertices of the locations modified
+            since the file was parsed (or last written) and copy everything
+            else from that file, updating filename in place if it is the
+            same file. The output is the same of a full write, which is done
+            instead when the rest of the entities changed or the source file
+            is not in the format write produces. An instance loaded from the
+            cache sidecar (from_file(cache=True)) has no source to copy from,
+            its first write is always a full write.
+        """
+        if not patch or self._source is None or not self._source.patch(self, filename):
+            self._write_tracked(filename)
+
+    def _write_tracked(self, filename):
+        # full write recording where the vertices of each location are
+        encoding = locale.getpreferredencoding(False)
+        locations = self._locations()
+        skeleton = self._skeleton(locations)
+        offset = 0
+        with open(filename, 'wb') as dst_file:
+            for text, location in zip(skeleton, locations + [None]):
+                data = _encode(text, encoding)
+                dst_file.write(data)
+                offset += len(data)
+                if location is not None:
+                    start = offset
+                    for chunk in VerticeList.iter_serialize(location):
+                        data = _encode(chunk, encoding)
+                        dst_file.write(data)
+                        offset += len(data)
+                    location._source_block = (start, offset, location.vertice_float_precision)
+                    location._source_modified = False
+        self._source = _PatchSource(filename, os.stat(filename), locations, skeleton)
+
+    def __deepcopy__(self, memo):
+        inst = BaseContainerObject.__deepcopy__(self, memo)
+        # the copy would patch the same file
+        inst._source = None
         return inst
 
+
+def _encode(text, encoding):
+    # same bytes written by a file opened with newline='\r\n'
+    return text.replace('\n', '\r\n').encode(encoding)
+
+
+def _needs_patch(location):
+    return (location._source_modified or
+            location.vertice_float_precision != location._source_block[2])
+
+
+def _matches(src_file, offset, data):
+    # whether the file holds data at offset
+    src_file.seek(offset)
+    return src_file.read(len(data)) == data
+
+
+def _vertices_match(src_file, location, start, n_bytes, encoding):
+    # nVertices line, first and last vertices of a location as written by
+    # VerticeList.serialize, in the n_bytes at start
+    n_vertices = location.n_vertices
+    head = _encode('nVertices {}\n'.format(n_vertices), encoding)
+    if n_vertices == 0:
+        return n_bytes == len(head) and _matches(src_file, start, head)
+    first, last = [_encode(line, encoding) for line in format_vertices(
+        location.vertice_array[[0, -1]], location.vertice_float_precision).splitlines(True)]
+    if n_vertices == 1:
+        return n_bytes == len(head) + len(first) and _matches(src_file, start, head + first)
+    return (len(head) + len(first) + len(last) <= n_bytes and
+            _matches(src_file, start, head + first) and
+            _matches(src_file, start + n_bytes - len(last), last))
+
+
+class _PatchSource:
+    """File a TxRxFile was parsed from or written to, used to patch it
+
+    :param path: path of the file
+    :param stat: os.stat of the file when it was read or written
+    :param locations: all locations of the TxRxFile, in order
+    :param skeleton: TxRxFile._skeleton when the file was written, None if
+        the file was parsed (the positions of the vertices are not known and
+        the file is checked before the first patch)
+    """
+
+    def __init__(self, path, stat, locations, skeleton=None):
+        self.path = os.path.abspath(path)
+        self.stat = (stat.st_size, stat.st_mtime_ns)
+        self.locations = locations
+        self.skeleton = skeleton
+
+    def _verify(self, locations, skeleton, encoding):
+        """Check that the parsed file is what write would produce
+
+        Only the text around the vertices is compared to the file, with the
+        nVertices line and the first and last vertices of the locations not
+        modified: their other vertices are taken to have the same format.
+        The spans of the vertices are then set in bytes.
+        """
+        spans = []
+        offset = 0
+        with open(self.path, 'rb') as src_file:
+            for text, location in zip(skeleton, locations + [None]):
+                data = _encode(text, encoding)
+                if not _matches(src_file, offset, data):
+                    return False
+                offset += len(data)
+                if location is None:
+                    break
+                n_bytes = location._source_block[1]
+                if not _needs_patch(location) and not _vertices_match(
+                        src_file, location, offset, n_bytes, encoding):
+                    return False
+                spans.append((offset, offset + n_bytes))
+                offset += n_bytes
+        if offset != self.stat[0]:
+            return False
+        for location, (start, stop) in zip(locations, spans):
+            location._source_block = (start, stop, location._source_block[2])
+        self.skeleton = skeleton
+        return True
+
+    def patch(self, txrx_file, filename):
+        """Write txrx_file to filename copying what did not change from the source
+
+        :return: False if a full write is needed
+        """
+        encoding = locale.getpreferredencoding(False)
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return False
+        if (stat.st_size, stat.st_mtime_ns) != self.stat:
+            return False
+        locations = txrx_file._locations()
+        if (len(locations) != len(self.locations) or
+                any(a is not b for a, b in zip(locations, self.locations))):
+            return False
+        skeleton = txrx_file._skeleton(locations)
+        if self.skeleton is None:
+            if not self._verify(locations, skeleton, encoding):
+                return False
+        elif skeleton != self.skeleton:
+            return False
+
+        changed = [location for location in locations if _needs_patch(location)]
+        blocks = [_encode(VerticeList.serialize(location), encoding) for location in changed]
+        if os.path.abspath(filename) == self.path:
+            self._patch_in_place(changed, blocks)
+        else:
+            self._patch_copy(filename, changed, blocks)
+        # shift the spans of the blocks after the ones that changed size
+        shift = 0
+        changed = dict(zip(map(id, changed), blocks))
+        for location in locations:
+            start, stop, precision = location._source_block
+            block = changed.get(id(location))
+            if block is None:
+                location._source_block = (start + shift, stop + shift, precision)
+            else:
+                location._source_block = (start + shift, start + shift + len(block),
+                                          location.vertice_float_precision)
+                shift += len(block) - (stop - start)
+            location._source_modified = False
+        stat = os.stat(filename)
+        self.path = os.path.abspath(filename)
+        self.stat = (stat.st_size, stat.st_mtime_ns)
+        return True
+
+    def _patch_in_place(self, changed, blocks):
+        with open(self.path, 'r+b') as dst_file:
+            resized = [len(block) != location._source_block[1] - location._source_block[0]
+                       for location, block in zip(changed, blocks)]
+            if True not in resized:
+                for location, block in zip(changed, blocks):
+                    dst_file.seek(location._source_block[0])
+                    dst_file.write(block)
+                return
+            # overwrite the blocks before the first one changing size, then
+            # rewrite the rest of the file
+            first = resized.index(True)
+            for location, block in zip(changed[:first], blocks[:first]):
+                dst_file.seek(location._source_block[0])
+                dst_file.write(block)
+            rest_start = changed[first]._source_block[0]
+            dst_file.seek(rest_start)
+            rest = dst_file.read()
+            dst_file.seek(rest_start)
+            offset = rest_start
+            for location, block in zip(changed[first:], blocks[first:]):
+                start, stop, precision = location._source_block
+                dst_file.write(rest[offset - rest_start:start - rest_start])
+                dst_file.write(block)
+                offset = stop
+            dst_file.write(rest[offset - rest_start:])
+            dst_file.truncate()
+
+    def _patch_copy(self, filename, changed, blocks):
+        with open(self.path, 'rb') as src_file, open(filename, 'wb') as dst_file:
+            offset = 0
+            for location, block in zip(changed, blocks):
+                start, stop, precision = location._source_block
+                dst_file.write(src_file.read(start - offset))
+                dst_file.write(block)
+                src_file.seek(stop)
+                offset = stop
+            dst_file.write(src_file.read())
+
+
 if __name__=='__main__':
     with open('../example/model.txrx') as infile:
         #print(Location.from_file(infile).serialize())
@@ -1,10 +1,74 @@
+import itertools
 import re
 
 from .errors import FormatError
 #from errors import FormatError
 
 
+class LineCursor:
+    """Line reader with one line of lookahead
+
+    Reads each line of the underlying iterable exactly once, so any iterable
+    of lines (opened files, pipes, sockets, generators, lists) can be parsed,
+    seekable or not. Lines are expected to keep their line terminator, as
+    returned when iterating over a text file. The end of the input is
+    signaled by an empty string, as in file.readline().
+
+    :param lines: iterable of lines
+    """
+
+    def __init__(self, lines):
+        self._lines = iter(lines)
+        self._next_line = None
+        # keep the name of the wrapped file, it is used by some parsers
+        self.name = getattr(lines, 'name', None)
+        # number of lines and characters consumed so far
+        self.line_number = 0
+        self.offset = 0
+
+    def peek(self):
+        """Return the next line without consuming it"""
+        if self._next_line is None:
+            self._next_line = next(self._lines, '')
+        return self._next_line
+
+    def readline(self):
+        """Consume and return the next line"""
+        line = self.peek()
+        self._next_line = None
+        if line:
+            self.line_number += 1
+            self.offset += len(line)
+        return line
+
+    def readlines(self, n_lines):
+        """Consume and return the next n_lines lines (fewer at the end of the input)"""
+        if n_lines <= 0:
+            return []
+        if self._next_line is None:
+            lines = list(itertools.islice(self._lines, n_lines))
+        else:
+            lines = [self._next_line]
+            self._next_line = None
+            if lines[0]:
+                lines.extend(itertools.islice(self._lines, n_lines - 1))
+            else:
+                lines = []
+        self.line_number += len(lines)
+        self.offset += sum(map(len, lines))
+        return lines
+
+
+def as_line_cursor(infile):
+    """Wrap infile in a LineCursor unless it is one already"""
+    if isinstance(infile, LineCursor):
+        return infile
+    return LineCursor(infile)
+
+
 def look_next_line(infile):
+    if isinstance(infile, LineCursor):
+        return infile.peek()
     now = infile.tell()
     line = infile.readline()
     infile.seek(now)
@@ -12,10 +76,16 @@ def look_next_line(infile):
 
 
 def match_or_error(exp, infile):
-    line = infile.readline()
-    match = re.match(exp, line)
+    return match_line_or_error(exp, infile.readline())
+
+
+def match_line_or_error(exp, line):
+    """Match of exp on a line already read, FormatError if it does not match"""
+    if isinstance(exp, str):
+        exp = re.compile(exp)
+    match = exp.match(line)
     if match:
         return match
     else:
         raise FormatError(
-            'Expected "{}", found "{}"'.format(exp, line))
\ No newline at end of file
+            'Expected "{}", found "{}"'.format(exp.pattern, line))
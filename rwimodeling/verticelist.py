@@ -1,14 +1,109 @@
+import contextlib
+import re
+
 import numpy as np
 
 from .errors import FormatError
-from .utils import match_or_error
+from .transform import apply_transform, rotation_matrix, scale_matrix
+from .utils import match_or_error, as_line_cursor
 #from errors import FormatError
-#from utils import match_or_error
+#from utils import match_or_error, as_line_cursor
+
+
+# Coordinate dtypes, from the fastest to the most precise.
+#
+# Text is always parsed as float64 (correctly rounded, as float() does) and
+# formatted through float64, so at a given vertice_float_precision:
+#   * float64 (default): a coordinate with up to 15 significant digits is
+#     written back exactly as read. Arithmetic uses NumPy's SIMD paths.
+#   * float32: 4 bytes per coordinate for memory bound bulk jobs. Only up to
+#     6 significant digits survive a round trip; extra decimals show the
+#     float32 representation error.
+#   * longdouble: the behavior of older versions, same round trip guarantee
+#     of float64 but transforms are computed in extended precision (16 bytes
+#     per coordinate on x86-64 Linux and no SIMD).
+VERTICE_DTYPES = (np.float32, np.float64, np.longdouble)
+
+_default_dtype = np.dtype(np.float64)
+
+
+def _check_dtype(dtype):
+    dtype = np.dtype(dtype)
+    if dtype not in [np.dtype(d) for d in VERTICE_DTYPES]:
+        raise ValueError('Coordinate dtype must be one of {}, not {}'.format(
+            [np.dtype(d).name for d in VERTICE_DTYPES], dtype))
+    return dtype
+
+
+def get_default_dtype():
+    """dtype used by vertice lists created without an explicit dtype"""
+    return _default_dtype
+
+
+def set_default_dtype(dtype):
+    """Set the package wide coordinate dtype (see VERTICE_DTYPES)
+
+    Only affects vertice lists created afterwards, including the ones created
+    by the parsers.
+
+    :return: the previous default dtype
+    """
+    global _default_dtype
+    previous = _default_dtype
+    _default_dtype = _check_dtype(dtype)
+    return previous
+
+
+@contextlib.contextmanager
+def default_dtype(dtype):
+    """Context manager setting the default coordinate dtype, e.g.
+
+    with default_dtype(np.float32):
+        obj = ObjectFile.from_file(infile)
+    """
+    previous = set_default_dtype(dtype)
+    try:
+        yield
+    finally:
+        set_default_dtype(previous)
+
+
+def format_vertices(vertice_array, precision):
+    """Format the rows of a (n, 3) array as "x y z" lines
+
+    All the coordinates are formatted in a single operation. The result is the
+    same of '{:.<precision>f}'.format(value) for every coordinate (values are
+    formatted as Python floats, as str.format does for any numpy scalar).
+
+    :param vertice_array: array like with shape (n, 3)
+    :param precision: number of decimal places
+    :return: string with one line per vertice
+    """
+    vertice_array = np.asarray(vertice_array)
+    n_vertices = len(vertice_array)
+    if n_vertices == 0:
+        return ''
+    line_format = ' '.join(['%.{0}f'.format(precision)] * 3) + '\n'
+    values = vertice_array.astype(np.float64, copy=False).ravel().tolist()
+    return (line_format * n_vertices) % tuple(values)
+
+
+# number of vertices formatted at once by iter_serialize
+SERIALIZE_CHUNK_SIZE = 8192
 
 
 class BaseVerticeList:
-    def __init__(self):
-        self._vertice_array = None
+
+    def __init__(self, dtype=None):
+        # dtype used to store the coordinates, fixed at creation
+        self._vertice_dtype = get_default_dtype() if dtype is None else _check_dtype(dtype)
+        # the vertices are the first _n_vertices rows of _vertice_buffer,
+        # which grows by doubling its capacity
+        self._vertice_buffer = None
+        self._n_vertices = 0
+        # axis aligned bounds, computed on the first access
+        self._bounds_cache = None
+        self._bounds_valid = False
         self.vertice_float_precision = 10
 
     @property
@@ -22,73 +117,185 @@ class BaseVerticeList:
     @vertice_float_precision.setter
     def vertice_float_precision(self, value):
         self._vertice_float_precision = value
-        self._vertice_format_string = ' '.join([self.float_format_string for i in range(3)]) + '\n'
+
+    @property
+    def _vertice_format_string(self):
+        return ' '.join([self.float_format_string for i in range(3)]) + '\n'
 
     @property
     def n_vertices(self):
-        if self._vertice_array is None:
-            return 0
-        return len(self._vertice_array)
+        return self._n_vertices
+
+    @property
+    def vertice_dtype(self):
+        return self._vertice_dtype
+
+    def invalidate_bounds(self):
+        """Drop the cached bounds, call it after modifying vertice_array in place"""
+        self._bounds_valid = False
+        self._bounds_cache = None
+
+    def _compute_bounds(self):
+        if self._n_vertices == 0:
+            return None
+        vertice_array = self.vertice_array
+        return np.array((vertice_array.min(axis=0), vertice_array.max(axis=0)))
+
+    @property
+    def bounds(self):
+        """Axis aligned bounds as a (2, 3) array [min, max] (None if there are no vertices)
+
+        The result is cached until the vertices change.
+        """
+        if not self._bounds_valid:
+            self._bounds_cache = self._compute_bounds()
+            if self._bounds_cache is not None:
+                self._bounds_cache.flags.writeable = False
+            self._bounds_valid = True
+        return self._bounds_cache
 
     def translate(self, v):
-        self._vertice_array += v
+        if self._n_vertices > 0:
+            self.vertice_array[...] += v
+            self.invalidate_bounds()
 
     def clear(self):
-        self._vertice_array = None
+        self._vertice_buffer = None
+        self._n_vertices = 0
+        self.invalidate_bounds()
 
     @property
     def vertice_array(self):
-        return self._vertice_array
+        """View of the vertices as a (n_vertices, 3) array (None if empty)"""
+        if self._n_vertices == 0:
+            return None
+        return self._vertice_buffer[:self._n_vertices]
+
+    def _reserve(self, n_vertices):
+        """Make room for at least n_vertices, growing the capacity geometrically"""
+        if self._vertice_buffer is None:
+            self._vertice_buffer = np.empty((n_vertices, 3), dtype=self._vertice_dtype)
+        elif len(self._vertice_buffer) < n_vertices:
+            capacity = max(n_vertices, 2 * len(self._vertice_buffer))
+            buffer = np.empty((capacity, 3), dtype=self._vertice_dtype)
+            buffer[:self._n_vertices] = self._vertice_buffer[:self._n_vertices]
+            self._vertice_buffer = buffer
 
     def add_vertice(self, v):
         if len(v) != 3:
             raise FormatError('Vertices must have 3 coordenates (x, y, z)')
-        if self._vertice_array is None:
-            self._vertice_array = np.array(v, ndmin=2, dtype=np.longdouble)
-        else:
-            self._vertice_array = np.concatenate(
-                (self._vertice_array, np.array(v, ndmin=2)))
+        self._reserve(self._n_vertices + 1)
+        self._vertice_buffer[self._n_vertices] = v
+        self._n_vertices += 1
+        self.invalidate_bounds()
 
-    def rotate(self, angle):
-        """Rotate counterclockwise by a given angle around a given origin.
+    def add_vertices(self, vertices):
+        """Append a block of vertices
 
-        The angle should be given in degrees.
+        :param vertices: array like with shape (n, 3)
         """
-        angle = np.radians(angle)
+        vertices = np.asarray(vertices)
+        if vertices.ndim != 2 or vertices.shape[1] != 3:
+            raise FormatError('Vertices must have 3 coordenates (x, y, z)')
+        n_vertices = self._n_vertices + len(vertices)
+        self._reserve(n_vertices)
+        self._vertice_buffer[self._n_vertices:n_vertices] = vertices
+        self._n_vertices = n_vertices
+        self.invalidate_bounds()
+
+    def transform(self, matrix):
+        """Apply a 4x4 affine transform (see the transform module) to all vertices"""
+        if self._n_vertices > 0:
+            apply_transform(self.vertice_array, matrix)
+            self.invalidate_bounds()
 
-        c = np.cos(angle)
-        s = np.sin(angle)
-        rot_mat = np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+    def rotate(self, angle, axis=(0, 0, 1), pivot=(0, 0, 0)):
+        """Rotate counterclockwise by a given angle around a given axis.
 
-        for i, v in enumerate(self._vertice_array):
-            self._vertice_array[i, :] = np.matmul(rot_mat, v)
+        The angle should be given in degrees, by default the rotation is
+        around the z axis passing through the origin.
+        """
+        self.transform(rotation_matrix(angle, axis, pivot))
+
+    def scale(self, factor, pivot=(0, 0, 0)):
+        """Scale by factor (scalar or per axis) around pivot"""
+        self.transform(scale_matrix(factor, pivot))
 
 
 class VerticeList(BaseVerticeList):
 
-    _begin_re = r'\s*nVertices\s+(?P<nv>\d+)\s*$'
+    _begin_re = re.compile(r'\s*nVertices\s+(?P<nv>\d+)\s*$')
 
-    def __init__(self):
-        BaseVerticeList.__init__(self)
+    def __init__(self, dtype=None):
+        BaseVerticeList.__init__(self, dtype)
 
     def invert_direction(self):
-        self._vertice_array = np.flip(self._vertice_array, 0)
+        if self._n_vertices > 0:
+            self.vertice_array[...] = np.flip(self.vertice_array, 0)
+            # the bounds do not change, but the containers are told the
+            # vertices did
+            self.invalidate_bounds()
 
     def serialize(self):
         mstr = ''
         mstr += 'nVertices {}\n'.format(self.n_vertices)
-        for v in self._vertice_array:
-            mstr += self._vertice_format_string.format(*v)
+        if self._n_vertices > 0:
+            mstr += format_vertices(self._vertice_buffer[:self._n_vertices],
+                                    self.vertice_float_precision)
         return mstr
 
+    def iter_serialize(self):
+        """Same as serialize, but formats SERIALIZE_CHUNK_SIZE vertices at a time"""
+        yield 'nVertices {}\n'.format(self.n_vertices)
+        for start in range(0, self._n_vertices, SERIALIZE_CHUNK_SIZE):
+            stop = min(start + SERIALIZE_CHUNK_SIZE, self._n_vertices)
+            yield format_vertices(self._vertice_buffer[start:stop],
+                                  self.vertice_float_precision)
+
     def from_file(infile, inst=None):
         if inst is None:
             inst = VerticeList()
-        vertices_match = match_or_error(VerticeList._begin_re, infile)
-        n_vertices = int(vertices_match.group('nv'))
+        vertice_array = read_vertice_list(as_line_cursor(infile))
+        if len(vertice_array) > 0:
+            inst.add_vertices(vertice_array)
+        return inst
 
-        for v in range(n_vertices):
-            line = infile.readline()
-            inst.add_vertice([float(i) for i in line.split()])
 
-        return inst
+# blocks with fewer vertices are converted by splitting their text, loadtxt
+# converts faster but has a larger fixed cost
+_LOADTXT_MIN_VERTICES = 16
+
+
+def read_vertice_list(infile):
+    """Read "nVertices n" and the n vertices that follow it
+
+    :param infile: LineCursor over the input
+    :return: (n, 3) float64 array
+    """
+    vertices_match = match_or_error(VerticeList._begin_re, infile)
+    n_vertices = int(vertices_match.group('nv'))
+    return parse_vertices(infile.readlines(n_vertices), n_vertices)
+
+
+def parse_vertices(lines, n_vertices):
+    """Convert n_vertices "x y z" lines to a (n_vertices, 3) float64 array
+
+    The whole block is converted in one call, the values are parsed as
+    float64 (as float() does).
+    """
+    if n_vertices == 0:
+        return np.empty((0, 3))
+    try:
+        if n_vertices < _LOADTXT_MIN_VERTICES:
+            # split per line, lines with the wrong number of values do not
+            # convert (as with loadtxt)
+            vertices = np.array([line.split() for line in lines], dtype=np.float64)
+        else:
+            vertices = np.loadtxt(lines, dtype=np.float64, comments=None, ndmin=2)
+    except ValueError as e:
+        raise FormatError('Invalid vertice list: {}'.format(e))
+    if vertices.shape != (n_vertices, 3):
+        raise FormatError(
+            'Expected {} vertices with 3 coordenates (x, y, z), found {}'.format(
+                n_vertices, vertices.shape))
+    return vertices
@@ -1,83 +1,508 @@
+import re
 from xml.etree import ElementTree
+from xml.parsers import expat
+
+import numpy as np
 
 from .errors import FormatError
 
-class X3dXmlFile3_3:
+# bytes read at once from the xml files
+CHUNK_SIZE = 1 << 20
+
+
+def _escape_attribute(text):
+    # as ElementTree escapes attribute values
+    return (text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+            .replace('"', '&quot;').replace('\n', '&#10;'))
+
+
+_MARKER_RE = re.compile(r'<!--rwimodeling insert \d+-->')
+
+
+class _InsertWriter:
+    """File like object writing the inserted text in place of its markers
+
+    The text of a marker may be split across calls to write, so the text
+    from the last '<' not yet closed is kept until the next call (or flush).
+
+    :param inserts: {marker: function returning the chunks of text to write}
+    """
+
+    def __init__(self, dst_file, inserts):
+        self._dst_file = dst_file
+        self._inserts = inserts
+        self._pending = ''
+
+    def write(self, data):
+        text = self._pending + data
+        offset = 0
+        for match in _MARKER_RE.finditer(text):
+            chunks = self._inserts.get(match.group())
+            if chunks is None:
+                continue
+            self._dst_file.write(text[offset:match.start()])
+            for chunk in chunks():
+                self._dst_file.write(chunk)
+            offset = match.end()
+        pending = text.rfind('<', offset)
+        if pending == -1 or '>' in text[pending:]:
+            pending = len(text)
+        self._dst_file.write(text[offset:pending])
+        self._pending = text[pending:]
+        return len(data)
+
+    def flush(self):
+        self._dst_file.write(self._pending)
+        self._pending = ''
+
+
+_STEP_RE = re.compile(r'^(?P<tag>[^\[\]]+)(?P<predicates>(\[[^\]]*\])*)$')
+_PREDICATE_RE = re.compile(
+    r'''\[@(?P<name>[^=\]]+)(=(?P<quote>['"])(?P<value>.*?)(?P=quote))?\]''')
+
+
+def _compile_xpath(xpath):
+    """Steps (descendant, tag, [(attribute, value)]) of a simple xpath
 
-    def __init__(self, file_name):
+    Supports the subset of the ElementTree syntax made of tags, '*', '//'
+    and attribute predicates ([@name] and [@name='value']), relative to the
+    root element.
+    """
+    path = xpath[2:] if xpath.startswith('./') else xpath
+    if path.startswith('/') and not xpath.startswith('./'):
+        raise FormatError('Absolute xpath is not supported: "{}"'.format(xpath))
+    steps = []
+    descendant = False
+    for part in path.split('/'):
+        if part == '':
+            descendant = True
+            continue
+        if part == '.' and not descendant:
+            continue
+        match = _STEP_RE.match(part)
+        if match is None:
+            raise FormatError('Unsupported xpath: "{}"'.format(xpath))
+        predicates = []
+        for predicate in re.findall(r'\[[^\]]*\]', match.group('predicates')):
+            predicate_match = _PREDICATE_RE.fullmatch(predicate)
+            if predicate_match is None:
+                raise FormatError('Unsupported xpath predicate "{}" in "{}"'.format(
+                    predicate, xpath))
+            predicates.append((predicate_match.group('name'), predicate_match.group('value')))
+        steps.append((descendant, match.group('tag'), predicates))
+        descendant = False
+    if descendant:
+        raise FormatError('Unsupported xpath: "{}"'.format(xpath))
+    return steps
+
+
+def _step_matches(step, element):
+    descendant, tag, predicates = step
+    name, attributes = element
+    if tag != '*' and tag != name:
+        return False
+    for attribute, value in predicates:
+        if attribute not in attributes:
+            return False
+        if value is not None and attributes[attribute] != value:
+            return False
+    return True
+
+
+def _xpath_matches(steps, path, i=0, j=0):
+    """Whether steps[i:] select path[j:] (elements below the root)"""
+    if i == len(steps):
+        return j == len(path)
+    descendant, tag, predicates = steps[i]
+    candidates = range(j, len(path)) if descendant else range(j, min(j + 1, len(path)))
+    for k in candidates:
+        if _step_matches(steps[i], path[k]) and _xpath_matches(steps, path, i + 1, k + 1):
+            return True
+    return False
+
+
+def _tag_end(src_file, start):
+    """Offset just after the '>' of the tag starting at start and if it is empty (<a/>)"""
+    src_file.seek(start)
+    offset = start
+    quote = None
+    previous = None
+    while True:
+        data = src_file.read(4096)
+        if not data:
+            raise FormatError('Unterminated tag at byte {}'.format(start))
+        for byte in data:
+            offset += 1
+            if quote is not None:
+                if byte == quote:
+                    quote = None
+            elif byte in b'"\'':
+                quote = byte
+            elif byte == ord('>'):
+                return offset, previous == ord('/')
+            previous = byte
+
+
+class _X3dXmlBase:
+    """X3D XML file in which ProjectedPoint lists or the geometry can be replaced or extended
+
+    By default the whole XML tree is loaded. With streaming=True the file is
+    not loaded: add_vertice_list and _add_object record the xpath, and write
+    makes a pass over the source with expat to find the selected elements
+    and another one copying the source, byte by byte except for the selected
+    elements, so the memory used does not depend on the size of the scene.
+    In that mode the source formatting is kept everywhere else (write of the
+    tree normalizes it) and the xpaths are limited to tags, '*', '//' and
+    attribute predicates ([@a] and [@a='v']). Selection errors are raised by
+    write.
+
+    :param file_name: path of the X3D XML file (it is not modified)
+    :param streaming: do not load the whole tree
+    """
+    _double_tag = 'Double'
+    _cartesian_point_tag = 'CartesianPoint'
+    # prefix of the names of the geometry elements (see _add_object)
+    _rxapi_prefix = ''
+
+    def __init__(self, file_name, streaming=False):
         self._file_name = file_name
-        string = open(file_name, 'r').read().replace('::','__')
-        with open(file_name, "w") as text_file:
-            text_file.write(string)
-        self._load_et(file_name)
+        self._streaming = streaming
+        # (xpath, clear, function returning the bytes to insert) added in
+        # streaming mode
+        self._edits = []
+        # functions returning the text to insert by the comment marking it in
+        # the tree
+        self._inserts = {}
+        if not streaming:
+            self._load_et(file_name)
 
     def _load_et(self, file_name):
         self._et = ElementTree.parse(file_name)
 
-    def add_vertice_list(self, vertice_list, xpath, clear=True):
-        point_list = self._et.findall(xpath)
-        if len(point_list) != 1:
+    def _points_xml(self, vertice_list):
+        """ProjectedPoint elements for the vertices of vertice_list, serialized
+
+        All the coordinates are formatted by a single operation (see
+        format_vertices), the text is the one ElementTree writes for the same
+        elements.
+        """
+        if vertice_list.n_vertices == 0:
+            return ''
+        point_format = '<ProjectedPoint>{}</ProjectedPoint>'.format(
+            self._cartesian_point_xml(vertice_list.vertice_float_precision))
+        values = vertice_list.vertice_array.astype(np.float64, copy=False).ravel().tolist()
+        return (point_format * vertice_list.n_vertices) % tuple(values)
+
+    def _cartesian_point_xml(self, precision):
+        # % template of a CartesianPoint element
+        value = '%.{}f'.format(precision)
+        return '<{0}>{1}</{0}>'.format(
+            self._cartesian_point_tag,
+            ''.join('<{0}><{1} Value="{2}"></{1}></{0}>'.format(name, self._double_tag, value)
+                    for name in ('X', 'Y', 'Z')))
+
+    def _faces_xml(self, mesh, start, stop, escape):
+        """Face elements for the faces [start, stop) of a CompactMesh, serialized
+
+        As CompactMesh.serialize_faces, the text is built by a single
+        formatting operation over all the coordinates and face fields.
+        """
+        face_head = ('<{0}Face><Name><{0}String Value="%s"></{0}String></Name>'
+                     '<Material><{0}Integer Value="%s"></{0}Integer></Material>'
+                     '<Vertices>').format(self._rxapi_prefix)
+        face_tail = '</Vertices></{}Face>'.format(self._rxapi_prefix)
+        point_formats = {}
+        template = []
+        values = []
+        offsets = mesh.face_offsets[start:stop + 1].tolist()
+        precisions = mesh.face_precisions[start:stop].tolist()
+        coordinates = mesh.vertices[offsets[0]:offsets[-1]].astype(
+            np.float64, copy=False).ravel().tolist()
+        for i, precision in enumerate(precisions):
+            point_format = point_formats.get(precision)
+            if point_format is None:
+                point_format = point_formats[precision] = self._cartesian_point_xml(precision)
+            n_vertices = offsets[i + 1] - offsets[i]
+            template.append(face_head)
+            template.append(point_format * n_vertices)
+            template.append(face_tail)
+            values.append(escape(mesh.face_names[start + i]))
+            values.append(escape(str(mesh.face_materials[start + i])))
+            first = 3 * (offsets[i] - offsets[0])
+            values.extend(coordinates[first:first + 3 * n_vertices])
+        return ''.join(template) % tuple(values)
+
+    def _object_xml(self, object_file):
+        """StructureGroup elements for the geometry of object_file, serialized
+
+        Yields the text in chunks, one per sub structure.
+        """
+        # names repeat a lot across faces
+        escaped = {}
+
+        def escape(text):
+            value = escaped.get(text)
+            if value is None:
+                value = escaped[text] = _escape_attribute(text)
+            return value
+
+        def head(tag, list_tag, name):
+            return ('<{0}{1}><Name><{0}String Value="{2}"></{0}String></Name><{3}>'.format(
+                self._rxapi_prefix, tag, escape(name), list_tag))
+
+        def tail(tag, list_tag):
+            return '</{2}></{0}{1}>'.format(self._rxapi_prefix, tag, list_tag)
+
+        for structure_group in object_file:
+            chunks = [head('StructureGroup', 'Structures', structure_group.name)]
+            for structure in structure_group:
+                chunks.append(head('Structure', 'SubStructures', structure.name))
+                for sub_structure in structure:
+                    mesh, start, stop = sub_structure._face_mesh()
+                    chunks.append(head('SubStructure', 'Faces', sub_structure.name))
+                    chunks.append(self._faces_xml(mesh, start, stop, escape))
+                    chunks.append(tail('SubStructure', 'Faces'))
+                    yield ''.join(chunks)
+                    chunks = []
+                chunks.append(tail('Structure', 'SubStructures'))
+            chunks.append(tail('StructureGroup', 'Structures'))
+            yield ''.join(chunks)
+
+    def _insert(self, xpath, clear, chunks):
+        """Insert serialized elements in the element selected by xpath
+
+        :param chunks: function returning the text to insert as an iterable
+            of str, called by write
+        """
+        if self._streaming:
+            def data():
+                for chunk in chunks():
+                    yield chunk.encode('us-ascii', 'xmlcharrefreplace')
+            self._edits.append((xpath, clear, data))
+            return
+        element = self._et.findall(xpath)
+        if len(element) != 1:
             raise FormatError(
-                'xpath is not selecting only one element. xpath: "{}" selected: "{}"'.format(xpath, point_list))
-        point_list = point_list[0]
+                'xpath is not selecting only one element. xpath: "{}" selected: "{}"'.format(xpath, element))
+        element = element[0]
         if clear:
-            point_list.clear()
+            element.clear()
+        # building the elements is much slower than formatting them, so a
+        # comment marks where write puts the formatted text
+        marker = 'rwimodeling insert {}'.format(len(self._inserts))
+        self._inserts['<!--{}-->'.format(marker)] = chunks
+        element.append(ElementTree.Comment(marker))
+
+    def add_vertice_list(self, vertice_list, xpath, clear=True):
+        # the points are formatted now, later changes to vertice_list are
+        # not written
+        points = self._points_xml(vertice_list)
+        self._insert(xpath, clear, lambda: (points,))
+
+    def _add_object(self, object_file, xpath, clear=True):
+        """Insert the geometry of an ObjectFile in the element selected by xpath
+
+        Private until the layout below is checked against a project exported
+        by InSite, it is a guess of what InSiteProject.run_x3d reads.
+
+        Each structure group becomes a StructureGroup element, holding
+        Structure, SubStructure and Face elements (the names of InSite 3.3
+        have the remcom::rxapi:: prefix):
+
+            <StructureGroup>
+              <Name><String Value="name"/></Name>
+              <Structures><Structure>...
+                <SubStructures><SubStructure>...
+                  <Faces><Face>
+                    <Name><String Value="name"/></Name>
+                    <Material><Integer Value="0"/></Material>
+                    <Vertices><CartesianPoint>...</CartesianPoint>...</Vertices>
+                  </Face>...
 
-        def add_vertice(vertice):
-            def add_point(point, name, value):
-                name_element = ElementTree.SubElement(point, name)
-                double = ElementTree.SubElement(name_element, 'remcom__rxapi__Double')
-                double.set('Value', vertice_list.float_format_string.format(value))
+        The faces are formatted from the vertice arrays (the mesh of a
+        compact ObjectFile or of a prototype, see CompactMesh) when the file
+        is written, one sub structure at a time, so the XML of the whole
+        scene is never held in memory, and changes made to object_file
+        until then are written.
 
-            projected_point = ElementTree.SubElement(point_list, 'ProjectedPoint')
-            point = ElementTree.SubElement(projected_point, 'remcom__rxapi__CartesianPoint')
+        :param object_file: ObjectFile whose structure groups are inserted
+        :param xpath: selects the element that will hold the structure groups
+        :param clear: remove the children of that element first
+        """
+        self._insert(xpath, clear, lambda: self._object_xml(object_file))
 
-            for name, value in zip(('X', 'Y', 'Z'), vertice):
-                add_point(point, name, value)
+    def _mangle(self, name):
+        # name of an element as seen by the xpaths
+        return name
 
-        for vertice in vertice_list.vertice_array:
-            add_vertice(vertice)
+    def _scan(self):
+        """Spans of the elements selected by the xpaths of the edits
 
+        :return: {xpath: [(start, end)]} start is the offset of the start tag
+            and end of the end tag (equal to start for empty elements)
+        """
+        xpaths = {xpath: _compile_xpath(xpath) for xpath, clear, chunks in self._edits}
+        selected = {xpath: [] for xpath in xpaths}
+        # (name, attributes) of the open elements below the root
+        path = []
+        # per open element, xpaths selecting it and its start offset
+        open_elements = []
+        parser = expat.ParserCreate()
+        parser.buffer_text = True
+
+        def start_element(name, attributes):
+            if open_elements:
+                path.append((self._mangle(name), attributes))
+            matches = [xpath for xpath, steps in xpaths.items()
+                       if _xpath_matches(steps, path)]
+            open_elements.append((matches, parser.CurrentByteIndex))
+
+        def end_element(name):
+            matches, start = open_elements.pop()
+            for xpath in matches:
+                selected[xpath].append((start, parser.CurrentByteIndex))
+            if open_elements:
+                path.pop()
+
+        parser.StartElementHandler = start_element
+        parser.EndElementHandler = end_element
+        with open(self._file_name, 'rb') as src_file:
+            try:
+                for data in iter(lambda: src_file.read(CHUNK_SIZE), b''):
+                    parser.Parse(data, False)
+                parser.Parse(b'', True)
+            except expat.ExpatError as e:
+                raise FormatError('Invalid XML file "{}": {}'.format(self._file_name, e))
+        return selected
+
+    def _write_streaming(self, file_name):
+        selected = self._scan()
+        # edits of each selected element, by start offset
+        elements = {}
+        for xpath, clear, chunks in self._edits:
+            spans = selected[xpath]
+            if len(spans) != 1:
+                raise FormatError(
+                    'xpath is not selecting only one element. xpath: "{}" selected: "{}"'.format(
+                        xpath, len(spans)))
+            start, end = spans[0]
+            elements.setdefault((start, end), []).append((clear, chunks))
+        spans = sorted(elements)
+        for (start, end), (next_start, next_end) in zip(spans[:-1], spans[1:]):
+            if next_start < end:
+                raise FormatError('The elements selected by the xpaths can not be nested')
+
+        with open(self._file_name, 'rb') as src_file, open(file_name, 'wb') as dst_file:
+
+            def copy(start, stop):
+                src_file.seek(start)
+                remaining = stop - start
+                while remaining > 0:
+                    data = src_file.read(min(CHUNK_SIZE, remaining))
+                    dst_file.write(data)
+                    remaining -= len(data)
+
+            offset = 0
+            for start, end in spans:
+                tag_end, empty = _tag_end(src_file, start)
+                src_file.seek(start)
+                start_tag = src_file.read(tag_end - start)
+                name = re.match(rb'<([^\s/>]+)', start_tag).group(1)
+                if empty:
+                    start_tag = start_tag[:-1].rstrip()[:-1] + b'>'
+                    end_tag_end = tag_end
+                else:
+                    end_tag_end, _ = _tag_end(src_file, end)
+                edits = elements[(start, end)]
+                # only the edits after the last clear matter
+                cleared = [i for i, (clear, chunks) in enumerate(edits) if clear]
+                copy(offset, start)
+                if cleared:
+                    edits = edits[cleared[-1]:]
+                    # as Element.clear, the attributes are removed as well
+                    dst_file.write(b'<' + name + b'>')
+                else:
+                    dst_file.write(start_tag)
+                    if not empty:
+                        copy(tag_end, end)
+                for clear, chunks in edits:
+                    for data in chunks():
+                        dst_file.write(data)
+                dst_file.write(b'</' + name + b'>')
+                offset = end_tag_end
+            src_file.seek(offset)
+            for data in iter(lambda: src_file.read(CHUNK_SIZE), b''):
+                dst_file.write(data)
+
+    def _write_tree(self, dst_file):
+        writer = _InsertWriter(dst_file, self._inserts)
+        self._et.write(writer, encoding='unicode', short_empty_elements=False)
+        writer.flush()
 
     def write(self, file_name):
-        self._et.write(file_name, short_empty_elements=False)
-        string = open(file_name, 'r').read().replace('__','::')
-        with open(file_name, "w") as text_file:
-            text_file.write(string)
-        
+        if self._streaming:
+            self._write_streaming(file_name)
+            return
+        # non ascii characters are written as character references, as
+        # ElementTree does by default, and the line endings are kept
+        with open(file_name, 'w', encoding='us-ascii', errors='xmlcharrefreplace',
+                  newline='') as dst_file:
+            self._write_tree(dst_file)
 
-class X3dXmlFile:
 
-    def __init__(self, file_name):
-        self._file_name = file_name
-        self._load_et(file_name)
+class X3dXmlFile3_3(_X3dXmlBase):
+    """X3D XML file of InSite 3.3, whose element names contain '::'
+
+    '::' is replaced by '__' in the element names while the file is parsed,
+    so the names are valid for ElementTree (use '__' in the xpaths), and
+    back when written. Attribute values and text are not changed. The
+    source file is not modified.
+    """
+    _double_tag = 'remcom::rxapi::Double'
+    _cartesian_point_tag = 'remcom::rxapi::CartesianPoint'
+    _rxapi_prefix = 'remcom::rxapi::'
 
     def _load_et(self, file_name):
-        self._et = ElementTree.parse(file_name)
+        # expat without namespace processing accepts '::' in the names
+        builder = ElementTree.TreeBuilder()
+        parser = expat.ParserCreate()
+        parser.buffer_text = True
+        # names of the elements as written in the file, by mangled name
+        self._names = {}
 
-    def add_vertice_list(self, vertice_list, xpath, clear=True):
-        point_list = self._et.findall(xpath)
-        if len(point_list) != 1:
-            raise FormatError(
-                'xpath is not selecting only one element. xpath: "{}" selected: "{}"'.format(xpath, point_list))
-        point_list = point_list[0]
-        if clear:
-            point_list.clear()
+        def start_element(name, attributes):
+            mangled = self._mangle(name)
+            self._names[mangled] = name
+            builder.start(mangled, attributes)
 
-        def add_vertice(vertice):
-            def add_point(point, name, value):
-                name_element = ElementTree.SubElement(point, name)
-                double = ElementTree.SubElement(name_element, 'Double')
-                double.set('Value', vertice_list.float_format_string.format(value))
+        parser.StartElementHandler = start_element
+        parser.EndElementHandler = lambda name: builder.end(self._mangle(name))
+        parser.CharacterDataHandler = builder.data
+        with open(file_name, 'rb') as src_file:
+            try:
+                for data in iter(lambda: src_file.read(CHUNK_SIZE), b''):
+                    parser.Parse(data, False)
+                parser.Parse(b'', True)
+            except expat.ExpatError as e:
+                raise FormatError('Invalid XML file "{}": {}'.format(file_name, e))
+        self._et = ElementTree.ElementTree(builder.close())
 
-            projected_point = ElementTree.SubElement(point_list, 'ProjectedPoint')
-            point = ElementTree.SubElement(projected_point, 'CartesianPoint')
+    def _mangle(self, name):
+        return name.replace('::', '__')
 
-            for name, value in zip(('X', 'Y', 'Z'), vertice):
-                add_point(point, name, value)
+    def _write_tree(self, dst_file):
+        # the tree is written with the names of the file, and left as it was
+        elements = list(self._et.iter())
+        tags = [element.tag for element in elements]
+        try:
+            for element, tag in zip(elements, tags):
+                if isinstance(tag, str):
+                    element.tag = self._names.get(tag, tag)
+            _X3dXmlBase._write_tree(self, dst_file)
+        finally:
+            for element, tag in zip(elements, tags):
+                element.tag = tag
 
-        for vertice in vertice_list.vertice_array:
-            add_vertice(vertice)
 
-    def write(self, file_name):
-        self._et.write(file_name, short_empty_elements=False)
+class X3dXmlFile(_X3dXmlBase):
+    pass
@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from rwimodeling import cache
+from rwimodeling.mimo import SetupFile
+from rwimodeling.objects import ObjectFile
+from rwimodeling.txrx import TxRxFile
+
+EXAMPLE_DIR=os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'example')
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.paths = {}
+        for name in ('car-handmade.object', 'model.txrx', 'model.setup'):
+            self.paths[name] = os.path.join(self.tmp_dir.name, name)
+            shutil.copy(os.path.join(EXAMPLE_DIR, name), self.paths[name])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def parse(self, entity_type, name, **options):
+        with open(self.paths[name]) as infile:
+            return entity_type.from_file(infile, **options)
+
+    def assert_round_trip(self, entity_type, name, **options):
+        expected = self.parse(entity_type, name).serialize()
+        # the first parse writes the sidecar, the second loads it
+        self.assertEqual(self.parse(entity_type, name, cache=True, **options).serialize(), expected)
+        self.assertTrue(os.path.isfile(cache.sidecar_path(self.paths[name])))
+        self.assertIsNotNone(cache.load(self.paths[name], entity_type, **options))
+        self.assertEqual(self.parse(entity_type, name, cache=True, **options).serialize(), expected)
+
+    def test_round_trip(self):
+        self.assert_round_trip(ObjectFile, 'car-handmade.object')
+        self.assert_round_trip(TxRxFile, 'model.txrx')
+        self.assert_round_trip(SetupFile, 'model.setup')
+
+    def test_round_trip_compact(self):
+        self.assert_round_trip(ObjectFile, 'car-handmade.object', compact=True)
+        obj = self.parse(ObjectFile, 'car-handmade.object', cache=True, compact=True)
+        self.assertIsNotNone(obj.mesh)
+
+    def edit(self, name, old, new, mtime_shift=10):
+        path = self.paths[name]
+        stat = os.stat(path)
+        with open(path, 'rb') as infile:
+            data = infile.read()
+        self.assertIn(old.encode(), data)
+        with open(path, 'wb') as outfile:
+            outfile.write(data.replace(old.encode(), new.encode(), 1))
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + mtime_shift * 10**9))
+
+    def test_size_change(self):
+        self.parse(TxRxFile, 'model.txrx', cache=True)
+        self.edit('model.txrx', 'begin_<points> Rx', 'begin_<points> Rx2')
+        self.assertIsNone(cache.load(self.paths['model.txrx'], TxRxFile))
+        self.assertEqual(self.parse(TxRxFile, 'model.txrx', cache=True)['Rx2'].name, 'Rx2')
+
+    def test_mtime_change(self):
+        self.parse(ObjectFile, 'car-handmade.object', cache=True)
+        path = self.paths['car-handmade.object']
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**10))
+        # same content, the sidecar is still valid
+        self.assertIsNotNone(cache.load(path, ObjectFile))
+
+    def test_same_size_content_change(self):
+        expected = self.parse(ObjectFile, 'car-handmade.object', cache=True).serialize()
+        size = os.path.getsize(self.paths['car-handmade.object'])
+        self.edit('car-handmade.object', 'Material 0', 'Material 1')
+        self.assertEqual(os.path.getsize(self.paths['car-handmade.object']), size)
+        self.assertIsNone(cache.load(self.paths['car-handmade.object'], ObjectFile))
+        obj = self.parse(ObjectFile, 'car-handmade.object', cache=True)
+        self.assertNotEqual(obj.serialize(), expected)
+        self.assertEqual(obj.serialize(), expected.replace('Material 0', 'Material 1', 1))
+
+    def test_corrupt_sidecar(self):
+        expected = self.parse(ObjectFile, 'car-handmade.object').serialize()
+        self.parse(ObjectFile, 'car-handmade.object', cache=True)
+        sidecar = cache.sidecar_path(self.paths['car-handmade.object'])
+        with open(sidecar, 'rb') as infile:
+            data = infile.read()
+        for corrupt in (data[:len(data) // 2], b'garbage', data[:100] + b'x' * (len(data) - 100)):
+            with open(sidecar, 'wb') as outfile:
+                outfile.write(corrupt)
+            obj = self.parse(ObjectFile, 'car-handmade.object', cache=True)
+            self.assertEqual(obj.serialize(), expected)
+            # the sidecar was written again
+            self.assertIsNotNone(cache.load(self.paths['car-handmade.object'], ObjectFile))
@@ -0,0 +1,40 @@
+import unittest
+
+import numpy as np
+
+from rwimodeling import grid
+from rwimodeling.objects import RectangularPrism, Structure
+from rwimodeling.txrx import Location
+
+
+class GridTest(unittest.TestCase):
+
+    def test_grids(self):
+        points = grid.rectangular_grid(0, 0, 4, 2, spacing=2, height=1.5)
+        self.assertEqual(points.tolist()[:4], [[0, 0, 1.5], [2, 0, 1.5], [4, 0, 1.5], [0, 2, 1.5]])
+        self.assertEqual(len(points), 6)
+        # the row at the joint belongs to the second segment
+        points = grid.corridor_grid([(0, 0), (10, 0), (10, 10)], width=4, spacing=2)
+        self.assertEqual(len(points), 5 * 3 + 6 * 3)
+        points = grid.radial_grid((1, 2), [0, 1, 2], 4)
+        self.assertEqual(len(points), 9)
+        np.testing.assert_allclose(np.hypot(points[:, 0] - 1, points[:, 1] - 2),
+                                   [0] + [1] * 4 + [2] * 4, atol=1e-12)
+
+    def test_inside_footprints(self):
+        building = RectangularPrism(10, 4, 20)
+        building.translate((5, 5, 0))
+        structure = Structure(name='building')
+        structure.add_sub_structures(building)
+        points = grid.rectangular_grid(0, 0, 20, 20, spacing=1)
+        inside = grid.inside_footprints(points, structure)
+        expected = ((points[:, 0] >= 5) & (points[:, 0] <= 15) &
+                    (points[:, 1] >= 5) & (points[:, 1] <= 9))
+        np.testing.assert_array_equal(inside, expected)
+        location = Location()
+        location.add_vertices(points[~inside])
+        self.assertEqual(location.n_vertices, len(points) - expected.sum())
+
+
+if __name__ == '__main__':
+    unittest.main()
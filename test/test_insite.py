@@ -0,0 +1,121 @@
+import os
+import sys
+import tempfile
+import textwrap
+import time
+import unittest
+
+from rwimodeling.insite import InSiteProject
+from rwimodeling.scheduler import RunSpec, Scheduler, parse_memory
+
+# stands for calcprop: prints its arguments and behaves as asked by the
+# --project file name (fail, sleep...)
+STUB = textwrap.dedent('''
+    import os, sys, time
+    args = sys.argv[1:]
+    project = [a for a in args if a.startswith('--project=')][0][len('--project='):]
+    print(' '.join(args))
+    name = os.path.basename(project)
+    count_file = project + '.count'
+    count = int(open(count_file).read()) + 1 if os.path.exists(count_file) else 1
+    open(count_file, 'w').write(str(count))
+    if name.startswith('sleep'):
+        time.sleep(float(name[len('sleep'):]))
+    if name.startswith('fail') and count <= int(name[len('fail'):]):
+        sys.exit(3)
+    output = [a for a in args if a.startswith('--calc-mode=')]
+    if output and output[0] != '--calc-mode=Empty':
+        os.makedirs(project + '.out', exist_ok=True)
+        open(os.path.join(project + '.out', 'power.p2m'), 'w').write('1')
+''')
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        stub = os.path.join(self.tmp_dir.name, 'calcprop.py')
+        with open(stub, 'w') as outfile:
+            outfile.write(STUB)
+        self.project = InSiteProject(calcprop_bin='"{}" "{}"'.format(sys.executable, stub))
+
+    def spec(self, name, **kargs):
+        return RunSpec(setup_path=os.path.join(self.tmp_dir.name, name), **kargs)
+
+    def test_results_in_order(self):
+        specs = [self.spec('a{}'.format(i), calc_mode='New', memory='1M') for i in range(6)]
+        results = Scheduler(self.project, max_workers=3).run(specs)
+        self.assertEqual([result.spec for result in results], specs)
+        self.assertTrue(all(result.ok and result.attempts == 1 for result in results))
+        self.assertIn('--calc-mode=New --memory=1M', results[0].log)
+
+    def test_retries(self):
+        results = self.project.run_all([self.spec('fail2'), self.spec('fail5')], retries=2)
+        self.assertTrue(results[0].ok)
+        self.assertEqual(results[0].attempts, 3)
+        self.assertEqual(results[1].returncode, 3)
+        self.assertEqual(results[1].attempts, 3)
+
+    def test_timeout(self):
+        start = time.monotonic()
+        result, = self.project.run_all([self.spec('sleep30')], timeout=0.5)
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertTrue(result.timed_out)
+        self.assertFalse(result.ok)
+
+    def test_memory_budget(self):
+        specs = [self.spec('sleep0.3', memory='1G'), self.spec('sleep0.3', memory='1G')]
+        start = time.monotonic()
+        results = self.project.run_all(specs, max_workers=2, memory_budget='1.5G')
+        # the budget only allows one run at a time
+        self.assertGreater(time.monotonic() - start, 0.6)
+        self.assertTrue(all(result.ok for result in results))
+        self.assertEqual(parse_memory('450.5M'), int(450.5 * 2 ** 20))
+        with self.assertRaises(ValueError):
+            self.project.run_all([self.spec('a', memory='2G')], memory_budget='1G')
+
+    def test_resume(self):
+        manifest = os.path.join(self.tmp_dir.name, 'runs.jsonl')
+        specs = [self.spec(name, calc_mode=calc_mode,
+                           output_dir=os.path.join(self.tmp_dir.name, name + '.out'))
+                 for name, calc_mode in (('a', 'New'), ('b', 'New'), ('c', 'Empty'))]
+        results = self.project.run_all(specs, manifest=manifest)
+        # c exits with 0 but writes no output
+        self.assertEqual([result.ok for result in results], [True, True, False])
+        self.assertEqual(results[2].returncode, 0)
+        # a crash while writing the manifest
+        with open(manifest, 'a') as outfile:
+            outfile.write('{"key": "trunc')
+        os.remove(os.path.join(self.tmp_dir.name, 'b.out', 'power.p2m'))
+        results = self.project.run_all(specs, manifest=manifest)
+        self.assertEqual([result.skipped for result in results], [True, False, False])
+        self.assertTrue(results[0].ok and results[1].ok)
+        with open(os.path.join(self.tmp_dir.name, 'a.count')) as infile:
+            self.assertEqual(infile.read(), '1')
+        results = self.project.run_all(specs, manifest=manifest)
+        self.assertEqual([result.skipped for result in results], [True, True, False])
+
+    def test_stale_outputs(self):
+        output_dir = os.path.join(self.tmp_dir.name, 'a.out')
+        os.makedirs(output_dir)
+        stale = os.path.join(output_dir, 'power.p2m')
+        with open(stale, 'w') as outfile:
+            outfile.write('1')
+        # left by an earlier run
+        os.utime(stale, (time.time() - 3600, time.time() - 3600))
+        spec = self.spec('a', calc_mode='Empty', output_dir=output_dir)
+        result, = self.project.run_all([spec], retries=1)
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(result.attempts, 2)
+        self.assertFalse(result.ok)
+        # the run writes the same file again, with the same size
+        result, = self.project.run_all([spec._replace(calc_mode='New')])
+        self.assertTrue(result.ok)
+        self.assertEqual(result.outputs, {'power.p2m': 1})
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import copy
+import unittest
+
+import numpy as np
+
+from rwimodeling import default_dtype
+from rwimodeling.instancing import Prototype
+from rwimodeling.objects import RectangularPrism, Structure, rectangular_prism_prototype
+from rwimodeling.transform import rotation_matrix, translation_matrix
+
+
+class PrototypeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.box = RectangularPrism(4, 2, 1, name='car', material=0)
+        self.prototype = Prototype(self.box)
+        self.original = self.box.as_vertice_array().copy()
+
+    def test_instance_geometry(self):
+        instance = self.prototype.instance(translation_matrix((10, 0, 0)))
+        np.testing.assert_array_equal(instance.as_vertice_array(), self.original + (10, 0, 0))
+        expected = copy.deepcopy(self.box)
+        expected.translate((10, 0, 0))
+        self.assertEqual(instance.serialize(), expected.serialize())
+        np.testing.assert_array_equal(instance.bounds, expected.bounds)
+
+    def test_prototype_edits(self):
+        a = self.prototype.instance(translation_matrix((10, 0, 0)))
+        b = self.prototype.instance(rotation_matrix(90))
+        b_vertices = b.as_vertice_array().copy()
+        # the source sub structure is copied by the prototype
+        self.box.translate((0, 100, 0))
+        np.testing.assert_array_equal(a.as_vertice_array(), self.original + (10, 0, 0))
+        # the faces of an instance are copies
+        a.face_list[0].vertice_array[...] = 0
+        np.testing.assert_array_equal(a.as_vertice_array(), self.original + (10, 0, 0))
+        # an expanded instance keeps its transform and no longer shares the geometry
+        a.expand()
+        self.assertIsNone(a.prototype)
+        np.testing.assert_array_equal(a.as_vertice_array(), self.original + (10, 0, 0))
+        a.face_list[0].vertice_array[...] = 0
+        a.translate((1, 0, 0))
+        np.testing.assert_array_equal(b.as_vertice_array(), b_vertices)
+        np.testing.assert_array_equal(self.prototype.instance().as_vertice_array(),
+                                      self.original)
+
+    def test_deepcopy(self):
+        structure = Structure(name='cars')
+        structure.add_sub_structures(self.prototype.instance(translation_matrix((5, 0, 0))))
+        structure_copy = copy.deepcopy(structure)
+        instance_copy = structure_copy['car']
+        self.assertIs(instance_copy.prototype, self.prototype)
+        instance_copy.translate((0, 5, 0))
+        np.testing.assert_array_equal(structure['car'].as_vertice_array(),
+                                      self.original + (5, 0, 0))
+        np.testing.assert_array_equal(instance_copy.as_vertice_array(), self.original + (5, 5, 0))
+
+    def test_rectangular_prism_prototype_dtype(self):
+        prototype = rectangular_prism_prototype(4.54, 1.76, 1.47, material=0)
+        self.assertIs(rectangular_prism_prototype(4.54, 1.76, 1.47, material=0), prototype)
+        with default_dtype(np.float32):
+            prototype32 = rectangular_prism_prototype(4.54, 1.76, 1.47, material=0)
+        self.assertEqual(prototype.mesh.vertices.dtype, np.float64)
+        self.assertEqual(prototype32.mesh.vertices.dtype, np.float32)
+        self.assertIs(rectangular_prism_prototype(4.54, 1.76, 1.47, material=0, dtype='float32'),
+                      prototype32)
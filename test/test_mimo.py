@@ -0,0 +1,87 @@
+import os
+import unittest
+
+import numpy as np
+
+from rwimodeling.mimo import SetupFile, ula_positions, uca_positions, upa_positions
+
+INPUT_SETUP_FILE=os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'example',
+                              'model.setup')
+
+
+class AntennaArrayTest(unittest.TestCase):
+
+    def setUp(self):
+        with open(INPUT_SETUP_FILE) as infile:
+            self.setup = SetupFile.from_file(infile)
+        self.antenna = self.setup['MIMO']
+
+    def test_arrays(self):
+        positions = self.antenna.positions
+        self.assertEqual(positions.shape, (64, 3))
+        np.testing.assert_allclose(positions[1], (0.0624568, 0, 0))
+        # untouched elements are written as parsed
+        text = self.antenna.serialize()
+        self.assertIn('position 0.0624568 -0 -0\n', text)
+        self.antenna.positions = positions + (1, 2, 3)
+        self.assertIn('position 1.0624568 2 3\n', self.antenna.serialize())
+        self.antenna.rotations = (0, 0, 90)
+        np.testing.assert_array_equal(self.antenna.rotations[-1], (0, 0, 90))
+
+    def test_generators(self):
+        np.testing.assert_allclose(ula_positions(3, 2, azimuth=90), [[0, 0, 0], [0, 2, 0], [0, 4, 0]],
+                                   atol=1e-12)
+        positions = upa_positions(2, 3, 1, tilt=90)
+        self.assertEqual(positions.shape, (6, 3))
+        np.testing.assert_allclose(positions[:3, 2], [0, 1, 2], atol=1e-12)
+        positions = uca_positions(6, spacing=1)
+        np.testing.assert_allclose(np.linalg.norm(np.diff(positions, axis=0), axis=1), 1)
+
+        self.antenna.set_mimo_elements(ula_positions(4, 0.0025, azimuth=30))
+        self.assertEqual(len(self.antenna.mimo_list), 4)
+        self.assertEqual(self.antenna.mimo_list[0].antenna, '0')
+        self.assertIn('MimoElement', self.setup.serialize())
+
+
+class SetupFileTest(unittest.TestCase):
+
+    def test_new_setup_file(self):
+        self.assertEqual(SetupFile().serialize(),
+                         SetupFile._default_head + SetupFile._default_tail)
+
+
+class SetupBlocksTest(unittest.TestCase):
+
+    def setUp(self):
+        with open(INPUT_SETUP_FILE) as infile:
+            self.setup = SetupFile.from_file(infile)
+        self.text = self.setup.serialize()
+
+    def test_untouched_blocks_are_verbatim(self):
+        model = self.setup.block('studyarea/model')
+        self.assertEqual(model.value('num_threads', int), 12)
+        self.assertTrue(model.has_flag('x3d'))
+        self.assertEqual([f['filename'] for f in self.setup.blocks('feature')][0], './Rosslyn.city')
+        self.assertEqual(self.setup.serialize(), self.text)
+
+    def test_modify(self):
+        self.setup.block('studyarea/model')['num_threads'] = 4
+        self.setup.block('requests')['CalculationMode'] = 'AddReceivers'
+        boundary = self.setup.block('studyarea/boundary')
+        boundary.vertice_array = boundary.vertice_array[:3] + (1, 0, 0)
+        text = self.setup.serialize()
+        self.assertIn('num_threads 4\n', text)
+        self.assertIn('CalculationMode AddReceivers\n', text)
+        self.assertIn('nVertices 3\n269.925506591797 187.422760009766 0\n', text)
+        self.assertEqual(len(text.splitlines()), len(self.text.splitlines()) - 1)
+        # the coordinates are read back exactly
+        vertice_array = [(0.1 + 0.2, 1 / 3, -2.0), (1e-20, 123456789.123456789, 1e22)]
+        boundary.vertice_array = vertice_array
+        self.assertEqual(boundary.vertice_array.tolist(), [list(v) for v in vertice_array])
+        self.assertIn('\n0.30000000000000004 0.3333333333333333 -2\n', self.setup.serialize())
+        # the MIMO elements are not part of the blocks
+        self.assertEqual(text.count('begin_<MimoElement>'), self.text.count('begin_<MimoElement>'))
+
+
+if __name__ == '__main__':
+    unittest.main()
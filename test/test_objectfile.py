@@ -1,14 +1,23 @@
 import os
 import tempfile
 import unittest
+from unittest import mock
 
-from rwimodeling.objects import ObjectFile
+import numpy as np
+
+from rwimodeling import verticelist
+from rwimodeling.errors import FormatError
+from rwimodeling.events import iterparse
+from rwimodeling.objects import ObjectFile, RectangularPrism, Structure, StructureGroup
+from rwimodeling.utils import LineCursor
 
 EXAMPLE_DIR=os.path.dirname(os.path.realpath(__file__))
 INPUT_OBJ_FILE=os.path.join(EXAMPLE_DIR, '..', 'example',
                             'car-handmade.object')
 OUTPUT_OBJ_FILE=os.path.join(EXAMPLE_DIR, '..', 'example',
                              'car-handmade-trans.object')
+INPUT_TXRX_FILE=os.path.join(EXAMPLE_DIR, '..', 'example',
+                             'model.txrx')
 
 
 class ObjectFileTest(unittest.TestCase):
@@ -27,7 +36,251 @@ class ObjectFileTest(unittest.TestCase):
         self.assertEqual(self.correct_outfile.read(),
                          self.outfile.read())
 
+    def test_new_object_file(self):
+        obj = ObjectFile()
+        self.assertEqual(obj.serialize(), ObjectFile._default_head + ObjectFile._default_tail)
+        structure = Structure(name='box')
+        structure.add_sub_structures(RectangularPrism(1, 2, 3))
+        group = StructureGroup(name='group')
+        group.add_structures(structure)
+        obj.add_structure_groups(group)
+        parsed = ObjectFile.from_file(obj.serialize().splitlines(True))
+        self.assertEqual(parsed.serialize(), obj.serialize())
+
     def tearDown(self):
         self.infile.close()
         self.outfile.close()
-        self.correct_outfile.close()
\ No newline at end of file
+        self.correct_outfile.close()
+
+class CompactTest(unittest.TestCase):
+
+    def parse(self, compact):
+        with open(INPUT_OBJ_FILE) as infile:
+            return ObjectFile.from_file(infile, compact=compact)
+
+    def test_same_as_plain(self):
+        plain = self.parse(False)
+        obj = self.parse(True)
+        self.assertIsNotNone(obj.mesh)
+        self.assertEqual(obj.serialize(), plain.serialize())
+        self.assertEqual(''.join(obj.iter_serialize()), plain.serialize())
+        for entity in (obj, plain):
+            entity.translate((10, 5, 3))
+            entity.rotate(30, pivot=(1, 2, 0))
+        self.assertIsNotNone(obj.mesh)
+        self.assertEqual(obj.serialize(), plain.serialize())
+        np.testing.assert_array_equal(obj.bounds, plain.bounds)
+
+    def test_edit_leaves_compact_mode(self):
+        plain = self.parse(False)
+        obj = self.parse(True)
+        for entity in (obj, plain):
+            structure = Structure(name='box')
+            structure.add_sub_structures(RectangularPrism(1, 2, 3))
+            next(iter(entity)).add_structures(structure)
+        self.assertIsNone(obj.mesh)
+        self.assertEqual(obj.serialize(), plain.serialize())
+        for entity in (obj, plain):
+            entity.translate((1, 1, 1))
+        self.assertEqual(obj.serialize(), plain.serialize())
+        obj.compact()
+        self.assertIsNotNone(obj.mesh)
+        self.assertEqual(obj.serialize(), plain.serialize())
+
+
+class NameIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.structure = Structure(name='a/b')
+        self.boxes = [RectangularPrism(1, 1, 1, name=name) for name in ('x', 'y', 'x', 'z/w')]
+        self.structure.add_sub_structures(self.boxes)
+        self.group = StructureGroup(name='group')
+        self.group.add_structures(self.structure)
+        # builds the indexes
+        self.assertIs(self.group['a/b/x'], self.boxes[0])
+
+    def test_rename(self):
+        structure = self.structure
+        self.boxes[1].name = 'v'
+        self.assertIs(structure['v'], self.boxes[1])
+        self.assertIsNone(structure.get('y'))
+        # duplicated names keep the order of the children
+        self.boxes[3].name = 'x'
+        self.assertEqual(structure.get_all('x'), [self.boxes[0], self.boxes[2], self.boxes[3]])
+        self.boxes[0].name = 'u'
+        self.assertIs(structure['x'], self.boxes[2])
+        self.assertIs(structure['u'], self.boxes[0])
+        self.assertEqual(structure.keys(), ['u', 'v', 'x', 'x'])
+        self.structure.name = 'c'
+        self.assertIs(self.group['c/x'], self.boxes[2])
+        self.assertIsNone(self.group.get('a/b/x'))
+        # faces renamed in a compact sub structure
+        obj = ObjectFile('boxes.object')
+        obj.add_structure_groups(self.group)
+        obj.compact()
+        face = self.group['c/u/top']
+        face.name = 'roof'
+        self.assertIs(self.group['c/u/roof'], face)
+        self.assertIsNone(self.group.get('c/u/top'))
+
+    def test_remove(self):
+        self.structure.clear()
+        self.assertIsNone(self.structure.get('x'))
+        self.structure.add_sub_structures(self.boxes[2:])
+        self.assertIs(self.structure['x'], self.boxes[2])
+        self.assertEqual(self.structure.get_all('x'), [self.boxes[2]])
+        # removed children no longer notify the container
+        self.boxes[1].name = 'x'
+        self.assertEqual(self.structure.get_all('x'), [self.boxes[2]])
+
+    def test_paths(self):
+        # names containing '/' are found whole first
+        self.assertIs(self.group['a/b'], self.structure)
+        self.assertIs(self.group['a/b/z/w'], self.boxes[3])
+        self.assertIs(self.group['a/b/z/w/top'], self.boxes[3].face_list[0])
+        self.assertEqual(self.group.get_many(['a/b/x', 'a/b/y']), self.boxes[:2])
+        for key in ('a', 'a/b/q', 'a/b/x/q', 'a/b/x/top/q'):
+            with self.assertRaises(KeyError):
+                self.group[key]
+
+
+class BoundsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.box = RectangularPrism(4, 2, 1)
+        self.structure = Structure(name='s')
+        self.structure.add_sub_structures(self.box)
+        self.group = StructureGroup(name='g')
+        self.group.add_structures(self.structure)
+        self.obj = ObjectFile('o.object')
+        self.obj.add_structure_groups(self.group)
+
+    def assert_bounds(self, entity, bounds):
+        np.testing.assert_allclose(entity.bounds, bounds, atol=1e-12)
+
+    def test_transforms(self):
+        self.assert_bounds(self.obj, [(0, 0, 0), (4, 2, 1)])
+        np.testing.assert_array_equal(self.obj.dimensions, (4, 2, 1))
+        self.box.translate((1, 2, 3))
+        self.assert_bounds(self.obj, [(1, 2, 3), (5, 4, 4)])
+        self.structure.rotate(90)
+        self.assert_bounds(self.group, [(-4, 1, 3), (-2, 5, 4)])
+        self.obj.scale(2)
+        self.assert_bounds(self.box, [(-8, 2, 6), (-4, 10, 8)])
+        # in place edits need invalidate_bounds
+        face = self.box.face_list[0]
+        face.vertice_array[0] = (100, 0, 7)
+        face.invalidate_bounds()
+        self.assert_bounds(self.obj, [(-8, 0, 6), (100, 10, 8)])
+        with self.assertRaises(ValueError):
+            self.obj.bounds[0, 0] = 1
+
+    def test_compact(self):
+        self.obj.compact()
+        self.assert_bounds(self.box, [(0, 0, 0), (4, 2, 1)])
+        self.obj.translate((1, 1, 1))
+        self.assert_bounds(self.box, [(1, 1, 1), (5, 3, 2)])
+        self.box.translate((0, 0, 10))
+        self.assert_bounds(self.obj, [(1, 1, 11), (5, 3, 12)])
+
+    def test_append(self):
+        self.assert_bounds(self.obj, [(0, 0, 0), (4, 2, 1)])
+        other = RectangularPrism(1, 1, 1)
+        other.translate((-3, 0, 0))
+        self.structure.add_sub_structures(other)
+        self.assert_bounds(self.obj, [(-3, 0, 0), (4, 2, 1)])
+        face = other.face_list[0]
+        face.add_vertices([(0, 0, 20)])
+        self.assert_bounds(self.group, [(-3, 0, 0), (4, 2, 20)])
+        self.structure.clear()
+        self.assertIsNone(self.obj.bounds)
+        self.assertIsNone(self.obj.dimensions)
+
+
+class IterparseTest(unittest.TestCase):
+
+    def test_events(self):
+        with open(INPUT_OBJ_FILE) as infile:
+            obj = ObjectFile.from_file(infile)
+        with open(INPUT_OBJ_FILE) as infile:
+            events = list(iterparse(infile))
+        faces = [value for event, value in events if event == 'face']
+        self.assertEqual([event for event, value in events][:2], ['text', 'begin'])
+        self.assertEqual(len(faces), sum(len(sub_structure.face_list) for group in obj
+                                           for structure in group for sub_structure in structure))
+        self.assertEqual(faces[0].vertice_array.shape, (4, 3))
+        self.assertEqual(events[0][1], obj._header_str)
+
+    def test_stops_after_entity(self):
+        lines = iter(['begin_<structure> a\n', 'begin_<sub_structure> \n',
+                      'begin_<face> f\n', 'Material 1\n', 'nVertices 1\n', '1 2 3\n',
+                      'end_<face>\n', 'end_<sub_structure>\n', 'end_<structure>\n',
+                      'next\n'])
+        structure = Structure.from_file(lines)
+        self.assertEqual(structure['']['f'].vertice_array.tolist(), [[1, 2, 3]])
+        self.assertEqual(list(lines), ['next\n'])
+
+    def test_txrx_events(self):
+        with open(INPUT_TXRX_FILE) as infile:
+            lines = infile.readlines()
+        events = list(iterparse(lines))
+        self.assertEqual([event for event, value in events],
+                         ['begin', 'text', 'location', 'text', 'end'] * 2)
+        self.assertEqual([value.name for event, value in events if event == 'begin'],
+                         ['Tx', 'Rx'])
+        rx_location = events[7][1]
+        self.assertTrue(rx_location.header.startswith('begin_<location> \n'))
+        self.assertEqual(lines[rx_location.start_line], 'nVertices 2\n')
+        self.assertEqual(rx_location.stop_line - rx_location.start_line, 3)
+        self.assertEqual(lines[rx_location.stop_line], 'end_<location>\n')
+        self.assertEqual(rx_location.vertice_array.shape, (2, 3))
+        # the text around the location, the head and the tail of the points
+        begin = lines.index('begin_<points> Rx\n')
+        header_start = rx_location.start_line - rx_location.header.count('\n')
+        self.assertEqual(events[6][1], ''.join(lines[begin + 1:header_start]))
+        end = lines.index('end_<points>\n', begin)
+        self.assertEqual(events[8][1], ''.join(lines[rx_location.stop_line + 1:end]))
+        self.assertEqual(events[9][1].line, 'end_<points>\n')
+
+    def test_stops_after_end(self):
+        with open(INPUT_TXRX_FILE) as infile:
+            lines = infile.readlines()
+        cursor = LineCursor(lines)
+        for event, value in iterparse(cursor):
+            if event == 'end':
+                break
+        self.assertEqual(cursor.peek(), 'begin_<points> Rx\n')
+        self.assertEqual(cursor.line_number, lines.index('begin_<points> Rx\n'))
+
+    def test_errors(self):
+        face = ['begin_<face> f\n', 'Material 1\n', 'nVertices 2\n', '1 2 3\n', '4 5 6\n',
+                'end_<face>\n']
+        sub_structure = ['begin_<sub_structure> \n'] + face + ['end_<sub_structure>\n']
+        # missing end line
+        with self.assertRaisesRegex(FormatError, 'end_<sub_structure>'):
+            list(iterparse(sub_structure[:-1]))
+        # nVertices not matching the vertices
+        for n_vertices in ('1', '3', 'x'):
+            lines = list(sub_structure)
+            lines[3] = 'nVertices {}\n'.format(n_vertices)
+            with self.assertRaises(FormatError):
+                list(iterparse(lines))
+        # missing lines of the face
+        with self.assertRaises(FormatError):
+            list(iterparse(sub_structure[:3]))
+
+    def test_parse_vertices(self):
+        lines = ['1 2 3\n', '  -4.5e-3\t5   6.25 \r\n', '7 8 9']
+        lines = (lines * 20)[:40]
+        for n_vertices in (1, 3, 15, 16, 40):
+            split = verticelist.parse_vertices(lines[:n_vertices], n_vertices)
+            with mock.patch.object(verticelist, '_LOADTXT_MIN_VERTICES', 0):
+                loadtxt = verticelist.parse_vertices(lines[:n_vertices], n_vertices)
+            self.assertEqual(split.dtype, loadtxt.dtype)
+            np.testing.assert_array_equal(split, loadtxt)
+            self.assertEqual(split.shape, (n_vertices, 3))
+        for bad_lines in (['1 2\n', '3 4 5 6\n'], ['1 2 x\n', '4 5 6\n'], ['1 2 3\n']):
+            for min_vertices in (0, 16):
+                with mock.patch.object(verticelist, '_LOADTXT_MIN_VERTICES', min_vertices):
+                    with self.assertRaises(FormatError):
+                        verticelist.parse_vertices(bad_lines, 2)
@@ -0,0 +1,97 @@
+import gc
+import unittest
+
+from rwimodeling.objects import ObjectFile, RectangularPrism, Structure, StructureGroup
+from rwimodeling.spatial import SpatialIndex, _Watcher
+
+
+def make_object(n_boxes):
+    structure = Structure(name='boxes')
+    for i in range(n_boxes):
+        box = RectangularPrism(1, 1, 1, name='box{}'.format(i))
+        box.translate((10 * i, 0, 0))
+        structure.add_sub_structures(box)
+    group = StructureGroup(name='group')
+    group.add_structures(structure)
+    obj = ObjectFile('boxes.object')
+    obj.add_structure_groups(group)
+    return obj
+
+
+def names(sub_structures):
+    return [sub_structure.name for sub_structure in sub_structures]
+
+
+class SpatialIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.obj = make_object(5)
+        self.structure = self.obj['group']['boxes']
+        self.index = SpatialIndex.from_object(self.obj)
+
+    def test_queries(self):
+        self.assertEqual(len(self.index), 5)
+        self.assertEqual(names(self.index.query_rect(9, -1, 21, 2)), ['box1', 'box2'])
+        self.assertEqual(names(self.index.query_radius((15, 0.5), 4)), ['box1'])
+        self.assertEqual(names(self.index.nearest((29, 0), k=2)), ['box3', 'box2'])
+        box0 = self.structure['box0']
+        self.assertEqual([names(found) for found in
+                          self.index.overlaps([(0, 0, 1, 1), (5, 5, 6, 6)], exclude=[box0])],
+                         [[], []])
+        self.assertEqual(self.index.any_overlap([(0, 0, 1, 1), (40, 0, 41, 1)]).tolist(),
+                         [True, True])
+
+    def test_moved_directly(self):
+        box = self.structure['box1']
+        # not through the index
+        box.translate((0, 100, 0))
+        self.assertEqual(names(self.index.query_rect(9, -1, 12, 2)), [])
+        self.assertEqual(names(self.index.query_rect(9, 99, 12, 102)), ['box1'])
+        # through a container
+        self.structure.translate((0, -100, 0))
+        self.assertEqual(names(self.index.query_rect(9, -1, 12, 2)), ['box1'])
+        self.assertEqual(names(self.index.query_rect(-1, -101, 1, -99)), ['box0'])
+        # a vertice_array modified in place
+        face = box.face_list[0]
+        face.vertice_array[:, 0] += 1000
+        face.invalidate_bounds()
+        self.assertEqual(names(self.index.nearest((1011, 0))), ['box1'])
+
+    def test_moved_compact(self):
+        self.obj.compact()
+        self.index.query_rect(0, 0, 1, 1)
+        self.obj.translate((0, 50, 0))
+        self.assertEqual(names(self.index.query_rect(-1, -1, 100, 2)), [])
+        self.assertEqual(len(self.index.query_rect(-1, 49, 100, 52)), 5)
+
+    def test_remove(self):
+        box = self.structure['box2']
+        self.index.remove(box)
+        self.assertNotIn(box, self.index)
+        self.assertFalse(any(isinstance(parent, _Watcher) for parent in box._parents))
+        box.translate((1, 0, 0))
+        self.assertEqual(names(self.index.query_rect(-100, -100, 100, 100)),
+                         ['box0', 'box1', 'box3', 'box4'])
+
+    def test_large_entries(self):
+        ground = RectangularPrism(1e6, 1e6, 0.1, name='ground')
+        ground.translate((-5e5, -5e5, -0.1))
+        self.index.insert(ground)
+        # not spread over the cells of the grid
+        self.assertLess(len(self.index._cells), 100)
+        self.assertEqual(names(self.index.query_rect(-1000, 1000, -999, 1001)), ['ground'])
+        self.assertEqual(names(self.index.query_rect(9, 0, 10, 1)), ['box1', 'ground'])
+        self.assertEqual(names(self.index.query_radius((2e5, 0), 1)), ['ground'])
+        # once moved, it is an ordinary entry
+        ground.translate((5e5, 5e5, 0))
+        ground.length = 1
+        ground.width = 1
+        self.assertEqual(names(self.index.query_rect(-1000, 1000, -999, 1001)), [])
+        self.index.remove(ground)
+        self.assertEqual(len(self.index._large), 0)
+
+    def test_index_released(self):
+        box = self.structure['box0']
+        del self.index
+        gc.collect()
+        self.assertFalse(any(isinstance(parent, _Watcher) for parent in box._parents))
@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+
+from rwimodeling.staging import ProjectStager, clean_run_dir
+from rwimodeling.txrx import TxRxFile
+
+EXAMPLE_DIR=os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'example')
+
+
+class ProjectStagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.base_dir = os.path.join(self.tmp_dir.name, 'base')
+        os.makedirs(os.path.join(self.base_dir, 'study'))
+        for name in ('model.setup', 'model.txrx', 'car-handmade.object'):
+            with open(os.path.join(EXAMPLE_DIR, name), 'rb') as infile, \
+                    open(os.path.join(self.base_dir, name), 'wb') as outfile:
+                outfile.write(infile.read())
+        with open(os.path.join(self.base_dir, 'study', 'old.p2m'), 'w') as outfile:
+            outfile.write('old result')
+
+    def test_stage_and_clean(self):
+        with open(os.path.join(self.base_dir, 'model.txrx')) as infile:
+            txrx = TxRxFile.from_file(infile)
+        stager = ProjectStager(self.base_dir, ignore=lambda path: path.startswith('study'))
+        run_dir = os.path.join(self.tmp_dir.name, 'run')
+        staged = stager.stage(run_dir, {'model.txrx': txrx, 'extra.object': 'x\n'})
+        self.assertEqual(staged['model.txrx'], 'write')
+        self.assertEqual(staged['extra.object'], 'write')
+        self.assertIn(staged['model.setup'], ('reflink', 'hardlink', 'copy'))
+        self.assertFalse(os.path.exists(os.path.join(run_dir, 'study')))
+        for name in ('model.setup', 'car-handmade.object'):
+            with open(os.path.join(self.base_dir, name), 'rb') as base_file, \
+                    open(os.path.join(run_dir, name), 'rb') as run_file:
+                self.assertEqual(base_file.read(), run_file.read())
+        # the written file does not go through a link to the base project
+        self.assertEqual(os.stat(os.path.join(self.base_dir, 'model.txrx')).st_nlink, 1)
+
+        os.makedirs(os.path.join(run_dir, 'study'))
+        with open(os.path.join(run_dir, 'study', 'power.p2m'), 'w') as outfile:
+            outfile.write('result')
+        removed = clean_run_dir(run_dir)
+        self.assertEqual(sorted(removed), ['car-handmade.object', 'model.setup'])
+        self.assertEqual(sorted(os.listdir(run_dir)), ['extra.object', 'model.txrx', 'study'])
+
+    def test_copy(self):
+        stager = ProjectStager(self.base_dir, method='copy')
+        staged = stager.stage(os.path.join(self.tmp_dir.name, 'run'))
+        self.assertEqual(set(staged.values()), {'copy'})
+        self.assertIn(os.path.join('study', 'old.p2m'), staged)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+
+if __name__ == '__main__':
+    unittest.main()
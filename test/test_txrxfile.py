@@ -1,8 +1,11 @@
 import os
 import tempfile
 import unittest
+from unittest import mock
 
-from rwimodeling.txrx import TxRxFile
+from rwimodeling.errors import FormatError
+from rwimodeling.txrx import TxRxFile, _PatchSource
+from rwimodeling.verticelist import VerticeList
 
 EXAMPLE_DIR=os.path.dirname(os.path.realpath(__file__))
 INPUT_OBJ_FILE=os.path.join(EXAMPLE_DIR, '..', 'example',
@@ -27,7 +30,154 @@ class TxRxFileTest(unittest.TestCase):
         self.assertEqual(self.correct_outfile.read(),
                          self.outfile.read())
 
+    def test_text_after_points(self):
+        lines = self.infile.readlines()
+        expected = TxRxFile.from_file(lines).serialize()
+        self.assertEqual(TxRxFile.from_file(lines + ['\n', '\n']).serialize(), expected)
+        with self.assertRaises(FormatError):
+            TxRxFile.from_file(lines + ['junk line\n'])
+
     def tearDown(self):
         self.infile.close()
         self.outfile.close()
-        self.correct_outfile.close()
\ No newline at end of file
+        self.correct_outfile.close()
+
+
+class PatchWriteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        # write() output (CRLF) is the format patches apply to
+        with open(INPUT_OBJ_FILE) as infile:
+            txrx = TxRxFile.from_file(infile)
+        txrx['Rx'].location_list[0].add_vertices([(x, 2.0 * x, 1.5) for x in range(50)])
+        self.source = self.path('source.txrx')
+        txrx.write(self.source)
+        # results of _PatchSource.patch, False meaning a full write
+        self.patches = []
+        original = _PatchSource.patch
+
+        def patch(source, txrx_file, filename):
+            result = original(source, txrx_file, filename)
+            self.patches.append(result)
+            return result
+        spy = mock.patch.object(_PatchSource, 'patch', patch)
+        spy.start()
+        self.addCleanup(spy.stop)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.tmp_dir.name, name)
+
+    def parse(self, path=None, **options):
+        with open(self.source if path is None else path) as infile:
+            return TxRxFile.from_file(infile, **options)
+
+    def read(self, path):
+        with open(path, 'rb') as infile:
+            return infile.read()
+
+    def assert_patch_is_full_write(self, txrx, filename, patched=True):
+        txrx.write(filename, patch=True)
+        patch_output = self.read(filename)
+        full = self.path('full.txrx')
+        # the full write also resets the patch source, so it comes second
+        txrx.write(full)
+        self.assertEqual(patch_output, self.read(full))
+        self.assertEqual(self.patches[-1:], [patched])
+
+    def edits(self):
+        def edit_one(txrx):
+            location = txrx['Rx'].location_list[0]
+            location.vertice_array[-1] += (1, 2, 3)
+            location.invalidate_bounds()
+
+        def add(txrx):
+            txrx['Tx'].location_list[0].add_vertices([(1, 2, 3), (4, 5, 6)])
+
+        def remove(txrx):
+            location = txrx['Rx'].location_list[0]
+            kept = location.vertice_array[::2].copy()
+            location.clear()
+            location.add_vertices(kept)
+        return edit_one, add, remove
+
+    def test_patch_copy(self):
+        for edit in self.edits():
+            txrx = self.parse()
+            edit(txrx)
+            self.assert_patch_is_full_write(txrx, self.path('out.txrx'))
+
+    def test_patch_in_place(self):
+        for edit in self.edits():
+            target = self.path('in_place.txrx')
+            with open(target, 'wb') as outfile:
+                outfile.write(self.read(self.source))
+            txrx = self.parse(target)
+            edit(txrx)
+            txrx.write(target, patch=True)
+            self.assertEqual(self.patches[-1], True)
+            patched = self.read(target)
+            txrx.write(self.path('full.txrx'))
+            self.assertEqual(patched, self.read(self.path('full.txrx')))
+
+    def test_patch_after_write(self):
+        txrx = self.parse()
+        out = self.path('out.txrx')
+        txrx.write(out)
+        for edit in self.edits():
+            edit(txrx)
+            txrx.write(out, patch=True)
+            self.assertEqual(self.patches[-1], True)
+            patched = self.read(out)
+            self.assertEqual(patched, txrx.serialize().replace('\n', '\r\n').encode())
+
+    def test_untouched_not_formatted(self):
+        txrx = self.parse()
+        self.edits()[0](txrx)
+        out = self.path('out.txrx')
+        with mock.patch.object(VerticeList, 'serialize', autospec=True,
+                               side_effect=VerticeList.serialize) as serialize:
+            txrx.write(out, patch=True)
+        self.assertEqual(self.patches, [True])
+        # the source is checked without formatting the other locations
+        self.assertEqual([call.args[0] for call in serialize.call_args_list],
+                         [txrx['Rx'].location_list[0]])
+        self.assertEqual(self.read(out), txrx.serialize().replace('\n', '\r\n').encode())
+
+    def test_other_precision(self):
+        txrx = self.parse()
+        location = txrx['Tx'].location_list[0]
+        location.add_vertices([(1 / 3, 2 / 3, 1.0)])
+        location.vertice_float_precision = 6
+        source = self.path('precision.txrx')
+        txrx.write(source)
+        # parsed with the default precision, the Tx vertices are formatted differently
+        txrx = self.parse(source)
+        self.edits()[0](txrx)
+        self.assert_patch_is_full_write(txrx, self.path('out.txrx'), patched=False)
+
+    def test_lf_source(self):
+        # the example is not in the format of write
+        txrx = self.parse(INPUT_OBJ_FILE)
+        self.edits()[0](txrx)
+        self.assert_patch_is_full_write(txrx, self.path('out.txrx'), patched=False)
+
+    def test_source_changed(self):
+        txrx = self.parse()
+        self.edits()[0](txrx)
+        stat = os.stat(self.source)
+        os.utime(self.source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**10))
+        self.assert_patch_is_full_write(txrx, self.path('out.txrx'), patched=False)
+
+    def test_cached_instance(self):
+        self.parse(cache=True)
+        txrx = self.parse(cache=True)
+        self.edits()[0](txrx)
+        out = self.path('out.txrx')
+        txrx.write(out, patch=True)
+        # loaded from the sidecar, there is no source to patch
+        self.assertEqual(self.patches, [])
+        self.assertEqual(self.read(out), txrx.serialize().replace('\n', '\r\n').encode())
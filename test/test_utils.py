@@ -0,0 +1,42 @@
+import unittest
+
+from rwimodeling.utils import LineCursor, as_line_cursor
+
+LINES = ['begin_<a> x\n', 'nVertices 2\n', '1 2 3\n', '4 5 6\n', 'end_<a>']
+
+
+class LineCursorTest(unittest.TestCase):
+
+    def test_peek_and_readline(self):
+        # a generator can not be rewound
+        cursor = LineCursor(line for line in LINES)
+        self.assertEqual(cursor.peek(), LINES[0])
+        self.assertEqual(cursor.peek(), LINES[0])
+        self.assertEqual((cursor.line_number, cursor.offset), (0, 0))
+        self.assertEqual(cursor.readline(), LINES[0])
+        self.assertEqual((cursor.line_number, cursor.offset), (1, len(LINES[0])))
+        self.assertEqual([cursor.readline() for line in LINES[1:]], LINES[1:])
+        self.assertEqual((cursor.line_number, cursor.offset), (5, len(''.join(LINES))))
+        # the end of the input, as many times as asked
+        for i in range(2):
+            self.assertEqual(cursor.peek(), '')
+            self.assertEqual(cursor.readline(), '')
+            self.assertEqual(cursor.readlines(3), [])
+        self.assertEqual((cursor.line_number, cursor.offset), (5, len(''.join(LINES))))
+        self.assertIs(as_line_cursor(cursor), cursor)
+
+    def test_readlines(self):
+        cursor = LineCursor(iter(LINES))
+        self.assertEqual(cursor.readlines(0), [])
+        self.assertEqual(cursor.readlines(2), LINES[:2])
+        # the peeked line is the first one returned
+        self.assertEqual(cursor.peek(), LINES[2])
+        self.assertEqual(cursor.readlines(1), LINES[2:3])
+        self.assertEqual(cursor.peek(), LINES[3])
+        # fewer lines at the end of the input
+        self.assertEqual(cursor.readlines(10), LINES[3:])
+        self.assertEqual((cursor.line_number, cursor.offset), (5, len(''.join(LINES))))
+        self.assertEqual(cursor.peek(), '')
+        self.assertEqual(cursor.readlines(1), [])
+        self.assertEqual(LineCursor([]).readlines(2), [])
+        self.assertEqual(LineCursor([]).peek(), '')
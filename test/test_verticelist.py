@@ -0,0 +1,106 @@
+import io
+import os
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from rwimodeling import default_dtype, get_default_dtype, set_default_dtype, verticelist
+from rwimodeling.errors import FormatError
+from rwimodeling.objects import ObjectFile
+from rwimodeling.txrx import TxRxFile
+from rwimodeling.verticelist import VerticeList
+
+EXAMPLE_DIR=os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'example')
+
+
+class VerticeBufferTest(unittest.TestCase):
+
+    def test_growth(self):
+        vertice_list = VerticeList()
+        expected = []
+        capacities = set()
+        for i in range(300):
+            if i % 3 == 0:
+                vertice_list.add_vertice((i, -i, 0.5 * i))
+                expected.append((i, -i, 0.5 * i))
+            else:
+                block = [(i, j, -j) for j in range(i % 7)]
+                vertice_list.add_vertices(np.array(block).reshape(-1, 3))
+                expected.extend(block)
+            capacities.add(len(vertice_list._vertice_buffer))
+            self.assertEqual(vertice_list.n_vertices, len(expected))
+        # several doublings, each keeping the vertices added before
+        self.assertGreater(len(capacities), 5)
+        self.assertLess(len(capacities), 20)
+        np.testing.assert_array_equal(vertice_list.vertice_array, expected)
+        np.testing.assert_array_equal(vertice_list.bounds,
+                                      [np.min(expected, axis=0), np.max(expected, axis=0)])
+        with self.assertRaises(FormatError):
+            vertice_list.add_vertices([(1, 2)])
+        self.assertEqual(vertice_list.n_vertices, len(expected))
+        vertice_list.clear()
+        self.assertIsNone(vertice_list.vertice_array)
+        self.assertEqual(vertice_list.serialize(), 'nVertices 0\n')
+        vertice_list.add_vertice((1, 2, 3))
+        self.assertEqual(vertice_list.vertice_array.tolist(), [[1, 2, 3]])
+
+
+class IterSerializeTest(unittest.TestCase):
+
+    def test_chunk_boundaries(self):
+        rng = np.random.default_rng(0)
+        with mock.patch.object(verticelist, 'SERIALIZE_CHUNK_SIZE', 4):
+            for n_vertices in (0, 1, 3, 4, 5, 8, 9, 13):
+                vertice_list = VerticeList()
+                if n_vertices > 0:
+                    vertice_list.add_vertices(rng.uniform(-1e3, 1e3, (n_vertices, 3)))
+                chunks = list(vertice_list.iter_serialize())
+                # the nVertices line and one chunk per 4 vertices
+                self.assertEqual(len(chunks), 1 + (n_vertices + 3) // 4)
+                self.assertEqual(''.join(chunks), vertice_list.serialize())
+
+    def test_containers(self):
+        with open(os.path.join(EXAMPLE_DIR, 'model.txrx')) as infile:
+            txrx = TxRxFile.from_file(infile)
+        txrx['Rx'].location_list[0].add_vertices(np.arange(3 * 10.0).reshape(-1, 3))
+        with open(os.path.join(EXAMPLE_DIR, 'car-handmade.object')) as infile:
+            obj = ObjectFile.from_file(infile)
+        with mock.patch.object(verticelist, 'SERIALIZE_CHUNK_SIZE', 3):
+            for entity in (txrx, obj):
+                self.assertEqual(''.join(entity.iter_serialize()), entity.serialize())
+                dst_file = io.StringIO()
+                entity.write_to(dst_file)
+                self.assertEqual(dst_file.getvalue(), entity.serialize())
+
+
+class DefaultDtypeTest(unittest.TestCase):
+
+    def tearDown(self):
+        set_default_dtype(np.float64)
+
+    def test_context_manager(self):
+        self.assertEqual(get_default_dtype(), np.float64)
+        with default_dtype(np.float32):
+            self.assertEqual(VerticeList().vertice_dtype, np.float32)
+            with open(os.path.join(EXAMPLE_DIR, 'car-handmade.object')) as infile:
+                obj = ObjectFile.from_file(infile)
+        self.assertEqual(get_default_dtype(), np.float64)
+        self.assertEqual(VerticeList().vertice_dtype, np.float64)
+        sub_structure = next(iter(obj))['']['']
+        self.assertEqual(sub_structure.face_list[0].vertice_dtype, np.float32)
+
+    def test_restored_after_exception(self):
+        set_default_dtype(np.longdouble)
+        with self.assertRaises(FormatError):
+            with default_dtype('float32'):
+                self.assertEqual(get_default_dtype(), np.float32)
+                ObjectFile.from_file(['begin_<structure_group> g\n', 'end_<object>\n'])
+        self.assertEqual(get_default_dtype(), np.longdouble)
+        # invalid dtypes change nothing
+        with self.assertRaises(ValueError):
+            with default_dtype(np.int32):
+                pass
+        with self.assertRaises(ValueError):
+            set_default_dtype('float16')
+        self.assertEqual(get_default_dtype(), np.longdouble)
@@ -0,0 +1,132 @@
+import io
+import os
+import tempfile
+import unittest
+from xml.parsers import expat
+
+from rwimodeling.objects import ObjectFile, RectangularPrism, Structure, StructureGroup
+from rwimodeling.verticelist import BaseVerticeList
+from rwimodeling.x3dxmlfile import X3dXmlFile, X3dXmlFile3_3, _InsertWriter
+
+TEMPLATE = (
+    '<?xml version="1.0"?>\n'
+    '<remcom::rxapi::Job>\n'
+    '  <Scene><remcom::rxapi::Scene Value="a__b::c">\n'
+    '    <Geometry><remcom::rxapi::Old/></Geometry>\n'
+    '  </remcom::rxapi::Scene></Scene>\n'
+    '</remcom::rxapi::Job>\n'
+)
+
+POINTS_TEMPLATE = (
+    '<?xml version="1.0"?>\r\n'
+    '<X3D>\r\n'
+    '  <Scene><ControlPoints Name="rx"><ProjectedPoint>old</ProjectedPoint></ControlPoints>'
+    '<Other/></Scene>\r\n'
+    '</X3D>\r\n'
+)
+
+
+def read_elements(path):
+    """(name, attributes) of all elements of an XML file, in order"""
+    elements = []
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = lambda name, attributes: elements.append((name, attributes))
+    with open(path, 'rb') as infile:
+        parser.ParseFile(infile)
+    return elements
+
+
+class AddObjectTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.template = os.path.join(self.tmp_dir.name, 'template.xml')
+        with open(self.template, 'w') as outfile:
+            outfile.write(TEMPLATE)
+        structure = Structure(name='car__1')
+        structure.add_sub_structures(RectangularPrism(4, 2, 1, name='body::x'))
+        group = StructureGroup(name='grp__A')
+        group.add_structures(structure)
+        self.obj = ObjectFile('cars.object')
+        self.obj.add_structure_groups(group)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, streaming):
+        path = os.path.join(self.tmp_dir.name, 'out{}.xml'.format(int(streaming)))
+        x3d = X3dXmlFile3_3(self.template, streaming=streaming)
+        x3d._add_object(self.obj, './Scene/remcom__rxapi__Scene/Geometry')
+        x3d.write(path)
+        return path
+
+    def test_names_are_not_mangled(self):
+        outputs = []
+        for streaming in (False, True):
+            elements = read_elements(self.write(streaming))
+            names = [name for name, attributes in elements]
+            values = [attributes['Value'] for name, attributes in elements
+                      if name == 'remcom::rxapi::String']
+            self.assertEqual(values[:3], ['grp__A', 'car__1', 'body::x'])
+            self.assertNotIn('remcom::rxapi::Old', names)
+            self.assertEqual(names.count('remcom::rxapi::Face'), 6)
+            self.assertIn(('remcom::rxapi::Scene', {'Value': 'a__b::c'}), elements)
+            outputs.append(elements)
+        self.assertEqual(outputs[0], outputs[1])
+
+
+class AddVerticeListTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.template = os.path.join(self.tmp_dir.name, 'template.xml')
+        with open(self.template, 'w', newline='') as outfile:
+            outfile.write(POINTS_TEMPLATE)
+        self.vertice_list = BaseVerticeList()
+        self.vertice_list.add_vertices([(1, 2, 3), (-0.5, 1e3, 0.25)])
+        self.vertice_list.vertice_float_precision = 3
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, streaming, clear):
+        path = os.path.join(self.tmp_dir.name, 'out{}{}.xml'.format(int(streaming), int(clear)))
+        x3d = X3dXmlFile(self.template, streaming=streaming)
+        x3d.add_vertice_list(self.vertice_list, './/ControlPoints', clear=clear)
+        x3d.write(path)
+        return path
+
+    def test_add_vertice_list(self):
+        for clear in (True, False):
+            outputs = []
+            for streaming in (False, True):
+                path = self.write(streaming, clear)
+                elements = read_elements(path)
+                values = [attributes['Value'] for name, attributes in elements
+                          if name == 'Double']
+                self.assertEqual(values, ['1.000', '2.000', '3.000',
+                                          '-0.500', '1000.000', '0.250'])
+                names = [name for name, attributes in elements]
+                self.assertEqual(names.count('ProjectedPoint'), 2 if clear else 3)
+                self.assertIn('Other', names)
+                with open(path, 'rb') as infile:
+                    data = infile.read()
+                if streaming:
+                    # the source is copied as is
+                    self.assertIn(b'<X3D>\r\n', data)
+                else:
+                    # the parser normalizes the line endings to '\n', written as is
+                    self.assertNotIn(b'\r', data)
+                outputs.append(elements)
+            self.assertEqual(outputs[0], outputs[1])
+
+    def test_split_marker(self):
+        inserted = {'<!--rwimodeling insert 0-->': lambda: ('<a/>', '<b/>')}
+        data = '<x><!--rwimodeling insert 0--><!--other--></x>'
+        for step in range(1, len(data) + 1):
+            dst_file = io.StringIO()
+            writer = _InsertWriter(dst_file, inserted)
+            for i in range(0, len(data), step):
+                writer.write(data[i:i + step])
+            writer.flush()
+            self.assertEqual(dst_file.getvalue(), '<x><a/><b/><!--other--></x>')